@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django_otp.plugins.otp_totp.models import TOTPDevice
+from .cache import session_auth_cache
 from .models import CustomUser
 
 # Unregister the default TOTPDevice admin if already registered
@@ -22,4 +23,13 @@ admin.site.register(TOTPDevice, CustomTOTPDeviceAdmin)
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ('username', 'email', 'user_type', 'is_active')
     list_filter = ('user_type', 'is_active')
-    search_fields = ('username', 'email')
\ No newline at end of file
+    search_fields = ('username', 'email')
+    actions = ['deactivate_users']
+
+    @admin.action(description='Deactivate selected users')
+    def deactivate_users(self, request, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
+        updated = CustomUser.objects.filter(pk__in=user_ids).update(is_active=False)
+        # update() sends no post_save, so their cached sessions are dropped here
+        session_auth_cache.invalidate_users(user_ids)
+        self.message_user(request, f'{updated} users deactivated.')
\ No newline at end of file
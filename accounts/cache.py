@@ -0,0 +1,95 @@
+import copy
+import uuid
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+
+
+def _entry_key(session_key):
+    return f'auth:session:{session_key}'
+
+
+def _user_generation_key(user_id):
+    return f'auth:generation:user:{user_id}'
+
+
+class SessionAuthCache:
+    """Short-lived cache of the user and verified OTP devices of each session
+
+    Entries are keyed by session key and record the generation token of
+    their user. Saving the user (a password, ``mfa_enabled`` or
+    ``is_active`` change) or one of their OTP devices replaces the token,
+    so their sessions read them from the database again on the next
+    request; logging out drops the session's entry. Anything else expires
+    after ``AUTH_CACHE_TIMEOUT`` seconds, including queryset ``update()``
+    calls, which send no signals; call ``invalidate_users`` after them.
+    """
+
+    def __init__(self, alias='sessions'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, request):
+        """Cached entry of the request's session, or None; read once per request"""
+        if not hasattr(request, '_auth_cache_entry'):
+            request._auth_cache_entry, request._auth_cache_generation = self._read(request)
+        return request._auth_cache_entry
+
+    def _read(self, request):
+        session_key = request.session.session_key
+        user_id = request.session.get(SESSION_KEY)
+        if session_key is None or user_id is None:
+            return None, None
+
+        generation_key = _user_generation_key(user_id)
+        values = self.cache.get_many([_entry_key(session_key), generation_key])
+        generation = values.get(generation_key)
+        if generation is None:
+            self.cache.add(generation_key, uuid.uuid4().hex, timeout=None)
+            generation = self.cache.get(generation_key)
+        entry = values.get(_entry_key(session_key))
+        if entry is None or entry['generation'] != generation or str(entry['user'].pk) != str(user_id):
+            return None, generation
+        return entry, generation
+
+    def set_user(self, request, user):
+        """Cache the user just read from the database for the request's session"""
+        # The generation read before the user was, so a concurrent change isn't masked
+        self.get(request)
+        generation = request._auth_cache_generation
+        if generation is None or not user.is_authenticated:
+            return
+        # A copy, so attributes OTPMiddleware sets on the request's user aren't cached
+        request._auth_cache_entry = {'generation': generation, 'user': copy.copy(user), 'devices': {}}
+        self._write(request)
+
+    def set_device(self, request, persistent_id, device):
+        """Cache the OTP device that verified the request's session"""
+        entry = self.get(request)
+        if entry is None:
+            return
+        entry['devices'][persistent_id] = device
+        self._write(request)
+
+    def _write(self, request):
+        self.cache.set(
+            _entry_key(request.session.session_key), request._auth_cache_entry, settings.AUTH_CACHE_TIMEOUT
+        )
+
+    def invalidate_session(self, session_key):
+        """Drop the cached user and devices of one session, e.g. on logout"""
+        self.cache.delete(_entry_key(session_key))
+
+    def invalidate_user(self, user_id):
+        """Drop the cached user and devices of every session of a user"""
+        self.invalidate_users([user_id])
+
+    def invalidate_users(self, user_ids):
+        """Drop the cached sessions of several users, e.g. after a queryset ``update()``"""
+        self.cache.set_many({_user_generation_key(user_id): uuid.uuid4().hex for user_id in user_ids}, timeout=None)
+
+
+session_auth_cache = SessionAuthCache()
@@ -0,0 +1,72 @@
+import copy
+import functools
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+from django_otp import DEVICE_ID_SESSION_KEY
+from django_otp.middleware import OTPMiddleware, is_verified
+from .cache import session_auth_cache
+
+
+def get_user(request):
+    """The session's user, from the session auth cache when possible"""
+    if not hasattr(request, '_cached_user'):
+        entry = session_auth_cache.get(request)
+        if entry is not None:
+            # A copy per request, since OTPMiddleware sets attributes on it
+            request._cached_user = copy.copy(entry['user'])
+        else:
+            request._cached_user = auth.get_user(request)
+            session_auth_cache.set_user(request, request._cached_user)
+    return request._cached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware that reads the user through the session auth cache"""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+
+
+class CachedOTPMiddleware(OTPMiddleware):
+    """OTPMiddleware that reads the verified device through the session auth cache
+
+    Works in both sync and async stacks; either way the device is only
+    looked up when the view first uses ``request.user``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None:
+            request.user = SimpleLazyObject(functools.partial(self._verify_user, request, user))
+        return await self.get_response(request)
+
+    def _verify_user(self, request, user):
+        persistent_id = request.session.get(DEVICE_ID_SESSION_KEY)
+        if not persistent_id or not user.is_authenticated:
+            return super()._verify_user(request, user)
+
+        entry = session_auth_cache.get(request)
+        if entry is not None and persistent_id in entry['devices']:
+            user.otp_device = entry['devices'][persistent_id]
+            user.is_verified = functools.partial(is_verified, user)
+            return user
+
+        user = super()._verify_user(request, user)
+        if user.otp_device is not None:
+            session_auth_cache.set_device(request, persistent_id, user.otp_device)
+        return user
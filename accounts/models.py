@@ -2,12 +2,15 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 class CustomUser(AbstractUser):
+    PATIENT = 1
+    DOCTOR = 2
+    ADMIN = 3
     USER_TYPE_CHOICES = (
-        (1, 'Patient'),
-        (2, 'Doctor'),
-        (3, 'Admin'),
+        (PATIENT, 'Patient'),
+        (DOCTOR, 'Doctor'),
+        (ADMIN, 'Admin'),
     )
-    user_type = models.PositiveSmallIntegerField(choices=USER_TYPE_CHOICES, default=1)
+    user_type = models.PositiveSmallIntegerField(choices=USER_TYPE_CHOICES, default=PATIENT)
     phone_number = models.CharField(max_length=20, blank=True)
     mfa_enabled = models.BooleanField(default=False)
 
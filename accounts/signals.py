@@ -0,0 +1,34 @@
+from django.apps import apps
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django_otp.models import Device
+from .cache import session_auth_cache
+from .models import CustomUser
+
+
+@receiver(user_logged_out)
+def session_logged_out(sender, request, **kwargs):
+    if request is not None and request.session.session_key:
+        session_auth_cache.invalidate_session(request.session.session_key)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    """Sessions must see new passwords, mfa_enabled and is_active right away"""
+    session_auth_cache.invalidate_user(instance.pk)
+
+
+def otp_device_changed(sender, instance, **kwargs):
+    """A deleted or reconfigured device must stop verifying cached sessions"""
+    if instance.user_id is not None:
+        session_auth_cache.invalidate_user(instance.user_id)
+
+
+# Connected per device model, so saves of other models don't run the receiver;
+# imported from AccountsConfig.ready, once every installed device model is loaded
+for model in apps.get_models():
+    if issubclass(model, Device):
+        post_save.connect(otp_device_changed, sender=model, dispatch_uid=f'otp_device_saved:{model._meta.label}')
+        post_delete.connect(otp_device_changed, sender=model, dispatch_uid=f'otp_device_deleted:{model._meta.label}')
@@ -1,3 +1,79 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import caches
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django_otp import DEVICE_ID_SESSION_KEY
+from django_otp.plugins.otp_totp.models import TOTPDevice
+from .cache import _entry_key, session_auth_cache
+from .models import CustomUser
 
-# Create your tests here.
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'accounts-tests-{alias}'}
+    for alias in settings.CACHES
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SessionAuthCacheTests(TestCase):
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        self.user = CustomUser.objects.create_user('patient', 'patient@example.com', 'old-password')
+        self.client.force_login(self.user)
+        self.session_key = self.client.session.session_key
+        session_auth_cache.set_user(self.request(), self.user)
+        self.assertIsNotNone(self.cached_entry())
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        return request
+
+    def cached_entry(self):
+        return session_auth_cache.get(self.request())
+
+    def test_password_change_drops_the_cached_user(self):
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertIsNone(self.cached_entry())
+
+    def test_deactivation_drops_the_cached_user(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.cached_entry())
+
+    def test_admin_deactivate_action_drops_the_cached_users(self):
+        admin_user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        admin_client = Client()
+        admin_client.force_login(admin_user)
+        # The admin site requires an OTP-verified session
+        session = admin_client.session
+        session[DEVICE_ID_SESSION_KEY] = TOTPDevice.objects.create(user=admin_user, name='phone').persistent_id
+        session.save()
+        response = admin_client.post(reverse('admin:accounts_customuser_changelist'), {
+            'action': 'deactivate_users',
+            '_selected_action': [self.user.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertIsNone(self.cached_entry())
+
+    def test_logout_drops_the_session_entry(self):
+        self.client.logout()
+        self.assertIsNone(caches['sessions'].get(_entry_key(self.session_key)))
+
+    def test_device_delete_drops_the_cached_devices(self):
+        device = TOTPDevice.objects.create(user=self.user, name='phone')
+        request = self.request()
+        session_auth_cache.set_user(request, self.user)
+        session_auth_cache.set_device(request, device.persistent_id, device)
+        self.assertIn(device.persistent_id, self.cached_entry()['devices'])
+
+        device.delete()
+        self.assertIsNone(self.cached_entry())
+
+    def test_changes_of_other_users_keep_the_cached_user(self):
+        other = CustomUser.objects.create_user('other', 'other@example.com', 'password')
+        TOTPDevice.objects.create(user=other, name='phone').delete()
+        self.assertIsNotNone(self.cached_entry())
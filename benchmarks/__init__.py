@@ -0,0 +1,10 @@
+"""Benchmarks for the recommender and the portal views
+
+Run against a throwaway test database filled with seeded synthetic data::
+
+    python -m benchmarks --users 5000 --treatments 500 --conditions 200 --output results.json
+    python -m benchmarks --compare before.json after.json
+
+Each benchmark records wall time, peak traced memory and SQL query count,
+and results are written as JSON tagged with the git commit.
+"""
@@ -0,0 +1,64 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark the recommender and portal views')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--treatments', type=int, default=200)
+    parser.add_argument('--conditions', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample', type=int, default=50, help='Users sampled for per-user benchmarks')
+    parser.add_argument('--suite', action='append', dest='suites', help='Suite to run (repeatable, default all)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced peak-memory pass')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two result files and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        from .harness import compare
+        print(compare(*args.compare))
+        return 0
+
+    # Keep benchmark models away from the real model directory
+    model_dir = tempfile.mkdtemp(prefix='recommender-bench-')
+    os.environ['RECOMMENDER_MODEL_DIR'] = model_dir
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthcareportal.settings')
+    import django
+    django.setup()
+    # WhiteNoise warns about the missing collectstatic directory
+    warnings.filterwarnings('ignore', message='No directory at')
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import override_settings
+    from . import synthetic, suites
+    from .harness import format_results, write_results
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        # Plain static storage: no collectstatic manifest in a throwaway environment
+        with override_settings(
+            DEBUG=False,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+        ):
+            dataset = synthetic.generate(args.users, args.treatments, args.conditions, args.seed)
+            results = suites.run(args.suites, sample_size=args.sample, seed=args.seed, memory=not args.no_memory)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    print(format_results(results))
+    if args.output:
+        write_results(args.output, vars(args), dataset, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
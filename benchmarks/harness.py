@@ -0,0 +1,113 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def measure(name, func, calls=1, setup=None, memory=True):
+    """Run ``func`` ``calls`` times and record wall time, peak memory and SQL queries
+
+    ``setup(i)`` runs right before call ``i``, outside the timed section, and
+    returns its arguments. Timings come from a pass without tracemalloc,
+    since tracing slows Python code down considerably; peak memory comes
+    from one extra traced call.
+    """
+    durations = []
+    queries = 0
+    for i in range(calls):
+        args = setup(i) if setup else ()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            func(*args)
+            durations.append(time.perf_counter() - started)
+        queries += len(captured)
+
+    peak_memory = None
+    if memory:
+        args = setup(0) if setup else ()
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'name': name,
+        'calls': calls,
+        'wall_time_total': sum(durations),
+        'wall_time_mean': statistics.mean(durations),
+        'wall_time_median': statistics.median(durations),
+        'wall_time_max': max(durations),
+        'peak_memory_bytes': peak_memory,
+        'queries_total': queries,
+        'queries_per_call': queries / calls,
+    }
+
+
+def git_commit():
+    """Commit of the working tree being benchmarked, if available"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, parameters, dataset, results):
+    """Write one run as JSON"""
+    document = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': parameters,
+        'dataset': dataset,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    return document
+
+
+def format_results(results):
+    """Human-readable table of results"""
+    lines = [f"{'benchmark':<36} {'calls':>5} {'mean ms':>10} {'max ms':>10} {'peak MB':>8} {'queries':>8}"]
+    for result in results:
+        peak = result['peak_memory_bytes']
+        lines.append(
+            f"{result['name']:<36} {result['calls']:>5} "
+            f"{result['wall_time_mean'] * 1000:>10.2f} {result['wall_time_max'] * 1000:>10.2f} "
+            f"{(peak / 2 ** 20 if peak is not None else float('nan')):>8.1f} {result['queries_per_call']:>8.1f}"
+        )
+    return '\n'.join(lines)
+
+
+def compare(before_path, after_path):
+    """Side-by-side mean wall time and query counts of two result files"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    lines = [
+        f"{before.get('commit')} -> {after.get('commit')}",
+        f"{'benchmark':<36} {'before ms':>10} {'after ms':>10} {'speedup':>8} {'queries':>15}",
+    ]
+    old = {result['name']: result for result in before['results']}
+    for result in after['results']:
+        previous = old.get(result['name'])
+        if previous is None:
+            continue
+        speedup = previous['wall_time_mean'] / result['wall_time_mean'] if result['wall_time_mean'] else float('inf')
+        lines.append(
+            f"{result['name']:<36} {previous['wall_time_mean'] * 1000:>10.2f} "
+            f"{result['wall_time_mean'] * 1000:>10.2f} {speedup:>7.2f}x "
+            f"{previous['queries_per_call']:>7.1f} -> {result['queries_per_call']:<5.1f}"
+        )
+    return '\n'.join(lines)
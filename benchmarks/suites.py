@@ -0,0 +1,169 @@
+import random
+from django.core.cache import caches
+from django.template import Engine, RequestContext, engines
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+from accounts.models import CustomUser
+from portal.bitset import METRICS
+from portal.candidates import candidate_index
+from portal.forms import UserHealthForm
+from portal.models import UserHealth
+from portal.services import get_recommender
+from .harness import measure
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f'GET {url} returned {response.status_code}')
+    return response
+
+
+def recommender_benchmarks(sample, memory=True):
+    """Feature preparation, training and per-user recommendation"""
+    recommender = get_recommender()
+
+    return [
+        measure('recommender._prepare_data', recommender._prepare_data, memory=memory),
+        measure('recommender.train', recommender.train, memory=memory),
+        measure(
+            'recommender.get_recommendations',
+            recommender.get_recommendations,
+            calls=len(sample),
+            setup=lambda i: (sample[i],),
+            memory=memory,
+        ),
+    ]
+
+
+def kernel_benchmarks(sample, memory=True):
+    """Scoring kernels: fitted similarity rows of candidate treatments vs condition bitsets of all treatments"""
+    recommender = get_recommender()
+    if recommender.similarity_matrix is None:
+        recommender.train()
+    conditions = {user_id: recommender._user_conditions(user_id) for user_id in sample}
+    bitsets = candidate_index.bitsets()
+
+    def model_kernel(user_id):
+        candidates, columns = recommender._candidates(conditions[user_id])
+        return candidates, recommender._user_scores(user_id, columns)
+
+    results = [
+        measure('kernel.model', model_kernel, calls=len(sample), setup=lambda i: (sample[i],), memory=memory),
+    ]
+    for metric in METRICS:
+        results.append(measure(
+            f'kernel.bitset.{metric}', bitsets.match,
+            calls=len(sample), setup=lambda i, metric=metric: (conditions[sample[i]], metric), memory=memory,
+        ))
+    for kernel in ('model', 'bitset'):
+        with override_settings(RECOMMENDER_SCORING_KERNEL=kernel):
+            results.append(measure(
+                f'kernel.get_recommendations.{kernel}', recommender.get_recommendations,
+                calls=len(sample), setup=lambda i: (sample[i],), memory=memory,
+            ))
+    return results
+
+
+def view_benchmarks(sample, memory=True):
+    """Portal views through the test client, logged in as sampled users"""
+    client = Client()
+    users = CustomUser.objects.in_bulk(sample)
+    recommendation_cache = caches['recommendations']
+
+    def as_user(url, cache=None):
+        def setup(i):
+            client.force_login(users[sample[i]])
+            if cache == 'cold':
+                recommendation_cache.clear()
+            elif cache == 'warm':
+                _get(client, url)
+            return (client, url)
+        return setup
+
+    dashboard = reverse('portal_dashboard')
+    api = reverse('api_recommendations')
+    return [
+        measure('view.dashboard', _get, calls=len(sample), setup=as_user(dashboard), memory=memory),
+        measure('view.api_recommendations.cold', _get, calls=len(sample), setup=as_user(api, cache='cold'), memory=memory),
+        measure('view.api_recommendations.warm', _get, calls=len(sample), setup=as_user(api, cache='warm'), memory=memory),
+    ]
+
+
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def _template_engine(cached):
+    """The project's template engine, with or without the cached loader"""
+    engine = engines['django'].engine
+    return Engine(
+        dirs=engine.dirs,
+        context_processors=engine.context_processors,
+        libraries=engine.libraries,
+        loaders=[('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)] if cached else TEMPLATE_LOADERS,
+    )
+
+
+def template_benchmarks(sample, memory=True):
+    """Portal page rendering with templates parsed on every render or cached, and with cold fragments"""
+    factory = RequestFactory()
+    users = CustomUser.objects.in_bulk(sample)
+    fragment_cache = caches['template_fragments']
+    recommender = get_recommender()
+    pages = {
+        'recommendations': lambda user: {'recommendations': recommender.get_recommendations(user.id, top_n=10)},
+        'health_profile': lambda user: {'form': UserHealthForm(instance=UserHealth.objects.get(user=user))},
+    }
+
+    def render(engine, name, request, context):
+        return engine.get_template(f'portal/{name}.html').render(RequestContext(request, context))
+
+    def page(engine, name, fragments='warm'):
+        def setup(i):
+            request = factory.get('/')
+            request.user = users[sample[i]]
+            context = pages[name](request.user)
+            if fragments == 'cold':
+                fragment_cache.clear()
+            else:
+                render(engine, name, request, context)
+            return (engine, name, request, context)
+        return setup
+
+    uncached, cached = _template_engine(cached=False), _template_engine(cached=True)
+    results = []
+    for name in pages:
+        results.extend([
+            measure(f'template.{name}.reparsed', render, calls=len(sample), setup=page(uncached, name), memory=memory),
+            measure(f'template.{name}.cached', render, calls=len(sample), setup=page(cached, name), memory=memory),
+        ])
+    results.append(measure(
+        'template.health_profile.cold', render,
+        calls=len(sample), setup=page(cached, 'health_profile', fragments='cold'), memory=memory,
+    ))
+    return results
+
+
+SUITES = {
+    'recommender': recommender_benchmarks,
+    'kernels': kernel_benchmarks,
+    'views': view_benchmarks,
+    'templates': template_benchmarks,
+}
+
+
+def run(suites=None, sample_size=50, seed=0, memory=True):
+    """Run the named suites (all by default) against a sample of users with conditions"""
+    user_ids = sorted(
+        UserHealth.objects.filter(conditions__isnull=False).distinct().values_list('user_id', flat=True)
+    )
+    sample = random.Random(seed).sample(user_ids, min(sample_size, len(user_ids)))
+
+    results = []
+    for name in suites or SUITES:
+        results.extend(SUITES[name](sample, memory=memory))
+    return results
@@ -0,0 +1,111 @@
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from accounts.models import CustomUser
+from portal.models import MedicalCondition, Treatment, UserHealth
+
+# Share of users with 0, 1, 2, ... conditions
+USER_CONDITION_COUNTS = (0.25, 0.35, 0.22, 0.10, 0.05, 0.03)
+# Share of treatments indicated for 1, 2, 3, 4 conditions
+TREATMENT_CONDITION_COUNTS = (0.45, 0.30, 0.17, 0.08)
+
+BATCH_SIZE = 2000
+
+
+def _sample_conditions(rng, condition_ids, popularity, counts, size, min_conditions=0):
+    """Draw a condition set per row, popular conditions more often
+
+    ``counts[k]`` is the share of rows with ``min_conditions + k`` conditions.
+    """
+    sizes = rng.choice(len(counts), size=size, p=counts) + min_conditions
+    return [
+        rng.choice(condition_ids, size=min(k, len(condition_ids)), replace=False, p=popularity)
+        for k in sizes
+    ]
+
+
+def generate(users=1000, treatments=200, conditions=100, seed=0):
+    """Fill the database with a reproducible synthetic population
+
+    Condition popularity follows a Zipf-like curve, so a few conditions are
+    very common and most are rare, and most patients have 0-3 conditions.
+    """
+    rng = np.random.default_rng(seed)
+
+    MedicalCondition.objects.bulk_create(
+        [MedicalCondition(name=f'Condition {i}', description=f'Synthetic condition {i}') for i in range(conditions)],
+        batch_size=BATCH_SIZE,
+    )
+    condition_ids = np.array(MedicalCondition.objects.order_by('id').values_list('id', flat=True))
+    popularity = 1.0 / np.arange(1, conditions + 1)
+    popularity /= popularity.sum()
+
+    Treatment.objects.bulk_create(
+        [
+            Treatment(
+                name=f'Treatment {i}',
+                description=f'Synthetic treatment {i} ' + 'lorem ipsum ' * 10,
+                effectiveness_score=float(rng.uniform(0.1, 1.0)),
+            )
+            for i in range(treatments)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    treatment_ids = Treatment.objects.order_by('id').values_list('id', flat=True)
+    treatment_conditions = _sample_conditions(
+        rng, condition_ids, popularity, TREATMENT_CONDITION_COUNTS, treatments, min_conditions=1
+    )
+    Treatment.conditions.through.objects.bulk_create(
+        [
+            Treatment.conditions.through(treatment_id=treatment_id, medicalcondition_id=int(condition_id))
+            for treatment_id, condition_set in zip(treatment_ids, treatment_conditions)
+            for condition_id in condition_set
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    password = make_password(None)
+    CustomUser.objects.bulk_create(
+        [
+            CustomUser(username=f'patient{i}', email=f'patient{i}@example.com', password=password)
+            for i in range(users)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(CustomUser.objects.order_by('id').values_list('id', flat=True))
+
+    # Roughly 5% of profiles leave each measurement empty
+    ages = rng.integers(18, 90, size=users)
+    heights = rng.normal(170, 10, size=users).round(1)
+    weights = rng.normal(75, 15, size=users).round(1)
+    missing = rng.random((users, 3)) < 0.05
+    UserHealth.objects.bulk_create(
+        [
+            UserHealth(
+                user_id=user_id,
+                age=None if missing[i, 0] else int(ages[i]),
+                height=None if missing[i, 1] else float(heights[i]),
+                weight=None if missing[i, 2] else float(weights[i]),
+            )
+            for i, user_id in enumerate(user_ids)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    profile_ids = dict(UserHealth.objects.values_list('user_id', 'id'))
+    user_conditions = _sample_conditions(rng, condition_ids, popularity, USER_CONDITION_COUNTS, users)
+    UserHealth.conditions.through.objects.bulk_create(
+        [
+            UserHealth.conditions.through(userhealth_id=profile_ids[user_id], medicalcondition_id=int(condition_id))
+            for user_id, condition_set in zip(user_ids, user_conditions)
+            for condition_id in condition_set
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    return {
+        'users': users,
+        'treatments': treatments,
+        'conditions': conditions,
+        'seed': seed,
+        'user_condition_links': sum(len(c) for c in user_conditions),
+        'treatment_condition_links': sum(len(c) for c in treatment_conditions),
+    }
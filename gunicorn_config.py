@@ -1,10 +1,57 @@
 # Gunicorn configuration for Render deployment
 import multiprocessing
+import os
+
+# Application: WSGI on gthread workers by default. Set ASGI=true to serve the
+# ASGI application on uvicorn workers, where the async views (/portal/async/...)
+# run on the event loop and scoring runs in a bounded thread pool.
+if os.environ.get('ASGI', 'False').lower() == 'true':
+    wsgi_app = 'healthcareportal.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'healthcareportal.wsgi:application'
+    worker_class = 'gthread'  # Use threads for better memory efficiency
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def _memory_mb():
+    """Memory available to the service: the cgroup limit if there is one, else physical memory"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a huge number
+        if limit.isdigit() and int(limit) < 2 ** 50:
+            return int(limit) // 2 ** 20
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2 ** 20
+
 
 # Worker configuration
-workers = 1  # Use only 1 worker on free tier
-threads = 2  # Use 2 threads per worker
-worker_class = 'gthread'  # Use threads for better memory efficiency
+# Workers default to 2 x cores + 1, capped by what fits in WEB_MEMORY_MB (the
+# cgroup limit by default) after RESERVED_MEMORY_MB for the master and the
+# recommender worker, at WORKER_MEMORY_MB per worker. WEB_CONCURRENCY overrides.
+cores = _cpu_count()
+memory_mb = int(os.environ.get('WEB_MEMORY_MB', _memory_mb()))
+reserved_memory_mb = int(os.environ.get('RESERVED_MEMORY_MB', 200))
+worker_memory_mb = int(os.environ.get('WORKER_MEMORY_MB', 160))
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY',
+    max(1, min(2 * cores + 1, (memory_mb - reserved_memory_mb) // worker_memory_mb)),
+))
+# Threads make up for workers the memory budget doesn't allow (gthread only)
+threads = int(os.environ.get('GUNICORN_THREADS', min(8, max(2, (2 * cores + 1) // workers))))
+
+# Load the application, and the recommender model, in the master before forking
+# so workers share their pages copy-on-write instead of each loading a copy.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() == 'true'
 
 # Timeout configuration
 timeout = 120  # Increase timeout to 120 seconds
@@ -13,8 +60,35 @@ graceful_timeout = 20
 # Memory optimization
 max_requests = 1000
 max_requests_jitter = 50
+# Heartbeat files in memory rather than on a possibly slow container disk
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
 
 # Logging
 loglevel = 'info'
 accesslog = '-'
-errorlog = '-'
\ No newline at end of file
+errorlog = '-'
+
+
+def when_ready(server):
+    """Load the recommender in the master, once, before any worker is forked"""
+    if not preload_app:
+        return
+    from django.db import connections
+    from portal.services import get_recommender
+
+    recommender = get_recommender()
+    server.log.info('Recommender preloaded (model version %s)', recommender.version)
+    # Workers must not share the master's database sockets
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    """Reset state that must not be carried over from the master"""
+    if not preload_app:
+        return
+    from django.db import connections
+    from portal import metrics
+
+    # The master closed its connections before forking; make sure none survive
+    connections.close_all()
+    metrics.registry.after_fork()
\ No newline at end of file
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 import dj_database_url
 from dotenv import load_dotenv
@@ -59,6 +60,7 @@ INSTALLED_APPS = [
     'django_otp',
     'django_otp.plugins.otp_totp',
     'crispy_forms',
+    'crispy_bootstrap4',
 
     # Local apps
     'accounts.apps.AccountsConfig',
@@ -66,16 +68,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'portal.middleware.MetricsMiddleware',  # First, so it times the whole stack
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add WhiteNoise for static files
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.CachedAuthenticationMiddleware',  # Reads the user through the sessions cache
     'allauth.account.middleware.AccountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django_otp.middleware.OTPMiddleware',
+    'accounts.middleware.CachedOTPMiddleware',  # Reads the OTP device through the sessions cache
 ]
 
 ROOT_URLCONF = 'healthcareportal.urls'
@@ -91,6 +94,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'portal.context_processors.fragment_cache',
             ],
         },
     },
@@ -103,10 +107,16 @@ WSGI_APPLICATION = 'healthcareportal.wsgi.application'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 # Use SQLite for local development, PostgreSQL for production
+# Each worker thread keeps its connection open for DB_CONN_MAX_AGE seconds and
+# checks it before reuse. Under ASGI, Django advises against persistent connections.
+ASGI = os.environ.get('ASGI', 'False').lower() == 'true'
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '0' if ASGI else '600'))
 if os.environ.get('DATABASE_URL'):
     DATABASES = {
         'default': dj_database_url.config(
-            default=os.environ.get('DATABASE_URL')
+            default=os.environ.get('DATABASE_URL'),
+            conn_max_age=DB_CONN_MAX_AGE,
+            conn_health_checks=True,
         )
     }
 else:
@@ -118,6 +128,69 @@ else:
     }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Invalidations must reach every gunicorn worker and the recommender worker,
+# so the shared caches default to files in the system temp dir, which is enough
+# for one machine; point the *_CACHE_BACKEND/*_CACHE_LOCATION settings at a
+# shared cache server when running on several. locmem is per process.
+
+CACHE_DIR = Path(os.environ.get('CACHE_DIR', Path(tempfile.gettempdir()) / 'healthcareportal-cache'))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', str(CACHE_DIR / 'default')),
+    },
+    # Ranked recommendations and the catalog and user generations that key them
+    # and the recommendation ETags
+    'recommendations': {
+        'BACKEND': os.environ.get('RECOMMENDATION_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('RECOMMENDATION_CACHE_LOCATION', str(CACHE_DIR / 'recommendations')),
+        'TIMEOUT': int(os.environ.get('RECOMMENDATION_CACHE_TIMEOUT', 15 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RECOMMENDATION_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # Sessions (in the cache and cached_db modes) and the per-session cache of the
+    # user and OTP device. Workers must share it, so it defaults to files in the
+    # system temp dir; use a shared server cache across machines.
+    'sessions': {
+        'BACKEND': os.environ.get('SESSION_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', str(Path(tempfile.gettempdir()) / 'healthcareportal-sessions')),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # Rendered {% cache %} fragments of portal templates. Catalog-derived fragments
+    # are keyed by the catalog generation kept in the shared recommendations cache,
+    # so every process replaces them when a treatment or medical condition changes
+    # and the fragments themselves can stay per process.
+    'template_fragments': {
+        'BACKEND': os.environ.get('TEMPLATE_FRAGMENT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('TEMPLATE_FRAGMENT_CACHE_LOCATION', 'template_fragments'),
+        'TIMEOUT': int(os.environ.get('TEMPLATE_FRAGMENT_CACHE_TIMEOUT', 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('TEMPLATE_FRAGMENT_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+# Sessions: 'db' (database only), 'cached_db' (read through the sessions cache,
+# written to the database as well) or 'cache' (sessions cache only; sessions are
+# lost when it is cleared)
+SESSION_STORE = os.environ.get('SESSION_STORE', 'cached_db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_STORE}'
+SESSION_CACHE_ALIAS = 'sessions'
+# Seconds the user and OTP device of a session are cached; user, device and
+# logout changes apply immediately. Queryset update()s send no signals, so
+# call session_auth_cache.invalidate_users after them (the user admin's
+# deactivate action does) or sessions keep the old user this long. 0 disables
+# the cache.
+AUTH_CACHE_TIMEOUT = int(os.environ.get('AUTH_CACHE_TIMEOUT', '60'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -219,14 +292,52 @@ OTP_TOTP_ISSUER = "Healthcare Portal"
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
 # Crispy Forms
+CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap4'
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
-# Memory optimization for Render
+# Recommender system
+# Trained models are written as versioned directories under this path and
+# memory-mapped by every worker.
+RECOMMENDER_MODEL_DIR = Path(os.environ.get('RECOMMENDER_MODEL_DIR', BASE_DIR / 'portal' / 'models'))
+# Profile edits rescore only the edited user; a full refit runs once this
+# share of users has been rescored incrementally, or the model is this old.
+RECOMMENDER_MAX_DRIFT = float(os.environ.get('RECOMMENDER_MAX_DRIFT', '0.1'))
+RECOMMENDER_REFIT_INTERVAL = int(os.environ.get('RECOMMENDER_REFIT_INTERVAL', 24 * 60 * 60))
+# Users read and fitted per chunk during training, which bounds its memory use
+RECOMMENDER_TRAINING_CHUNK_SIZE = int(os.environ.get('RECOMMENDER_TRAINING_CHUNK_SIZE', '5000'))
+# Memory for scoring one block of users against all treatments during training;
+# the similarity matrix itself is written to disk block by block.
+RECOMMENDER_TRAINING_MEMORY_MB = int(os.environ.get('RECOMMENDER_TRAINING_MEMORY_MB', '64'))
+# Training runs in `manage.py recommender_worker`; a queued job waits until no
+# new request has arrived for this many seconds, so bursts collapse into one run.
+RECOMMENDER_TRAINING_DEBOUNCE = float(os.environ.get('RECOMMENDER_TRAINING_DEBOUNCE', '5'))
+# Threads per process that run scoring for the async views; further requests
+# wait for a free thread without blocking the event loop.
+RECOMMENDER_EXECUTOR_WORKERS = int(os.environ.get('RECOMMENDER_EXECUTOR_WORKERS', '2'))
+# Cohort mode: users with the same conditions and similar age, height and weight
+# (one of this many k-means clusters) share one score row. Applies from the next
+# full training run.
+RECOMMENDER_COHORTS = os.environ.get('RECOMMENDER_COHORTS', 'False') == 'True'
+RECOMMENDER_COHORT_CLUSTERS = int(os.environ.get('RECOMMENDER_COHORT_CLUSTERS', '16'))
+# Scores of get_recommendations: 'model' ranks treatments sharing a condition by
+# the fitted similarity of user and treatment features; 'bitset' ranks them by
+# condition overlap alone (RECOMMENDER_BITSET_METRIC: overlap, jaccard or cosine),
+# computed on packed condition bitsets without a fitted model.
+RECOMMENDER_SCORING_KERNEL = os.environ.get('RECOMMENDER_SCORING_KERNEL', 'model')
+RECOMMENDER_BITSET_METRIC = os.environ.get('RECOMMENDER_BITSET_METRIC', 'jaccard')
+
+# Request metrics
+# Every process writes its metrics to a file in this directory (at most once per
+# flush interval); /metrics sums them, so it must be shared by all workers.
+METRICS_DIR = Path(os.environ.get('METRICS_DIR', Path(tempfile.gettempdir()) / 'healthcareportal-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+
+# Production: parse each template once per process instead of on every render
 if not DEBUG:
-    # Disable persistent connections in production
-    DATABASES['default']['CONN_MAX_AGE'] = 0
-    
-    # Reduce template caching
-    TEMPLATES[0]['APP_DIRS'] = True
-    if 'loaders' in TEMPLATES[0]['OPTIONS']:
-        del TEMPLATES[0]['OPTIONS']['loaders']
+    TEMPLATES[0]['APP_DIRS'] = False  # Replaced by the app_directories loader below
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
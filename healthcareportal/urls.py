@@ -20,6 +20,7 @@ from django.views.generic.base import TemplateView
 from django_otp.admin import OTPAdminSite
 from django.conf import settings
 from django.conf.urls.static import static
+from portal.views import metrics_view
 
 # Enable OTP for admin
 admin.site.__class__ = OTPAdminSite
@@ -29,6 +30,7 @@ urlpatterns = [
     path('accounts/', include('allauth.urls')),
     path('accounts/', include('accounts.urls')),
     path('portal/', include('portal.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', TemplateView.as_view(template_name='home.html'), name='home'),
 ]
 
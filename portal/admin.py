@@ -1,5 +1,57 @@
 from django.contrib import admin
-from .models import MedicalCondition, Treatment, UserHealth, Recommendation
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .jobs import enqueue_rescores, enqueue_training
+from .models import MedicalCondition, Treatment, UserHealth, Recommendation, TrainingJob
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses PostgreSQL's row estimate for large unfiltered tables
+
+    An exact COUNT(*) reads the whole table, which takes too long on tables
+    that grow with the user base. Filtered lists, small tables and other
+    databases are counted exactly.
+    """
+    # Tables estimated to have fewer rows are counted exactly
+    estimate_above = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row is not None and row[0] > self.estimate_above:
+                return int(row[0])
+        return super().count
+
+def _queue_rescores(modeladmin, request, user_ids):
+    """Queue rescores for the recommender worker instead of scoring in the request"""
+    queued = enqueue_rescores(user_ids)
+    if queued is None:
+        modeladmin.message_user(request, 'Too many users selected to rescore one by one; queued a full retrain.')
+    else:
+        modeladmin.message_user(request, f'Queued recommendation recomputes for {queued} users.')
+
+@admin.action(description='Recompute recommendations for selected users')
+def recompute_user_recommendations(modeladmin, request, queryset):
+    _queue_rescores(modeladmin, request, queryset.values_list('user_id', flat=True).iterator())
+
+@admin.action(description='Recompute recommendations for the users of selected recommendations')
+def recompute_recommendation_users(modeladmin, request, queryset):
+    user_ids = queryset.order_by().values_list('user_id', flat=True).distinct()
+    _queue_rescores(modeladmin, request, user_ids.iterator())
+
+@admin.action(description='Update recommendations for selected treatments')
+def update_treatment_recommendations(modeladmin, request, queryset):
+    treatment_ids = list(queryset.values_list('pk', flat=True))
+    for treatment_id in treatment_ids:
+        enqueue_training(treatment_id=treatment_id)
+    modeladmin.message_user(request, f'Queued recommendation updates for {len(treatment_ids)} treatments.')
 
 @admin.register(MedicalCondition)
 class MedicalConditionAdmin(admin.ModelAdmin):
@@ -12,6 +64,7 @@ class TreatmentAdmin(admin.ModelAdmin):
     list_filter = ('conditions',)
     search_fields = ('name', 'description')
     filter_horizontal = ('conditions',)
+    actions = [update_treatment_recommendations]
 
 @admin.register(UserHealth)
 class UserHealthAdmin(admin.ModelAdmin):
@@ -19,6 +72,12 @@ class UserHealthAdmin(admin.ModelAdmin):
     list_filter = ('conditions',)
     search_fields = ('user__username', 'user__email')
     filter_horizontal = ('conditions',)
+    # One joined query per page, and no select of every user on the change form
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [recompute_user_recommendations]
 
 @admin.register(Recommendation)
 class RecommendationAdmin(admin.ModelAdmin):
@@ -26,3 +85,19 @@ class RecommendationAdmin(admin.ModelAdmin):
     list_filter = ('condition', 'created_at')
     search_fields = ('user__username', 'treatment__name', 'condition__name')
     readonly_fields = ('score', 'created_at')
+    list_select_related = ('user', 'treatment', 'condition')
+    raw_id_fields = ('user', 'treatment', 'condition')
+    # The model's score ordering would sort the whole table for every page
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [recompute_recommendation_users]
+
+@admin.register(TrainingJob)
+class TrainingJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'user', 'treatment', 'status', 'request_count', 'requested_at', 'duration')
+    list_filter = ('kind', 'status')
+    search_fields = ('user__username', 'treatment__name')
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'duration', 'error')
+    list_select_related = ('user', 'treatment')
+    raw_id_fields = ('user', 'treatment')
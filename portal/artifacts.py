@@ -0,0 +1,259 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+import joblib
+import numpy as np
+from scipy import sparse
+
+MANIFEST = 'manifest.json'
+CURRENT = 'CURRENT'
+OVERRIDES = 'overrides.log'
+# User id and row width in front of each override row
+OVERRIDE_HEADER = struct.Struct('<qI')
+# Reserved size of .npy headers written before the row count is known
+NPY_HEADER_SIZE = 128
+
+
+def _write_atomic(path, write):
+    """Write a file next to ``path`` and rename it into place"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _override_record(user_id, row):
+    row = np.ascontiguousarray(row, dtype='<f8')
+    return OVERRIDE_HEADER.pack(user_id, len(row)) + row.tobytes()
+
+
+def _save_overrides(f, overrides):
+    """Write override rows, one record per user"""
+    for user_id, row in overrides.items():
+        f.write(_override_record(user_id, row))
+
+
+def _parse_overrides(data):
+    """Override rows of the complete records in ``data``, and the bytes they take"""
+    rows = {}
+    offset = 0
+    while offset + OVERRIDE_HEADER.size <= len(data):
+        user_id, width = OVERRIDE_HEADER.unpack_from(data, offset)
+        end = offset + OVERRIDE_HEADER.size + 8 * width
+        if end > len(data):
+            # A record still being appended
+            break
+        rows[user_id] = np.frombuffer(data, dtype='<f8', count=width, offset=offset + OVERRIDE_HEADER.size)
+        offset = end
+    return rows, offset
+
+
+def _npy_header(shape, dtype):
+    """A version 1.0 .npy header padded to NPY_HEADER_SIZE bytes"""
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+    # Magic string and version (8 bytes) and header length (2), then the header ending in a newline
+    header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+    return np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class ArrayWriter:
+    """Appends blocks of rows to an .npy file whose row count is only known at the end
+
+    Only the block being written is in memory; the finished array is
+    memory-mapped, and ``ModelStore.publish`` hard-links it into the version.
+    """
+
+    def __init__(self, path, row_shape=(), dtype=np.float64):
+        self.path = Path(path)
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.file = open(self.path, 'wb')
+        self.file.write(b'\0' * NPY_HEADER_SIZE)
+
+    def append(self, block):
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if block.shape[1:] != self.row_shape:
+            raise ValueError(f'Rows of shape {block.shape[1:]} do not match {self.row_shape}')
+        block.tofile(self.file)
+        self.rows += len(block)
+
+    def finish(self):
+        """Write the header and return the array, memory-mapped"""
+        self.file.seek(0)
+        self.file.write(_npy_header((self.rows,) + self.row_shape, self.dtype))
+        self.file.close()
+        return np.load(self.path, mmap_mode='r')
+
+    def discard(self):
+        """Remove the file (a published copy is a separate hard link)"""
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ModelStore:
+    """Versioned on-disk recommender artifacts
+
+    Each training run is written to its own ``versions/<version>`` directory
+    (built under a temporary name and renamed into place) with a manifest,
+    and then published by atomically replacing the ``CURRENT`` pointer.
+    Readers therefore never see a half-written model, and a version that
+    is in use is never modified, apart from its overrides log: rows of
+    users rescored since the fit are appended to it, so readers only read
+    what is new, and it is only replaced (atomically) to compact it.
+
+    Arrays are stored as ``.npy`` and loaded with ``mmap_mode='r'``, so every
+    worker process maps the same page cache instead of holding its own copy.
+    A version derived from another one (e.g. after a catalog edit) hard-links
+    the memory-mapped arrays it reuses instead of copying them.
+    """
+
+    def __init__(self, root, keep=3):
+        self.root = Path(root)
+        self.versions = self.root / 'versions'
+        self.keep = keep
+
+    def current_version(self):
+        """Name of the published version, or None"""
+        try:
+            return (self.root / CURRENT).read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def signature(self, version=None):
+        """Cheap fingerprints of the published model and of the overrides of ``version``
+
+        The first changes whenever a new model is published, the second
+        whenever override rows are appended or compacted.
+        """
+        try:
+            published = os.stat(self.root / CURRENT).st_mtime_ns
+        except FileNotFoundError:
+            published = None
+        overrides = None
+        if version:
+            try:
+                stat = os.stat(self.versions / version / OVERRIDES)
+                overrides = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return published, overrides
+
+    def publish(self, arrays, scaler, treatment_features, manifest, overrides=None):
+        """Write a new version and make it current, returning its name"""
+        self.versions.mkdir(parents=True, exist_ok=True)
+        # Names sort in publication order
+        version = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f') + '-' + uuid.uuid4().hex[:6]
+        staging = Path(tempfile.mkdtemp(dir=self.versions, prefix='.staging-'))
+
+        try:
+            for name, array in arrays.items():
+                if isinstance(array, np.memmap):
+                    _link_or_copy(array.filename, staging / f'{name}.npy')
+                else:
+                    np.save(staging / f'{name}.npy', array)
+            joblib.dump(scaler, staging / 'scaler.joblib')
+            sparse.save_npz(staging / 'treatment_features.npz', treatment_features)
+            if overrides:
+                with open(staging / OVERRIDES, 'wb') as f:
+                    _save_overrides(f, overrides)
+            manifest = dict(manifest, version=version, arrays=sorted(arrays))
+            (staging / MANIFEST).write_text(json.dumps(manifest, indent=2))
+            os.rename(staging, self.versions / version)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        _write_atomic(self.root / CURRENT, lambda f: f.write(version.encode()))
+        self._prune(version)
+        return version
+
+    def array_writer(self, row_shape=(), dtype=np.float64):
+        """Writer of an array built block by block, on the same filesystem as the versions"""
+        self.versions.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.versions, prefix='.scratch-', suffix='.npy')
+        os.close(fd)
+        return ArrayWriter(path, row_shape, dtype)
+
+    def load(self, version=None):
+        """Load a version (the current one by default), or None if there is none"""
+        version = version or self.current_version()
+        if version is None:
+            return None
+
+        path = self.versions / version
+        manifest = json.loads((path / MANIFEST).read_text())
+        return {
+            'manifest': manifest,
+            'arrays': {name: np.load(path / f'{name}.npy', mmap_mode='r') for name in manifest['arrays']},
+            'scaler': joblib.load(path / 'scaler.joblib'),
+            'treatment_features': sparse.load_npz(path / 'treatment_features.npz'),
+        }
+
+    def load_overrides(self, version, position=None):
+        """Per-user score rows written since ``version`` was trained
+
+        Returns the rows appended after ``position`` (a value returned by
+        an earlier call), the position to pass next time, and whether the
+        rows are all of them rather than an addition to the earlier ones,
+        which is the case on the first call and after a compaction.
+        """
+        try:
+            with open(self.versions / version / OVERRIDES, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                complete = position is None or position[0] != inode
+                offset = 0 if complete else position[1]
+                f.seek(offset)
+                rows, size = _parse_overrides(f.read())
+        except FileNotFoundError:
+            return {}, None, True
+        return rows, (inode, offset + size), complete
+
+    def append_override(self, version, overrides, user_id):
+        """Append the row of ``user_id`` in ``overrides`` to the overrides of ``version``
+
+        The file is rewritten from ``overrides`` once superseded rows take
+        up more than half of it.
+        """
+        record = _override_record(user_id, overrides[user_id])
+        # One write per record, so readers see whole records or a prefix of the last one
+        with open(self.versions / version / OVERRIDES, 'ab') as f:
+            f.write(record)
+            size = f.tell()
+        if size > 2 * len(record) * len(overrides):
+            self.save_overrides(version, overrides)
+
+    def save_overrides(self, version, overrides):
+        """Atomically replace the override rows of ``version``"""
+        _write_atomic(self.versions / version / OVERRIDES, lambda f: _save_overrides(f, overrides))
+
+    def _prune(self, current):
+        """Remove old versions beyond ``keep``
+
+        Processes still mapping a removed version keep working (the files
+        stay alive while mapped) until their next version check.
+        """
+        versions = sorted(p.name for p in self.versions.iterdir() if not p.name.startswith('.'))
+        for version in versions[:-self.keep]:
+            if version != current:
+                shutil.rmtree(self.versions / version, ignore_errors=True)
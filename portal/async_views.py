@@ -0,0 +1,101 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from . import metrics
+from .cache import recommendation_cache
+from .models import DashboardSnapshot, Recommendation
+from .services import get_recommender
+from .views import _page_params, _page_response, _recommendations_etag, _recommendations_last_modified
+
+_executor = None
+
+
+def _scoring_executor():
+    """Bounded pool for scoring, so slow scoring calls queue instead of piling up threads"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECOMMENDER_EXECUTOR_WORKERS, thread_name_prefix='scoring'
+        )
+    return _executor
+
+
+def _run_scoring(func):
+    # Pool threads outlive requests, so clean up their connections like a request would
+    close_old_connections()
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+async def _offload(func):
+    """Run blocking scoring work in the scoring pool
+
+    Pool threads use their own database connections; only the request's
+    stage timings are carried over.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_scoring_executor(), functools.partial(metrics.in_request(_run_scoring), func))
+
+
+async def _authenticated_user(request):
+    """The request's user if logged in, else None, resolved off the event loop"""
+    return await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+
+
+async def dashboard_view(request):
+    """User dashboard view, async"""
+    user = await _authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    payload = await DashboardSnapshot.objects.filter(user=user).values_list('payload', flat=True).afirst()
+    if payload is None:
+        payload = await sync_to_async(DashboardSnapshot.objects.for_user)(user)
+
+    return await sync_to_async(render)(request, 'portal/dashboard.html', payload)
+
+
+async def api_recommendations(request):
+    """API endpoint for recommendations, async
+
+    Same parameters and conditional GET handling as the sync endpoint.
+    Scoring runs in the bounded scoring pool, so at most
+    ``RECOMMENDER_EXECUTOR_WORKERS`` requests score at once. The request
+    still holds a thread while sync-only middleware (WhiteNoise, allauth's
+    AccountMiddleware) wraps it.
+    """
+    user = await _authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    limit, after, error = _page_params(request)
+    if error:
+        return error
+
+    etag, last_modified = await sync_to_async(
+        lambda: (quote_etag(_recommendations_etag(request)), _recommendations_last_modified(request).timestamp())
+    )()
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        # One extra row tells whether there is a next page
+        if after is None:
+            recommendations = await _offload(
+                lambda: recommendation_cache.get_or_compute(user.id, limit + 1, get_recommender())
+            )
+        else:
+            # Later pages read what the first page stored, without scoring
+            recommendations = [rec async for rec in Recommendation.objects.page_for_user(user.id, limit + 1, after)]
+        response = _page_response(recommendations, limit)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
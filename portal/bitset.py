@@ -0,0 +1,104 @@
+import numpy as np
+
+WORD_BITS = 64
+# Set bits of every byte value
+POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+# Multiplying by this sums the 8 bytes of a word into its top byte
+BYTE_SUM = np.uint64(0x0101010101010101)
+METRICS = ('overlap', 'jaccard', 'cosine')
+
+
+def popcount(words):
+    """Set bits of each row of a (rows, words) uint64 array"""
+    words = np.ascontiguousarray(words, dtype='<u8')
+    # Bits per byte from the table, then per word (at most 64, so the top byte holds it)
+    byte_counts = POPCOUNT_TABLE.take(words.view(np.uint8)).view('<u8')
+    return ((byte_counts * BYTE_SUM) >> np.uint64(56)).sum(axis=1).astype(np.int64)
+
+
+def pack(rows, n_bits):
+    """Pack rows of bit positions into a (rows, words) uint64 array"""
+    words = np.zeros((len(rows), max(1, -(-n_bits // WORD_BITS))), dtype='<u8')
+    for row, bits in enumerate(rows):
+        bits = np.asarray(bits, dtype=np.int64)
+        masks = np.left_shift(np.uint64(1), (bits % WORD_BITS).astype(np.uint64))
+        np.bitwise_or.at(words[row], bits // WORD_BITS, masks)
+    return words
+
+
+def unpack(words):
+    """(row, bit position) of every set bit of a (rows, words) uint64 array"""
+    bits = np.unpackbits(np.ascontiguousarray(words, dtype='<u8').view(np.uint8), axis=1, bitorder='little')
+    return np.nonzero(bits)
+
+
+class TreatmentBitsets:
+    """Condition sets of all treatments packed into bitsets
+
+    Bit ``i`` of a row stands for the ``i``-th of the sorted condition ids.
+    A user's conditions are packed the same way, so the conditions shared
+    with every treatment are one AND over the array, and their number a
+    popcount.
+    """
+
+    def __init__(self, treatment_ids, condition_ids, words):
+        self.treatment_ids = treatment_ids
+        self.condition_ids = condition_ids
+        self.words = words
+        self.sizes = popcount(words)
+        self.bit_of = {condition_id: bit for bit, condition_id in enumerate(condition_ids.tolist())}
+
+    @classmethod
+    def from_index(cls, treatments_by_condition):
+        """Build from a condition id -> treatment ids mapping"""
+        condition_ids = np.array(sorted(treatments_by_condition), dtype=np.int64)
+        conditions_by_treatment = {}
+        for bit, condition_id in enumerate(condition_ids.tolist()):
+            for treatment_id in treatments_by_condition[condition_id]:
+                conditions_by_treatment.setdefault(treatment_id, []).append(bit)
+        treatment_ids = np.array(sorted(conditions_by_treatment), dtype=np.int64)
+        words = pack([conditions_by_treatment[t] for t in treatment_ids.tolist()], len(condition_ids))
+        return cls(treatment_ids, condition_ids, words)
+
+    def pack_conditions(self, condition_ids):
+        """Bitset of a set of condition ids; conditions no treatment has are left out"""
+        # A user has a handful of conditions, so plain ints beat array operations
+        words = [0] * self.words.shape[1]
+        for condition_id in condition_ids:
+            bit = self.bit_of.get(condition_id)
+            if bit is not None:
+                words[bit // WORD_BITS] |= 1 << (bit % WORD_BITS)
+        return np.array(words, dtype='<u8')
+
+    def match(self, condition_ids, metric='jaccard'):
+        """Treatments sharing a condition with ``condition_ids``, with the shared conditions and a score
+
+        Returns a list of (treatment_id, shared condition ids) and the
+        matching array of scores: the number of shared conditions
+        (``overlap``), or it divided by the size of the union (``jaccard``)
+        or by the geometric mean of both sizes (``cosine``).
+        """
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric {metric!r}; expected one of {", ".join(METRICS)}')
+        user_size = len(set(condition_ids))
+        if not user_size or not len(self.treatment_ids):
+            return [], np.empty(0)
+
+        shared = self.words & self.pack_conditions(condition_ids)
+        overlap = popcount(shared)
+        hits = np.flatnonzero(overlap)
+        overlap = overlap[hits]
+        if metric == 'jaccard':
+            scores = overlap / (user_size + self.sizes[hits] - overlap)
+        elif metric == 'cosine':
+            scores = overlap / np.sqrt(user_size * self.sizes[hits])
+        else:
+            scores = overlap.astype(np.float64)
+
+        # Rows of unpack() come out in order, so each hit's bits are one slice
+        _, bits = unpack(shared[hits])
+        shared_ids = np.split(self.condition_ids[bits], np.cumsum(overlap)[:-1])
+        candidates = [
+            (treatment_id, ids.tolist()) for treatment_id, ids in zip(self.treatment_ids[hits].tolist(), shared_ids)
+        ]
+        return candidates, scores
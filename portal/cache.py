@@ -0,0 +1,130 @@
+import time
+import uuid
+from datetime import datetime, timezone
+from django.core.cache import caches
+from .metrics import stage
+
+CATALOG_GENERATION_KEY = 'recs:generation:catalog'
+HITS_KEY = 'recs:stats:hits'
+MISSES_KEY = 'recs:stats:misses'
+
+
+def _user_generation_key(user_id):
+    return f'recs:generation:user:{user_id}'
+
+
+def _new_generation():
+    """Random token prefixed with its creation time"""
+    return f'{time.time_ns():x}.{uuid.uuid4().hex}'
+
+
+def _generation_time(generation):
+    try:
+        return int(generation.split('.')[0], 16) / 1e9
+    except ValueError:
+        # Token written before generations carried a time
+        return 0.0
+
+
+class RecommendationCache:
+    """Per-user cache of ranked recommendations
+
+    Entries are keyed by user, model version and two generation tokens:
+    one for the user's profile and one for the whole catalog. Invalidation
+    replaces a token, so stale entries are never read again and simply age
+    out through the backend's TTL and eviction (LRU for locmem, culling for
+    the file backend). Rescoring one user replaces only that user's token,
+    so other users' entries survive it. Tokens are random rather than
+    counters so that an evicted token can't come back with a value that
+    matches old entries. Tokens start with their creation time, which gives
+    the time of the last change for Last-Modified headers.
+    """
+
+    def __init__(self, alias='recommendations'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _generations(self, user_id):
+        user_key = _user_generation_key(user_id)
+        generations = self.cache.get_many([CATALOG_GENERATION_KEY, user_key])
+        for key in (CATALOG_GENERATION_KEY, user_key):
+            if key not in generations:
+                self.cache.add(key, _new_generation(), timeout=None)
+                generations[key] = self.cache.get(key)
+        return generations[CATALOG_GENERATION_KEY], generations[user_key]
+
+    def key(self, user_id, version, top_n):
+        catalog_generation, user_generation = self._generations(user_id)
+        return f'recs:{user_id}:{version}:{top_n}:{catalog_generation}:{user_generation}'
+
+    def validators(self, user_id, recommender):
+        """ETag source and last-modified time of a user's recommendations
+
+        Both change whenever cached entries of the user are invalidated or
+        a new model version is published, without scoring anything. Other
+        users being rescored changes neither.
+        """
+        recommender.refresh()
+        catalog_generation, user_generation = self._generations(user_id)
+        tag = f'{user_id}:{recommender.version}:{catalog_generation}:{user_generation}'
+        modified = max(
+            recommender.published_at or 0.0,
+            _generation_time(catalog_generation),
+            _generation_time(user_generation),
+        )
+        return tag, datetime.fromtimestamp(modified, tz=timezone.utc)
+
+    def get_or_compute(self, user_id, top_n, recommender):
+        """Cached top-N recommendations for a user, computing them on a miss"""
+        recommender.refresh()
+        with stage('cache.lookup'):
+            key = self.key(user_id, recommender.version, top_n)
+            recommendations = self.cache.get(key)
+        if recommendations is not None:
+            self._count(HITS_KEY)
+            return recommendations
+
+        self._count(MISSES_KEY)
+        recommendations = recommender.get_recommendations(user_id, top_n=top_n)
+        self.cache.set(key, recommendations)
+        return recommendations
+
+    def catalog_generation(self):
+        """Token that changes whenever the catalog does, for keys of other catalog-derived content"""
+        generation = self.cache.get(CATALOG_GENERATION_KEY)
+        if generation is None:
+            self.cache.add(CATALOG_GENERATION_KEY, _new_generation(), timeout=None)
+            generation = self.cache.get(CATALOG_GENERATION_KEY)
+        return generation
+
+    def invalidate_user(self, user_id):
+        """Drop cached recommendations of one user"""
+        self.cache.set(_user_generation_key(user_id), _new_generation(), timeout=None)
+
+    def invalidate_all(self):
+        """Drop every cached recommendation, e.g. after a catalog change"""
+        self.cache.set(CATALOG_GENERATION_KEY, _new_generation(), timeout=None)
+
+    def _count(self, key):
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 0, timeout=None)
+            self.cache.incr(key)
+
+    def stats(self):
+        """Hit/miss counters across all processes sharing the cache backend"""
+        counts = self.cache.get_many([HITS_KEY, MISSES_KEY])
+        hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+        return {
+            'backend': self.cache.__class__.__name__,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+        }
+
+
+recommendation_cache = RecommendationCache()
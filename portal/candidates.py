@@ -0,0 +1,92 @@
+import time
+from django.db.models import Count, Max
+from .models import Treatment
+
+# Seconds between checks of the treatment/condition links for changes made by other processes
+VERSION_CHECK_INTERVAL = 1.0
+
+
+class CandidateIndex:
+    """In-memory inverted index of condition id -> ids of treatments for it
+
+    Only treatments sharing a condition with a user can be recommended to
+    them, so this gives the candidate set without looking at the rest of
+    the catalog. Its version is the number and highest id of the
+    ``Treatment.conditions`` links in the database; link ids are never
+    reused, so adding or removing a link in any process changes it. Each
+    process checks the version at most once per ``VERSION_CHECK_INTERVAL``
+    seconds and rebuilds its copy when it has changed.
+    """
+
+    def __init__(self):
+        self._treatments_by_condition = None
+        self._version = None
+        self._checked_at = None
+        self._bitsets = None
+
+    def invalidate(self):
+        """Drop this process's copy of the index, e.g. after changing a treatment's conditions"""
+        self._treatments_by_condition = None
+        self._checked_at = None
+        self._bitsets = None
+
+    def refresh(self):
+        """Check the links for changes now, e.g. before a worker runs a batch of jobs"""
+        self._checked_at = None
+        self._index()
+
+    def validate_treatment(self, treatment_id, condition_ids):
+        """Rebuild the index unless it links ``treatment_id`` to exactly ``condition_ids``
+
+        ``condition_ids`` should be read from the database by the caller, so
+        jobs about a treatment never score against links that predate it.
+        """
+        indexed = {c for c, treatment_ids in self._index().items() if treatment_id in treatment_ids}
+        if indexed != set(condition_ids):
+            self._treatments_by_condition = None
+            self.refresh()
+
+    def _current_version(self):
+        links = Treatment.conditions.through.objects.aggregate(count=Count('id'), last=Max('id'))
+        return links['count'], links['last']
+
+    def _build(self):
+        """Load the whole treatment/condition through table in one query"""
+        treatments_by_condition = {}
+        links = Treatment.conditions.through.objects.values_list('medicalcondition_id', 'treatment_id')
+        for condition_id, treatment_id in links.iterator():
+            treatments_by_condition.setdefault(condition_id, []).append(treatment_id)
+        return treatments_by_condition
+
+    def _index(self):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= VERSION_CHECK_INTERVAL:
+            version = self._current_version()
+            if self._treatments_by_condition is None or version != self._version:
+                self._treatments_by_condition = self._build()
+                self._version = version
+                self._bitsets = None
+            self._checked_at = now
+        return self._treatments_by_condition
+
+    def candidates(self, condition_ids):
+        """Map each treatment sharing a condition with ``condition_ids`` to the shared conditions"""
+        index = self._index()
+        candidates = {}
+        for condition_id in condition_ids:
+            for treatment_id in index.get(condition_id, ()):
+                candidates.setdefault(treatment_id, []).append(condition_id)
+        return candidates
+
+    def bitsets(self):
+        """The index as packed per-treatment condition bitsets, rebuilt along with it"""
+        index = self._index()
+        if self._bitsets is None:
+            # numpy is only imported by processes that score
+            from .bitset import TreatmentBitsets
+
+            self._bitsets = TreatmentBitsets.from_index(index)
+        return self._bitsets
+
+
+candidate_index = CandidateIndex()
@@ -0,0 +1,95 @@
+import logging
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import pairwise_distances_argmin
+from scipy import sparse
+from .features import NUMERIC_COLUMNS, USER_NUMERIC_COLUMNS
+
+# Users per k-means mini-batch
+BATCH_SIZE = 1024
+# Most users read, across as many chunks as it takes, to find distinct demographics for the initial centroids
+SEED_SIZE = 16 * BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class Cohorts:
+    """Groups of similar users that are scored as one
+
+    A cohort is the users with exactly the same set of conditions whose
+    scaled age, height and weight fall into the same k-means cluster. Each
+    cohort is scored once through a representative row (the cluster
+    centroid plus the shared conditions) and its members share the scores.
+    """
+
+    def __init__(self, centroids):
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, chunks, n_clusters):
+        """Cluster the demographics of scaled user feature chunks, one mini-batch at a time
+
+        The centroids are seeded from as many chunks as it takes to find
+        ``n_clusters`` distinct rows (up to ``SEED_SIZE`` users), so a first
+        chunk of look-alike users doesn't cap the number of clusters. Fewer
+        distinct rows than that make for fewer clusters, with a warning.
+        """
+        chunks = iter(chunks)
+        seed = []
+        seeded = distinct = 0
+        for scaled in chunks:
+            seed.append(scaled[:, :len(USER_NUMERIC_COLUMNS)].toarray())
+            seeded += len(seed[-1])
+            distinct = len(np.unique(np.vstack(seed), axis=0))
+            if distinct >= n_clusters or seeded >= SEED_SIZE:
+                break
+        if not seeded:
+            raise ValueError('No users to cluster')
+        if distinct < n_clusters:
+            logger.warning(
+                'Only %d distinct demographics among the first %d users, fitting %d cohort clusters instead of %d',
+                distinct, seeded, distinct, n_clusters,
+            )
+
+        kmeans = MiniBatchKMeans(
+            n_clusters=min(n_clusters, distinct), batch_size=BATCH_SIZE, n_init=3, random_state=0,
+        )
+        kmeans.partial_fit(np.vstack(seed))
+        for scaled in chunks:
+            demographics = scaled[:, :len(USER_NUMERIC_COLUMNS)].toarray()
+            for start in range(0, len(demographics), BATCH_SIZE):
+                kmeans.partial_fit(demographics[start:start + BATCH_SIZE])
+        return cls(kmeans.cluster_centers_)
+
+    def assign(self, scaled, positions=None):
+        """Cohorts of the rows of a scaled user feature matrix
+
+        ``positions`` maps the keys of cohorts seen before to their
+        positions and is extended with the cohorts first seen here. Returns
+        the cohort position of each row and a representative row for each
+        new cohort.
+        """
+        if positions is None:
+            positions = {}
+        scaled = sparse.csr_matrix(scaled)
+        scaled.sort_indices()
+        clusters = pairwise_distances_argmin(scaled[:, :len(USER_NUMERIC_COLUMNS)].toarray(), self.centroids)
+
+        cohort_of_row = np.empty(scaled.shape[0], dtype=np.int64)
+        first_rows = []
+        for row in range(scaled.shape[0]):
+            columns = scaled.indices[scaled.indptr[row]:scaled.indptr[row + 1]]
+            # The condition set is hashed by its sorted column numbers
+            key = (int(clusters[row]), columns[columns >= len(NUMERIC_COLUMNS)].tobytes())
+            position = positions.get(key)
+            if position is None:
+                position = positions[key] = len(positions)
+                first_rows.append(row)
+            cohort_of_row[row] = position
+
+        first_rows = np.array(first_rows, dtype=np.int64)
+        representatives = sparse.hstack([
+            sparse.csr_matrix(self.centroids[clusters[first_rows]]),
+            scaled[first_rows, len(USER_NUMERIC_COLUMNS):],
+        ], format='csr')
+        return cohort_of_row, representatives
@@ -0,0 +1,13 @@
+from django.core.cache import caches
+from .cache import recommendation_cache
+
+
+def fragment_cache(request):
+    """Timeout and catalog generation for the {% cache %} fragments of portal templates"""
+    return {
+        'fragment_timeout': caches['template_fragments'].default_timeout,
+        # Read from the shared recommendations cache, so a catalog change made by
+        # any process replaces the fragments of all of them. A callable, so the
+        # cache is only read by templates that use it.
+        'catalog_generation': recommendation_cache.catalog_generation,
+    }
@@ -0,0 +1,231 @@
+import numpy as np
+from scipy import sparse
+from .models import UserHealth, Treatment, MedicalCondition
+
+# Numeric columns of the shared feature space. Users only fill the first three
+# and treatments only the last one, so both sides have the same width.
+USER_NUMERIC_COLUMNS = ('age', 'height', 'weight')
+TREATMENT_NUMERIC_COLUMNS = ('effectiveness',)
+NUMERIC_COLUMNS = USER_NUMERIC_COLUMNS + TREATMENT_NUMERIC_COLUMNS
+# Model fields behind the numeric columns
+NUMERIC_FIELDS = {'age': 'age', 'height': 'height', 'weight': 'weight', 'effectiveness': 'effectiveness_score'}
+
+
+class ConditionIndex:
+    """Stable mapping of medical condition ids to feature columns"""
+
+    def __init__(self, condition_ids):
+        self.condition_ids = np.unique(np.asarray(list(condition_ids), dtype=np.int64))
+
+    @classmethod
+    def from_database(cls):
+        """Build the index from the current condition catalog"""
+        return cls(MedicalCondition.objects.values_list('id', flat=True))
+
+    def __len__(self):
+        return len(self.condition_ids)
+
+    def columns_for(self, condition_ids):
+        """Map condition ids to columns, returning (columns, mask of known ids)"""
+        condition_ids = np.asarray(condition_ids, dtype=np.int64)
+        if not len(self.condition_ids):
+            return np.zeros(len(condition_ids), dtype=np.int64), np.zeros(len(condition_ids), dtype=bool)
+
+        cols = np.searchsorted(self.condition_ids, condition_ids)
+        cols = np.minimum(cols, len(self.condition_ids) - 1)
+        return cols, self.condition_ids[cols] == condition_ids
+
+
+class FeatureSchema:
+    """Column layout of the feature space shared by users and treatments
+
+    The user numeric columns come first, then the treatment numeric
+    columns (each side leaves the other's at zero), then one column per
+    medical condition in ascending id order. The schema is stored with
+    every model version and checked when one is loaded, so a model is
+    never served with a layout other than the one it was trained with.
+    """
+
+    def __init__(self, conditions, user_columns=USER_NUMERIC_COLUMNS, treatment_columns=TREATMENT_NUMERIC_COLUMNS):
+        self.conditions = conditions if isinstance(conditions, ConditionIndex) else ConditionIndex(conditions)
+        self.user_columns = tuple(user_columns)
+        self.treatment_columns = tuple(treatment_columns)
+
+    @classmethod
+    def from_database(cls):
+        """Schema over the current condition catalog"""
+        return cls(ConditionIndex.from_database())
+
+    @classmethod
+    def from_manifest(cls, manifest, condition_ids):
+        """Schema stored with a model version
+
+        Raises ValueError when it doesn't match the columns this code builds.
+        """
+        stored = manifest.get('schema')
+        if stored is None:
+            # Versions trained before the schema was stored only list column names
+            numeric = [name for name in manifest['columns'] if not name.startswith('condition_')]
+            stored = {
+                'user_columns': numeric[:len(USER_NUMERIC_COLUMNS)],
+                'treatment_columns': numeric[len(USER_NUMERIC_COLUMNS):],
+                'conditions': len(manifest['columns']) - len(numeric),
+            }
+        schema = cls(condition_ids, stored['user_columns'], stored['treatment_columns'])
+        if schema.numeric_columns != NUMERIC_COLUMNS or stored['conditions'] != len(schema.conditions):
+            raise ValueError(f'Model feature columns {schema.numeric_columns} do not match {NUMERIC_COLUMNS}')
+        return schema
+
+    def to_manifest(self):
+        return {
+            'user_columns': list(self.user_columns),
+            'treatment_columns': list(self.treatment_columns),
+            'conditions': len(self.conditions),
+        }
+
+    @property
+    def numeric_columns(self):
+        return self.user_columns + self.treatment_columns
+
+    @property
+    def width(self):
+        return len(self.numeric_columns) + len(self.conditions)
+
+    def column_names(self):
+        """Feature column names in matrix order"""
+        return list(self.numeric_columns) + [f'condition_{cid}' for cid in self.conditions.condition_ids]
+
+    def condition_ids_of(self, columns):
+        """Condition ids of feature matrix columns (condition columns only)"""
+        return self.conditions.condition_ids[np.asarray(columns) - len(self.numeric_columns)]
+
+    def with_conditions(self, condition_ids):
+        """This schema with columns for ``condition_ids`` appended
+
+        The ids must be larger than every known one, so that existing
+        columns keep their position.
+        """
+        return FeatureSchema(
+            np.concatenate([self.conditions.condition_ids, condition_ids]), self.user_columns, self.treatment_columns
+        )
+
+
+class FeatureMatrix:
+    """Row ids plus dense numeric columns and a sparse one-hot condition block"""
+
+    def __init__(self, ids, numeric, conditions, unknown_conditions=()):
+        self.ids = ids
+        self.numeric = numeric
+        self.conditions = conditions
+        # Condition ids linked to these rows but missing from the index
+        self.unknown_conditions = set(unknown_conditions)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def empty(self):
+        return len(self.ids) == 0
+
+    def row_of(self, row_id):
+        """Return the row position of ``row_id`` or None"""
+        row = np.searchsorted(self.ids, row_id)
+        if row < len(self.ids) and self.ids[row] == row_id:
+            return int(row)
+        return None
+
+    def to_sparse(self):
+        """Full feature matrix (numeric columns first) as CSR"""
+        return sparse.hstack(
+            [sparse.csr_matrix(self.numeric), self.conditions], format='csr'
+        )
+
+
+def _condition_block(row_ids, pairs, index):
+    """Build a CSR one-hot block from (row id, condition id) pairs
+
+    Returns the block and the condition ids that were not in the index.
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    rows = np.searchsorted(row_ids, pairs[:, 0])
+    cols, known = index.columns_for(pairs[:, 1])
+
+    # Drop links to rows outside this matrix or conditions outside the index
+    rows_in = rows < len(row_ids)
+    rows_in[rows_in] = row_ids[rows[rows_in]] == pairs[rows_in, 0]
+    keep = rows_in & known
+
+    block = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=np.float64), (rows[keep], cols[keep])),
+        shape=(len(row_ids), len(index)),
+    )
+    return block, np.unique(pairs[rows_in & ~known, 1])
+
+
+def _numeric_block(values, schema, columns):
+    """Place raw numeric values into their columns of the schema's numeric block"""
+    numeric = np.zeros((len(values), len(schema.numeric_columns)), dtype=np.float64)
+    if len(values):
+        offset = schema.numeric_columns.index(columns[0])
+        # Missing measurements (None) count as 0, as they always have
+        raw = np.array(values, dtype=np.float64).reshape(len(values), -1)
+        numeric[:, offset:offset + raw.shape[1]] = np.nan_to_num(raw)
+    return numeric
+
+
+def _user_features(schema, rows, links):
+    """Feature matrix of users from (user_id, *numeric) rows and their condition links"""
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    numeric = _numeric_block([row[1:] for row in rows], schema, schema.user_columns)
+    pairs = list(links.values_list('userhealth__user_id', 'medicalcondition_id'))
+
+    return FeatureMatrix(ids, numeric, *_condition_block(ids, pairs, schema.conditions))
+
+
+def _user_fields(schema):
+    return [NUMERIC_FIELDS[column] for column in schema.user_columns]
+
+
+def build_user_features(schema, user_ids=None):
+    """Build user features with one query for profiles and one for conditions"""
+    profiles = UserHealth.objects.order_by('user_id')
+    links = UserHealth.conditions.through.objects.all()
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+        links = links.filter(userhealth__user_id__in=user_ids)
+
+    return _user_features(schema, list(profiles.values_list('user_id', *_user_fields(schema))), links)
+
+
+def iter_user_features(schema, chunk_size):
+    """User features in chunks of up to ``chunk_size`` users by ascending id, two queries per chunk"""
+    last_id = None
+    while True:
+        profiles = UserHealth.objects.order_by('user_id')
+        if last_id is not None:
+            profiles = profiles.filter(user_id__gt=last_id)
+        rows = list(profiles.values_list('user_id', *_user_fields(schema))[:chunk_size])
+        if not rows:
+            return
+        links = UserHealth.conditions.through.objects.filter(
+            userhealth__user_id__gte=rows[0][0], userhealth__user_id__lte=rows[-1][0]
+        )
+        yield _user_features(schema, rows, links)
+        last_id = rows[-1][0]
+
+
+def build_treatment_features(schema, treatment_ids=None):
+    """Build treatment features with one query for treatments and one for conditions"""
+    treatments = Treatment.objects.order_by('id')
+    links = Treatment.conditions.through.objects.all()
+    if treatment_ids is not None:
+        treatments = treatments.filter(id__in=treatment_ids)
+        links = links.filter(treatment_id__in=treatment_ids)
+
+    fields = [NUMERIC_FIELDS[column] for column in schema.treatment_columns]
+    rows = list(treatments.values_list('id', *fields))
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    numeric = _numeric_block([row[1:] for row in rows], schema, schema.treatment_columns)
+    pairs = list(links.values_list('treatment_id', 'medicalcondition_id'))
+
+    return FeatureMatrix(ids, numeric, *_condition_block(ids, pairs, schema.conditions))
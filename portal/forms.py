@@ -28,3 +28,7 @@ class UserHealthForm(forms.ModelForm):
             'weight': 'Your weight in kilograms',
             'conditions': 'Select any medical conditions you have',
         }
+
+    def conditions_cache_key(self):
+        """Ids of the initially selected conditions, for the cached conditions list"""
+        return ','.join(str(condition.pk) for condition in self.initial.get('conditions', []))
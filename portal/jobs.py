@@ -0,0 +1,148 @@
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import TrainingJob, UserHealth
+from .cache import recommendation_cache
+from .services import get_recommender
+from .candidates import candidate_index
+
+# Users per transaction when queueing rescores in bulk
+ENQUEUE_BATCH_SIZE = 1000
+
+
+def enqueue_training(user_id=None, treatment_id=None):
+    """Ask the recommender worker for a full retrain, a rescore of one user or an update of one treatment
+
+    Requests for work that is already pending are folded into the pending
+    job, which also pushes back its debounce window.
+    """
+    if user_id is not None:
+        kind = 'user'
+    elif treatment_id is not None:
+        kind = 'treatment'
+    else:
+        kind = 'full'
+    with transaction.atomic():
+        coalesced = TrainingJob.objects.filter(
+            status='pending', kind=kind, user_id=user_id, treatment_id=treatment_id
+        ).update(request_count=F('request_count') + 1, requested_at=timezone.now())
+        if not coalesced:
+            TrainingJob.objects.create(kind=kind, user_id=user_id, treatment_id=treatment_id)
+
+
+def enqueue_rescores(user_ids):
+    """Queue rescores of many users, e.g. from an admin action
+
+    Pending rescores of the same users are coalesced. Rescoring more than
+    ``RECOMMENDER_MAX_DRIFT`` of all users would trigger a full refit
+    anyway, so one full retrain is queued instead. Returns the number of
+    users queued, or None for a full retrain.
+    """
+    user_ids = sorted(set(user_ids))
+    if len(user_ids) > settings.RECOMMENDER_MAX_DRIFT * max(UserHealth.objects.count(), 1):
+        enqueue_training()
+        return None
+
+    now = timezone.now()
+    for start in range(0, len(user_ids), ENQUEUE_BATCH_SIZE):
+        batch = user_ids[start:start + ENQUEUE_BATCH_SIZE]
+        with transaction.atomic():
+            pending = TrainingJob.objects.filter(status='pending', kind='user', user_id__in=batch)
+            coalesced = set(pending.values_list('user_id', flat=True))
+            pending.update(request_count=F('request_count') + 1, requested_at=now)
+            TrainingJob.objects.bulk_create([
+                TrainingJob(kind='user', user_id=user_id) for user_id in batch if user_id not in coalesced
+            ])
+    return len(user_ids)
+
+
+def claim_due_jobs(debounce=None):
+    """Mark pending jobs that have been quiet for ``debounce`` seconds as running"""
+    if debounce is None:
+        debounce = settings.RECOMMENDER_TRAINING_DEBOUNCE
+    cutoff = timezone.now() - timedelta(seconds=debounce)
+
+    with transaction.atomic():
+        jobs = TrainingJob.objects.filter(status='pending', requested_at__lte=cutoff)
+        # Without SKIP LOCKED (SQLite) concurrent workers could claim the same jobs, so run only one
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        jobs = list(jobs)
+        TrainingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status='running', started_at=timezone.now()
+        )
+    return jobs
+
+
+def _run(jobs, task):
+    """Run ``task`` and record its outcome on every job it covers"""
+    started = time.monotonic()
+    try:
+        task()
+        status, error = 'done', ''
+    except Exception:
+        status, error = 'failed', traceback.format_exc()
+
+    TrainingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+        status=status,
+        error=error,
+        finished_at=timezone.now(),
+        duration=time.monotonic() - started,
+    )
+    return status
+
+
+def process_jobs(jobs):
+    """Run claimed jobs, collapsing them into as little work as possible
+
+    Returns a list of (description, status) for each run.
+    """
+    if not jobs:
+        return []
+
+    recommender = get_recommender()
+
+    # Pick up a model written by another worker and catalog links changed by the web processes
+    recommender.refresh()
+    candidate_index.refresh()
+
+    # A full retrain rescores everyone, so it covers every job in the batch
+    if any(job.kind == 'full' for job in jobs):
+        return [(f'full retrain ({len(jobs)} jobs)', _run(jobs, recommender.train))]
+
+    results = []
+    by_treatment = {}
+    by_user = {}
+    for job in jobs:
+        if job.kind == 'treatment':
+            by_treatment.setdefault(job.treatment_id, []).append(job)
+        else:
+            by_user.setdefault(job.user_id, []).append(job)
+    # Catalog first, so user rescores see the updated treatments
+    for treatment_id, treatment_jobs in sorted(by_treatment.items()):
+        status = _run(treatment_jobs, lambda: recommender.update_treatment(treatment_id))
+        results.append((f'update treatment {treatment_id}', status))
+    for user_id, user_jobs in sorted(by_user.items()):
+        status = _run(user_jobs, lambda: recommender.update_user(user_id))
+        # Entries cached since the profile changed were ranked with the user's old scores
+        recommendation_cache.invalidate_user(user_id)
+        results.append((f'rescore user {user_id}', status))
+    return results
+
+
+def requeue_stale_jobs(timeout):
+    """Return jobs left running by a worker that died to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return TrainingJob.objects.filter(status='running', started_at__lte=cutoff).update(
+        status='pending', started_at=None
+    )
+
+
+def prune_finished_jobs(days):
+    """Delete finished jobs older than ``days``"""
+    cutoff = timezone.now() - timedelta(days=days)
+    TrainingJob.objects.filter(status__in=('done', 'failed'), finished_at__lte=cutoff).delete()
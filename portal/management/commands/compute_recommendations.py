@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import time
+from itertools import islice
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from accounts.models import CustomUser
+from portal.models import UserHealth, Recommendation
+from portal.services import get_recommender
+
+
+def _init_worker():
+    """Set up Django in pool processes started with the spawn method"""
+    if not apps.ready:
+        django.setup()
+
+
+def _score_block(user_ids):
+    """Score a block of users and bulk-write their recommendations"""
+    recommender = get_recommender()
+    recommender.refresh()
+    entries = recommender.score_users(user_ids)
+    Recommendation.objects.replace_for_users(entries, user_ids)
+    return len(user_ids), len(entries)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Precompute and store recommendations for all (or some) users'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-type', type=int, choices=[value for value, _ in CustomUser.USER_TYPE_CHOICES],
+            help='Only users of this type ({})'.format(
+                ', '.join(f'{value} {label}' for value, label in CustomUser.USER_TYPE_CHOICES)
+            ),
+        )
+        parser.add_argument('--min-id', type=int, help='Smallest user id to include')
+        parser.add_argument('--max-id', type=int, help='Largest user id to include')
+        parser.add_argument(
+            '--condition', type=int, action='append', dest='conditions',
+            help='Only users with this condition id (repeatable)',
+        )
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Worker processes')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Users scored per block')
+        parser.add_argument('--train', action='store_true', help='Run a full retrain first')
+
+    def handle(self, *args, **options):
+        recommender = get_recommender()
+
+        if options['train']:
+            self.stdout.write('Training...')
+            recommender.train()
+        recommender.refresh()
+        if recommender.similarity_matrix is None:
+            raise CommandError('No trained model. Run the recommender worker or pass --train.')
+
+        profiles = UserHealth.objects.order_by('user_id')
+        if options['user_type'] is not None:
+            profiles = profiles.filter(user__user_type=options['user_type'])
+        if options['min_id'] is not None:
+            profiles = profiles.filter(user_id__gte=options['min_id'])
+        if options['max_id'] is not None:
+            profiles = profiles.filter(user_id__lte=options['max_id'])
+        if options['conditions']:
+            profiles = profiles.filter(conditions__in=options['conditions']).distinct()
+
+        # Load the ids up front so no query is open while the pool forks
+        user_ids = list(profiles.values_list('user_id', flat=True))
+        blocks = _chunks(user_ids, options['chunk_size'])
+
+        started = time.monotonic()
+        users = rows = 0
+        if options['processes'] > 1:
+            # Children must open their own database connections
+            connections.close_all()
+            with multiprocessing.Pool(options['processes'], initializer=_init_worker) as pool:
+                for block_users, block_rows in pool.imap_unordered(_score_block, blocks):
+                    users += block_users
+                    rows += block_rows
+        else:
+            for block in blocks:
+                block_users, block_rows = _score_block(block)
+                users += block_users
+                rows += block_rows
+        elapsed = time.monotonic() - started
+
+        rate = users / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {rows} recommendations for {users} users in {elapsed:.2f}s ({rate:.1f} users/sec)'
+        ))
@@ -0,0 +1,250 @@
+import csv
+import json
+import sys
+import time
+from collections import ChainMap
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DataError, IntegrityError, reset_queries, transaction
+from accounts.models import CustomUser
+from portal.jobs import enqueue_training
+from portal.models import MedicalCondition, UserHealth
+
+USER_FIELDS = ('email', 'first_name', 'last_name', 'phone_number')
+PROFILE_FIELDS = {'age': int, 'height': float, 'weight': float}
+USER_TYPES = dict(CustomUser.USER_TYPE_CHOICES)
+# Separator of condition names in a single field
+CONDITION_SEPARATOR = ';'
+
+
+class RowError(ValueError):
+    pass
+
+
+def _read_csv(f):
+    # Line 1 is the header
+    for line, record in enumerate(csv.DictReader(f), start=2):
+        yield line, record
+
+
+def _read_jsonl(f):
+    for line, text in enumerate(f, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            record = None
+        yield line, record
+
+
+READERS = {'csv': _read_csv, 'jsonl': _read_jsonl}
+
+
+def _condition_key(name):
+    return name.strip().casefold()
+
+
+def _check_length(model, field, value, label=None):
+    max_length = model._meta.get_field(field).max_length
+    if len(value) > max_length:
+        raise RowError(f'{label or field} {value!r} is longer than {max_length} characters')
+
+
+def _parse(record):
+    """(user fields, profile fields, condition names) of one input record"""
+    if not isinstance(record, dict):
+        raise RowError('not a JSON object')
+
+    username = (record.get('username') or record.get('email') or '').strip()
+    if not username:
+        raise RowError('username or email is required')
+    _check_length(CustomUser, 'username', username)
+    user = {'username': username}
+    for field in USER_FIELDS:
+        user[field] = (record.get(field) or '').strip()
+        _check_length(CustomUser, field, user[field])
+    try:
+        user['user_type'] = int(record.get('user_type') or CustomUser.PATIENT)
+    except (TypeError, ValueError):
+        user['user_type'] = None
+    if user['user_type'] not in USER_TYPES:
+        raise RowError(f'invalid user_type {record.get("user_type")!r}')
+
+    profile = {}
+    for field, cast in PROFILE_FIELDS.items():
+        value = record.get(field)
+        if value in (None, ''):
+            profile[field] = None
+            continue
+        try:
+            profile[field] = cast(value)
+        except (TypeError, ValueError):
+            raise RowError(f'invalid {field} {value!r}')
+        if profile[field] < 0:
+            raise RowError(f'invalid {field} {value!r}')
+
+    conditions = record.get('conditions') or []
+    if isinstance(conditions, str):
+        conditions = conditions.split(CONDITION_SEPARATOR)
+    if not isinstance(conditions, list) or not all(isinstance(name, str) for name in conditions):
+        raise RowError('conditions must be a list of names')
+    names = [name.strip() for name in conditions if name.strip()]
+    for name in names:
+        _check_length(MedicalCondition, 'name', name, 'condition name')
+
+    return user, profile, names
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _pks(objects, model, key):
+    """{key: pk} of freshly bulk-created objects, re-read on backends that don't return pks"""
+    if all(obj.pk is not None for obj in objects):
+        return {getattr(obj, key): obj.pk for obj in objects}
+    values = [getattr(obj, key) for obj in objects]
+    return dict(model.objects.filter(**{f'{key}__in': values}).values_list(key, 'pk'))
+
+
+class Command(BaseCommand):
+    help = 'Create users and health profiles in bulk from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON Lines file, or '-' for standard input")
+        parser.add_argument('--format', choices=sorted(READERS), help='Input format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Profiles written per transaction')
+        parser.add_argument(
+            '--create-conditions', action='store_true',
+            help='Create medical conditions that do not exist yet instead of rejecting the row',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Validate and roll back every chunk')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format']
+        if input_format is None:
+            if path.endswith('.csv'):
+                input_format = 'csv'
+            elif path.endswith(('.jsonl', '.ndjson')):
+                input_format = 'jsonl'
+            else:
+                raise CommandError('Cannot tell the input format from the file name; pass --format')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        # Condition names are matched case-insensitively against one preloaded map;
+        # of duplicate names the oldest condition wins
+        self.condition_ids = {}
+        for pk, name in MedicalCondition.objects.order_by('-id').values_list('id', 'name'):
+            self.condition_ids[_condition_key(name)] = pk
+        self.create_conditions = options['create_conditions']
+        self.dry_run = options['dry_run']
+
+        started = time.monotonic()
+        self.created = self.skipped = self.errors = 0
+        try:
+            f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f'Cannot open {path}: {e}')
+        with f:
+            for chunk in _chunks(self._rows(READERS[input_format](f)), options['chunk_size']):
+                try:
+                    self._write_chunk(chunk)
+                except (DataError, IntegrityError) as e:
+                    # The chunk was rolled back; report its rows and carry on with the next
+                    self.errors += len(chunk)
+                    lines = f'line {chunk[0][0]}' if len(chunk) == 1 else f'lines {chunk[0][0]}-{chunk[-1][0]}'
+                    self.stderr.write(f'{lines}: rejected by the database: {e}')
+                # With DEBUG on, every bulk insert would otherwise stay in the query log
+                reset_queries()
+        elapsed = time.monotonic() - started
+
+        if self.created and not self.dry_run:
+            # One full refresh covers every imported profile
+            enqueue_training()
+
+        rate = self.created / elapsed if elapsed else 0.0
+        verb = 'Validated' if self.dry_run else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {self.created} profiles in {elapsed:.2f}s ({rate:.1f} profiles/sec); '
+            f'{self.skipped} existing usernames skipped, {self.errors} rows rejected'
+        ))
+
+    def _rows(self, records):
+        """Valid (line, user, profile, condition names) rows, reporting the rest"""
+        for line, record in records:
+            try:
+                user, profile, names = _parse(record)
+                if not self.create_conditions:
+                    unknown = [name for name in names if _condition_key(name) not in self.condition_ids]
+                    if unknown:
+                        raise RowError(f'unknown conditions {", ".join(unknown)}')
+            except RowError as e:
+                self.errors += 1
+                self.stderr.write(f'line {line}: {e}')
+                continue
+            yield line, user, profile, names
+
+    def _write_chunk(self, rows):
+        with transaction.atomic():
+            # Usernames taken by earlier chunks or existing users, and repeats within this chunk
+            taken = set(CustomUser.objects.filter(
+                username__in=[user['username'] for _, user, _, _ in rows]
+            ).values_list('username', flat=True))
+            new_rows = []
+            skipped = 0
+            for line, user, profile, names in rows:
+                if user['username'] in taken:
+                    skipped += 1
+                    self.stderr.write(f'line {line}: username {user["username"]!r} already exists')
+                    continue
+                taken.add(user['username'])
+                new_rows.append((user, profile, names))
+
+            condition_ids = ChainMap(self._create_conditions(new_rows), self.condition_ids)
+
+            users = CustomUser.objects.bulk_create([
+                CustomUser(password=make_password(None), **user) for user, _, _ in new_rows
+            ])
+            user_ids = _pks(users, CustomUser, 'username')
+            profiles = UserHealth.objects.bulk_create([
+                UserHealth(user_id=user_ids[user['username']], **profile) for user, profile, _ in new_rows
+            ])
+            profile_ids = _pks(profiles, UserHealth, 'user_id')
+
+            Through = UserHealth.conditions.through
+            Through.objects.bulk_create([
+                Through(userhealth_id=profile_ids[user_ids[user['username']]], medicalcondition_id=condition_id)
+                for user, _, names in new_rows
+                for condition_id in {condition_ids[_condition_key(name)] for name in names}
+            ])
+
+            if self.dry_run:
+                transaction.set_rollback(True)
+            else:
+                self.condition_ids.update(condition_ids.maps[0])
+        self.created += len(new_rows)
+        self.skipped += skipped
+
+    def _create_conditions(self, rows):
+        """Create the conditions named by the rows that don't exist yet, returning their ids by name key"""
+        missing = {}
+        for _, _, names in rows:
+            for name in names:
+                key = _condition_key(name)
+                if key not in self.condition_ids:
+                    missing.setdefault(key, name)
+        if not missing:
+            return {}
+        created = MedicalCondition.objects.bulk_create([
+            MedicalCondition(name=name, description='') for name in missing.values()
+        ])
+        return {_condition_key(name): pk for name, pk in _pks(created, MedicalCondition, 'name').items()}
@@ -0,0 +1,47 @@
+import signal
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from portal.jobs import claim_due_jobs, process_jobs, prune_finished_jobs, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Drain the recommender training queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain due jobs once and exit')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between queue polls')
+        parser.add_argument(
+            '--debounce', type=float, default=settings.RECOMMENDER_TRAINING_DEBOUNCE,
+            help='Seconds a job must be quiet before it runs',
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=60 * 60,
+            help='Requeue jobs left running for this many seconds',
+        )
+        parser.add_argument('--keep-days', type=int, default=7, help='Days to keep finished jobs')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+
+        while not self.stopping:
+            jobs = claim_due_jobs(options['debounce'])
+            for description, status in process_jobs(jobs):
+                style = self.style.SUCCESS if status == 'done' else self.style.ERROR
+                self.stdout.write(style(f'{description}: {status}'))
+
+            if options['once']:
+                break
+            if not jobs:
+                prune_finished_jobs(options['keep_days'])
+                time.sleep(options['interval'])
+
+    def stop(self, signum, frame):
+        """Finish the current batch, then exit"""
+        self.stopping = True
@@ -0,0 +1,76 @@
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+
+# What a web worker does before serving its first request
+BOOT = '''
+import resource, sys
+from django.conf import settings
+from django.utils.module_loading import import_string
+import_string(settings.WSGI_APPLICATION)
+from django.urls import get_resolver
+get_resolver().url_patterns
+{extra}
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(rss if sys.platform == 'darwin' else rss * 1024)
+'''
+
+LOAD_RECOMMENDER = '''
+from portal.services import get_recommender
+get_recommender()
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+
+def parse_importtime(output):
+    """(module, self us, cumulative us, depth) for each line of ``-X importtime`` output"""
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return imports
+
+
+class Command(BaseCommand):
+    help = 'Report the import time and memory a web worker spends booting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=15, help='Rows in each table')
+        parser.add_argument(
+            '--with-recommender', action='store_true',
+            help='Also load the recommender, as the first recommendation request does',
+        )
+
+    def handle(self, *args, **options):
+        code = BOOT.format(extra=LOAD_RECOMMENDER if options['with_recommender'] else '')
+        # A fresh interpreter, so nothing is already imported by this command
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f'Boot failed:\n{result.stderr[-2000:]}')
+
+        imports = parse_importtime(result.stderr)
+        total_us = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        rss_mb = int(result.stdout.split()[-1]) / 2 ** 20
+
+        self.stdout.write(
+            f'Boot: {total_us / 1000:.1f} ms importing {len(imports)} modules, max RSS {rss_mb:.1f} MB'
+        )
+
+        by_package = defaultdict(int)
+        for module, self_us, _, _ in imports:
+            by_package[module.split('.')[0]] += self_us
+        self.stdout.write('\nSelf time by top-level package:')
+        for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:options['limit']]:
+            self.stdout.write(f'  {self_us / 1000:9.1f} ms  {package}')
+
+        self.stdout.write('\nSlowest imports (cumulative):')
+        for module, _, cumulative, _ in sorted(imports, key=lambda item: -item[2])[:options['limit']]:
+            self.stdout.write(f'  {cumulative / 1000:9.1f} ms  {module}')
@@ -0,0 +1,243 @@
+import contextvars
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+
+# Upper bounds (seconds) of the latency histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds of the SQL query count histogram buckets
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMS = {
+    'portal_request_duration_seconds': ('Request latency by view', DURATION_BUCKETS),
+    'portal_request_sql_queries': ('SQL queries per request by view', QUERY_BUCKETS),
+    'portal_request_sql_duration_seconds': ('Time spent in SQL per request by view', DURATION_BUCKETS),
+    'portal_recommender_stage_duration_seconds': ('Recommender stage durations', DURATION_BUCKETS),
+}
+COUNTERS = {
+    'portal_requests_total': 'Requests by view and status code',
+}
+
+ARCHIVE = 'archive.json'
+
+# Stage timings of the request being handled in this thread/task
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def _labels_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+class Registry:
+    """Metrics of this process, flushed to a per-process file
+
+    Every process writes its own ``<pid>.json`` into ``METRICS_DIR`` at most
+    once per ``METRICS_FLUSH_INTERVAL`` seconds; ``collect()`` sums all files,
+    so the /metrics endpoint reports totals across gunicorn workers and the
+    recommender worker alike. Files of processes that have exited are folded
+    into an archive file so counters never go backwards.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.histograms = {}
+        self.counters = {}
+        self.pid = os.getpid()
+        self.last_flush = 0.0
+
+    @property
+    def directory(self):
+        return Path(settings.METRICS_DIR)
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a histogram"""
+        buckets = HISTOGRAMS[name][1]
+        self._check_fork()
+        with self.lock:
+            series = self.histograms.setdefault(name, {}).setdefault(
+                _labels_key(labels), {'buckets': [0] * len(buckets), 'count': 0, 'sum': 0.0}
+            )
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['count'] += 1
+            series['sum'] += value
+        self._maybe_flush()
+
+    def increment(self, name, amount=1, **labels):
+        """Increase a counter"""
+        self._check_fork()
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _labels_key(labels)
+            series[key] = series.get(key, 0) + amount
+        self._maybe_flush()
+
+    def _snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps({'histograms': self.histograms, 'counters': self.counters}))
+
+    def after_fork(self):
+        """Start a forked process from a clean slate under its own file"""
+        # The parent's lock may have been held by a thread that doesn't exist here
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _check_fork(self):
+        if os.getpid() != self.pid:
+            self.after_fork()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self.last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this process's metrics to its file"""
+        self.last_flush = time.monotonic()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f'{self.pid}.json'
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """Sum the metrics of all processes, archiving those of exited ones"""
+        self.flush()
+        total = {'histograms': {}, 'counters': {}}
+
+        with open(self.directory / '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = self.directory / ARCHIVE
+            archive = _read(archive_path)
+            archived = False
+            for path in self.directory.glob('*.json'):
+                if path.name == ARCHIVE:
+                    continue
+                data = _read(path)
+                if _alive(int(path.stem)):
+                    _merge(total, data)
+                else:
+                    _merge(archive, data)
+                    path.unlink()
+                    archived = True
+            if archived:
+                archive_path.write_text(json.dumps(archive))
+            _merge(total, archive)
+
+        return total
+
+
+def _read(path):
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return {'histograms': {}, 'counters': {}}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(total, data):
+    for name, series in data.get('histograms', {}).items():
+        target = total['histograms'].setdefault(name, {})
+        for key, values in series.items():
+            if key not in target:
+                target[key] = {'buckets': list(values['buckets']), 'count': values['count'], 'sum': values['sum']}
+                continue
+            target[key]['buckets'] = [a + b for a, b in zip(target[key]['buckets'], values['buckets'])]
+            target[key]['count'] += values['count']
+            target[key]['sum'] += values['sum']
+    for name, series in data.get('counters', {}).items():
+        target = total['counters'].setdefault(name, {})
+        for key, value in series.items():
+            target[key] = target.get(key, 0) + value
+
+
+def _format_labels(key, **extra):
+    labels = dict(json.loads(key), **extra)
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def to_prometheus(data, counters=()):
+    """Render collected metrics in the Prometheus text exposition format
+
+    ``counters`` are extra (name, help, value) triples of counters kept
+    elsewhere; their names end in ``_total``.
+    """
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key, series in sorted(data['histograms'].get(name, {}).items()):
+            # Stored bucket counts are already cumulative
+            for bound, count in zip(buckets, series['buckets']):
+                lines.append(f'{name}_bucket{_format_labels(key, le=bound)} {count}')
+            lines.append(f'{name}_bucket{_format_labels(key, le="+Inf")} {series["count"]}')
+            lines.append(f'{name}_sum{_format_labels(key)} {series["sum"]}')
+            lines.append(f'{name}_count{_format_labels(key)} {series["count"]}')
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for key, value in sorted(data['counters'].get(name, {}).items()):
+            lines.append(f'{name}{_format_labels(key)} {value}')
+    for name, help_text, value in counters:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def stage(name):
+    """Time a recommender stage for the histograms and the current request's Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        registry.observe('portal_recommender_stage_duration_seconds', duration, stage=name)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, duration))
+
+
+def start_request():
+    """Begin collecting stage timings for a request"""
+    stages = []
+    return stages, _request_stages.set(stages)
+
+
+def finish_request(token):
+    _request_stages.reset(token)
+
+
+def in_request(func):
+    """Wrap ``func`` to record stage timings into the current request from another thread"""
+    stages = _request_stages.get()
+
+    def run(*args, **kwargs):
+        token = _request_stages.set(stages)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _request_stages.reset(token)
+    return run
@@ -0,0 +1,141 @@
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.http import FileResponse
+from . import metrics
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Record latency, SQL and recommender stage metrics for every request
+
+    Adds a ``Server-Timing`` header so the breakdown shows up in the
+    browser's network panel. Works in both sync and async stacks, so it
+    doesn't force async views back onto a thread. A streaming response is
+    recorded once its body is closed, including the time and queries spent
+    producing it; its header can only cover the time until the body starts.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = QueryTimer()
+        stages, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            with _timing_queries(queries):
+                response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self._record(request, response, queries, stages, started)
+
+    async def __acall__(self, request):
+        queries = QueryTimer()
+        stages, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            with _timing_queries(queries):
+                response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self._record(request, response, queries, stages, started)
+
+    def _record(self, request, response, queries, stages, started):
+        duration = time.perf_counter() - started
+        self._server_timing(response, queries, stages, duration)
+        # Files are sent as they are (sendfile where possible), without work worth timing
+        if not response.streaming or isinstance(response, FileResponse):
+            _observe(request, response, queries, duration)
+            return response
+
+        def closed():
+            _observe(request, response, queries, time.perf_counter() - started)
+        content_class = _AsyncTimedContent if response.is_async else _TimedContent
+        response.streaming_content = content_class(response.streaming_content, queries, closed)
+        return response
+
+    def _server_timing(self, response, queries, stages, duration):
+        timings = [f'sql;dur={queries.duration * 1000:.1f};desc="{queries.count} queries"']
+        timings += [f'{name.replace(".", "-")};dur={seconds * 1000:.1f}' for name, seconds in stages]
+        timings.append(f'total;dur={duration * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+
+
+def _observe(request, response, queries, duration):
+    # Label by route name rather than path to keep the series bounded
+    match = getattr(request, 'resolver_match', None)
+    view = (match.view_name or match._func_path) if match else 'unresolved'
+
+    metrics.registry.observe('portal_request_duration_seconds', duration, view=view)
+    metrics.registry.observe('portal_request_sql_queries', queries.count, view=view)
+    metrics.registry.observe('portal_request_sql_duration_seconds', queries.duration, view=view)
+    metrics.registry.increment('portal_requests_total', view=view, status=response.status_code)
+
+
+class _TimedBody:
+    """Streaming body that counts the queries made while producing it and reports when closed
+
+    The response closes it after the server has sent the body or the client
+    has gone away, including when it was never iterated.
+    """
+
+    def __init__(self, content, queries, on_close):
+        self.content = content
+        self.queries = queries
+        self.on_close = on_close
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+
+class _TimedContent(_TimedBody):
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with _timing_queries(self.queries):
+            return next(self.content)
+
+
+class _AsyncTimedContent(_TimedBody):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        with _timing_queries(self.queries):
+            return await self.content.__anext__()
+
+
+def _timing_queries(queries):
+    """Install ``queries`` as execute wrapper on every configured connection"""
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(queries))
+    return stack
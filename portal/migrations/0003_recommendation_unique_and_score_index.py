@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 19:46
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def remove_duplicate_recommendations(apps, schema_editor):
+    """Keep only the newest row per (user, treatment, condition)"""
+    Recommendation = apps.get_model('portal', 'Recommendation')
+    newer = Recommendation.objects.filter(
+        user=OuterRef('user'), treatment=OuterRef('treatment'), condition=OuterRef('condition'), id__gt=OuterRef('id')
+    )
+    Recommendation.objects.filter(Exists(newer)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0002_trainingjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_recommendations, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recommendation',
+            index=models.Index(fields=['user', '-score'], name='portal_rec_user_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recommendation',
+            constraint=models.UniqueConstraint(fields=('user', 'treatment', 'condition'), name='unique_user_treatment_condition'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 19:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0003_recommendation_unique_and_score_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trainingjob',
+            name='treatment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='training_jobs', to='portal.treatment'),
+        ),
+        migrations.AlterField(
+            model_name='trainingjob',
+            name='kind',
+            field=models.CharField(choices=[('full', 'Full retrain'), ('user', 'User rescore'), ('treatment', 'Treatment update')], default='full', max_length=10),
+        ),
+    ]
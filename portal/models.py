@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.text import Truncator
 from accounts.models import CustomUser
 
 class MedicalCondition(models.Model):
@@ -27,6 +31,60 @@ class UserHealth(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Health Profile"
 
+class RecommendationManager(models.Manager):
+    def replace_for_users(self, entries, user_ids):
+        """Store freshly scored recommendations for ``user_ids``
+
+        ``entries`` are (user_id, treatment_id, condition_id, score) tuples.
+        Existing rows are updated in place by one upsert, and rows whose
+        condition the user or the treatment no longer has are deleted by
+        one statement.
+        """
+        with transaction.atomic():
+            self._upsert(entries)
+            self._delete_stale(user_ids)
+            DashboardSnapshot.objects.refresh_for_users(user_ids)
+
+    def _upsert(self, entries):
+        self.bulk_create(
+            [
+                Recommendation(user_id=user_id, treatment_id=treatment_id, condition_id=condition_id, score=score)
+                for user_id, treatment_id, condition_id, score in entries
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'treatment', 'condition'],
+            update_fields=['score'],
+        )
+
+    def _delete_stale(self, user_ids):
+        user_has_condition = UserHealth.conditions.through.objects.filter(
+            userhealth__user_id=OuterRef('user_id'), medicalcondition_id=OuterRef('condition_id')
+        )
+        treatment_has_condition = Treatment.conditions.through.objects.filter(
+            treatment_id=OuterRef('treatment_id'), medicalcondition_id=OuterRef('condition_id')
+        )
+        self.filter(user_id__in=user_ids).exclude(
+            Exists(user_has_condition) & Exists(treatment_has_condition)
+        ).delete()
+
+    def page_for_user(self, user_id, limit, after=None):
+        """Queryset of up to ``limit`` recommendations of a user by descending (score, id)
+
+        ``after`` is the (score, id) of the last row of the previous page.
+        """
+        recommendations = self.filter(user_id=user_id).select_related('treatment', 'condition').order_by('-score', '-id')
+        if after is not None:
+            score, pk = after
+            recommendations = recommendations.filter(Q(score__lt=score) | Q(score=score, id__lt=pk))
+        return recommendations[:limit]
+
+    def replace_for_user(self, user_id, entries):
+        """Store freshly scored (treatment_id, condition_id, score) entries for one user"""
+        self.replace_for_users(
+            [(user_id, treatment_id, condition_id, score) for treatment_id, condition_id, score in entries],
+            [user_id],
+        )
+
 class Recommendation(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='recommendations')
     treatment = models.ForeignKey(Treatment, on_delete=models.CASCADE)
@@ -34,8 +92,123 @@ class Recommendation(models.Model):
     score = models.FloatField(default=0.0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = RecommendationManager()
+
     class Meta:
         ordering = ['-score', '-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'treatment', 'condition'], name='unique_user_treatment_condition'),
+        ]
+        indexes = [
+            # Top-N by score for one user (dashboard, recommendations page)
+            models.Index(fields=['user', '-score'], name='portal_rec_user_score_idx'),
+        ]
 
     def __str__(self):
         return f"Recommendation for {self.user.username}: {self.treatment.name}"
+
+class DashboardSnapshotManager(models.Manager):
+    # Recommendations shown on the dashboard
+    TOP_N = 5
+
+    def for_user(self, user):
+        """Dashboard payload of a user, building it (and their health profile) if missing"""
+        payload = self.filter(user=user).values_list('payload', flat=True).first()
+        if payload is None:
+            UserHealth.objects.get_or_create(user=user)
+            payload = self.refresh_for_users([user.pk])[user.pk]
+        return payload
+
+    def refresh_for_users(self, user_ids):
+        """Rebuild the snapshots of ``user_ids`` with three reads and one upsert
+
+        Returns the new payloads by user id. Users without a health profile
+        get no snapshot.
+        """
+        user_ids = list(user_ids)
+        payloads = {
+            profile.pop('user_id'): {'health_profile': dict(profile, conditions=[]), 'recommendations': []}
+            for profile in UserHealth.objects.filter(user_id__in=user_ids).values('user_id', 'age', 'height', 'weight')
+        }
+        if not payloads:
+            return payloads
+
+        conditions = UserHealth.conditions.through.objects.filter(
+            userhealth__user_id__in=payloads
+        ).order_by('medicalcondition__name').values_list('userhealth__user_id', 'medicalcondition__name')
+        for user_id, name in conditions:
+            payloads[user_id]['health_profile']['conditions'].append(name)
+
+        # Top recommendations of every user in one query
+        top = Recommendation.objects.filter(user_id__in=payloads).annotate(
+            rank=Window(RowNumber(), partition_by=F('user_id'), order_by=[F('score').desc(), F('created_at').desc()])
+        ).filter(rank__lte=self.TOP_N).order_by('user_id', 'rank').values_list(
+            'user_id', 'treatment__name', 'treatment__description', 'condition__name', 'score'
+        )
+        for user_id, treatment, description, condition, score in top:
+            payloads[user_id]['recommendations'].append({
+                'treatment': {'name': treatment, 'description': Truncator(description).words(20)},
+                'condition': {'name': condition},
+                'score': score,
+            })
+
+        self.bulk_create(
+            [DashboardSnapshot(user_id=user_id, payload=payload) for user_id, payload in payloads.items()],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['payload', 'updated_at'],
+        )
+        return payloads
+
+    def invalidate_users(self, user_ids):
+        """Drop snapshots so they are rebuilt on the next write or dashboard visit"""
+        self.filter(user_id__in=user_ids).delete()
+
+class DashboardSnapshot(models.Model):
+    """Everything the dashboard renders for a user, kept up to date on writes"""
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='dashboard_snapshot')
+    payload = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DashboardSnapshotManager()
+
+    def __str__(self):
+        return f"Dashboard snapshot for user {self.user_id}"
+
+class TrainingJob(models.Model):
+    """Queued recommender run, coalescing repeated requests for the same work"""
+    KIND_CHOICES = (
+        ('full', 'Full retrain'),
+        ('user', 'User rescore'),
+        ('treatment', 'Treatment update'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='full')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True, related_name='training_jobs')
+    treatment = models.ForeignKey(Treatment, on_delete=models.CASCADE, null=True, blank=True, related_name='training_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    request_count = models.PositiveIntegerField(default=1, help_text="Requests coalesced into this job")
+    created_at = models.DateTimeField(auto_now_add=True)
+    requested_at = models.DateTimeField(default=timezone.now, help_text="Time of the latest coalesced request")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Run time in seconds")
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-requested_at']
+        indexes = [
+            models.Index(fields=['status', 'requested_at']),
+        ]
+
+    def __str__(self):
+        if self.kind == 'user':
+            return f"Rescore user {self.user_id} ({self.status})"
+        if self.kind == 'treatment':
+            return f"Update treatment {self.treatment_id} ({self.status})"
+        return f"Full retrain ({self.status})"
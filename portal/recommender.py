@@ -1,144 +1,603 @@
 import numpy as np
-import pandas as pd
+from scipy import sparse
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import StandardScaler
-import joblib
-import os
-from pathlib import Path
-from .models import UserHealth, Treatment, MedicalCondition, Recommendation
+import time
+from django.conf import settings
+from .models import UserHealth, Treatment, Recommendation
+from .features import (
+    NUMERIC_COLUMNS, FeatureSchema, build_user_features, build_treatment_features, iter_user_features,
+)
+from .jobs import enqueue_training
+from .candidates import candidate_index
+from .artifacts import ModelStore
+from .cohorts import Cohorts
+from .metrics import stage
+
+# Users rescored per query when a treatment changes
+RESCORE_BLOCK_SIZE = 1000
+# Cohort score rows kept per process before the cache is cleared
+COHORT_CACHE_SIZE = 1000
+# Dense copies of a block's similarity rows alive at once while scoring it
+SIMILARITY_COPIES = 3
+# Share of a score that depends on the treatment's effectiveness (0 to 1)
+EFFECTIVENESS_WEIGHT = 0.5
+EFFECTIVENESS_COLUMN = NUMERIC_COLUMNS.index('effectiveness')
+# Stored with each model; versions scored another way are refit before use
+SCORING = 'condition-cosine-by-effectiveness'
+
+
+def _take(row, columns):
+    """Scores at ``columns``, NaN where the row predates a treatment"""
+    scores = np.full(len(columns), np.nan)
+    covered = columns < len(row)
+    scores[covered] = row[columns[covered]]
+    return scores
+
+
+def _patches_by_user(arrays):
+    """Group stored (user, column, score) patches by user"""
+    patches = {}
+    if 'patch_user_ids' in arrays:
+        for user_id, column, score in zip(
+            arrays['patch_user_ids'].tolist(), arrays['patch_columns'].tolist(), arrays['patch_scores'].tolist()
+        ):
+            patches.setdefault(user_id, {})[column] = score
+    return patches
+
+
+def _scores(users, treatments, scaler):
+    """Scores of scaled user rows against scaled treatment rows
+
+    Treatments leave the demographic columns empty and users the
+    effectiveness column, so those would only lengthen the vectors and
+    shrink every cosine. The score is the cosine of the condition columns,
+    weighted by the treatment's effectiveness so that of two treatments
+    for the same conditions the more effective one ranks higher.
+    """
+    numeric = len(NUMERIC_COLUMNS)
+    similarity = cosine_similarity(users[:, numeric:], treatments[:, numeric:])
+    effectiveness = treatments[:, EFFECTIVENESS_COLUMN].toarray().ravel() * scaler.scale_[EFFECTIVENESS_COLUMN]
+    weight = 1 - EFFECTIVENESS_WEIGHT + EFFECTIVENESS_WEIGHT * np.clip(effectiveness, 0, 1)
+    return similarity * weight
+
+
+def _similarity_block_rows(n_treatments):
+    """Users scored at once in training, so dense intermediates stay within the memory budget"""
+    row_bytes = SIMILARITY_COPIES * n_treatments * np.dtype(np.float64).itemsize
+    return max(1, settings.RECOMMENDER_TRAINING_MEMORY_MB * 2 ** 20 // max(row_bytes, 1))
+
 
 class HealthRecommender:
     """AI-based health treatment recommender system"""
-    
+
     def __init__(self):
-        self.model_path = Path(__file__).resolve().parent / 'models'
-        self.model_path.mkdir(exist_ok=True)
-        self.scaler_file = self.model_path / 'scaler.joblib'
-        self.similarity_matrix_file = self.model_path / 'similarity_matrix.joblib'
-        
+        self.store = ModelStore(settings.RECOMMENDER_MODEL_DIR)
+        self._load()
+
+    def _load(self):
+        """Load the current model version, or start untrained"""
+        self.version = self.store.current_version()
+        self._signature = self.store.signature(self.version)
+
         # Initialize or load models
-        if os.path.exists(self.scaler_file) and os.path.exists(self.similarity_matrix_file):
-            self.scaler = joblib.load(self.scaler_file)
-            self.similarity_matrix = joblib.load(self.similarity_matrix_file)
+        model = self.store.load(self.version)
+        schema = None
+        # Versions scored another way are not served either; the next fit replaces them
+        if model is not None and model['manifest'].get('scoring') == SCORING:
+            try:
+                schema = FeatureSchema.from_manifest(model['manifest'], model['arrays']['condition_ids'])
+            except ValueError:
+                # Trained on another feature layout; serve nothing until the next fit
+                schema = None
+        if schema is not None:
+            arrays = model['arrays']
+            self.scaler = model['scaler']
+            self.similarity_matrix = arrays['similarity']
+            self.user_ids = arrays['user_ids']
+            self.treatment_ids = arrays['treatment_ids']
+            self.treatment_features = model['treatment_features']
+            self.schema = schema
+            self.manifest = model['manifest']
+            self.trained_at = self.manifest['trained_at']
+            # Score rows of users rescored since the last full fit
+            self.user_overrides, self._overrides_position, _ = self.store.load_overrides(self.version)
+            # Scores of treatment columns recomputed since the last full fit
+            self.column_patches = _patches_by_user(arrays)
+            # In cohort mode similarity rows belong to cohorts, not users
+            self.user_cohorts = arrays.get('user_cohorts')
+            self.cohorts = Cohorts(arrays['cohort_centroids']) if 'cohort_centroids' in arrays else None
         else:
-            self.scaler = StandardScaler()
+            self.scaler = None
             self.similarity_matrix = None
-    
-    def _prepare_data(self):
+            self.user_ids = None
+            self.treatment_ids = None
+            self.treatment_features = None
+            self.schema = None
+            self.manifest = None
+            self.trained_at = None
+            self.user_overrides = {}
+            self._overrides_position = None
+            self.column_patches = {}
+            self.user_cohorts = None
+            self.cohorts = None
+        # Score rows of cohorts scored since loading, by cohort key
+        self.cohort_scores = {}
+
+    @property
+    def published_at(self):
+        """Unix time the loaded model was published, or None"""
+        published = self._signature[0]
+        return published / 1e9 if published is not None else None
+
+    def refresh(self):
+        """Swap to a newer model or overrides published by another process (e.g. the worker)"""
+        signature = self.store.signature(self.version)
+        if signature[0] != self._signature[0]:
+            self._load()
+        elif signature != self._signature:
+            self._refresh_overrides()
+
+    def _refresh_overrides(self):
+        """Read the override rows appended since the last read, without reloading the model"""
+        # Taken first, so that rows appended while reading are read next time
+        self._signature = self.store.signature(self.version)
+        if self.similarity_matrix is None:
+            return
+        rows, self._overrides_position, complete = self.store.load_overrides(self.version, self._overrides_position)
+        if complete:
+            self.user_overrides = rows
+        else:
+            self.user_overrides.update(rows)
+
+    def _prepare_data(self, schema=None):
         """Prepare data for the recommender system"""
-        # Get all user health profiles
-        health_profiles = UserHealth.objects.all().prefetch_related('conditions')
-        
-        # Get all treatments
-        treatments = Treatment.objects.all().prefetch_related('conditions')
-        
-        # Create user features
-        user_features = []
-        for profile in health_profiles:
-            # Basic health metrics
-            features = {
-                'user_id': profile.user.id,
-                'age': profile.age or 0,
-                'height': profile.height or 0,
-                'weight': profile.weight or 0,
-            }
-            
-            # Add conditions as one-hot encoding
-            for condition in MedicalCondition.objects.all():
-                features[f'condition_{condition.id}'] = 1 if condition in profile.conditions.all() else 0
-            
-            user_features.append(features)
-        
-        # Create treatment features
-        treatment_features = []
-        for treatment in treatments:
-            features = {
-                'treatment_id': treatment.id,
-                'effectiveness': treatment.effectiveness_score,
-            }
-            
-            # Add conditions as one-hot encoding
-            for condition in MedicalCondition.objects.all():
-                features[f'condition_{condition.id}'] = 1 if condition in treatment.conditions.all() else 0
-            
-            treatment_features.append(features)
-        
-        # Convert to DataFrames
-        user_df = pd.DataFrame(user_features)
-        treatment_df = pd.DataFrame(treatment_features)
-        
-        return user_df, treatment_df
-    
+        # Stable column layout shared by users and treatments
+        if schema is None:
+            schema = FeatureSchema.from_database()
+
+        # Sparse user and treatment features, two queries per side
+        user_features = build_user_features(schema)
+        treatment_features = build_treatment_features(schema)
+
+        return user_features, treatment_features
+
+    def _user_chunks(self, schema):
+        return iter_user_features(schema, settings.RECOMMENDER_TRAINING_CHUNK_SIZE)
+
     def train(self):
-        """Train the recommender system"""
-        user_df, treatment_df = self._prepare_data()
-        
-        if user_df.empty or treatment_df.empty:
+        """Train the recommender system
+
+        Users are streamed in chunks of ``RECOMMENDER_TRAINING_CHUNK_SIZE``,
+        once to fit the scaler and once to score them (plus once to fit
+        the clusters in cohort mode), so only a chunk of user features is
+        in memory at a time. Similarity rows are computed in blocks sized to
+        ``RECOMMENDER_TRAINING_MEMORY_MB`` and appended to a file on disk,
+        so the full matrix is never in memory either.
+        """
+        with stage('train.prepare'):
+            schema = FeatureSchema.from_database()
+            treatment_features = build_treatment_features(schema)
+        if treatment_features.empty:
             return False
-        
-        # Extract features (excluding IDs)
-        user_features = user_df.drop('user_id', axis=1).values
-        treatment_features = treatment_df.drop('treatment_id', axis=1).values
-        
-        # Scale features
-        user_features_scaled = self.scaler.fit_transform(user_features)
-        treatment_features_scaled = self.scaler.transform(treatment_features)
-        
-        # Calculate similarity matrix
-        self.similarity_matrix = cosine_similarity(user_features_scaled, treatment_features_scaled)
-        
-        # Save models
-        joblib.dump(self.scaler, self.scaler_file)
-        joblib.dump(self.similarity_matrix, self.similarity_matrix_file)
-        
+
+        # Scale features (sparse input, so no centering). The statistics come
+        # from users only; treatment-only columns keep unit scale.
+        with stage('train.fit'):
+            scaler = StandardScaler(with_mean=False)
+            for user_features in self._user_chunks(schema):
+                scaler.partial_fit(user_features.to_sparse())
+            if not hasattr(scaler, 'scale_'):
+                return False
+            treatment_features_scaled = scaler.transform(treatment_features.to_sparse())
+
+        cohorts = None
+        if settings.RECOMMENDER_COHORTS:
+            with stage('train.cohorts'):
+                cohorts = Cohorts.fit(
+                    (scaler.transform(user_features.to_sparse()) for user_features in self._user_chunks(schema)),
+                    settings.RECOMMENDER_COHORT_CLUSTERS,
+                )
+
+        # Score users block by block straight to disk, one row per cohort in cohort mode
+        writers = {
+            'similarity': self.store.array_writer((len(treatment_features),)),
+            'user_ids': self.store.array_writer(dtype=np.int64),
+        }
+        if cohorts is not None:
+            writers['user_cohorts'] = self.store.array_writer(dtype=np.int64)
+        block_rows = _similarity_block_rows(len(treatment_features))
+        try:
+            with stage('train.similarity'):
+                cohort_positions = {}
+                for user_features in self._user_chunks(schema):
+                    user_features_scaled = scaler.transform(user_features.to_sparse())
+                    if cohorts is not None:
+                        cohort_of_row, user_features_scaled = cohorts.assign(user_features_scaled, cohort_positions)
+                        writers['user_cohorts'].append(cohort_of_row)
+                    for start in range(0, user_features_scaled.shape[0], block_rows):
+                        writers['similarity'].append(_scores(
+                            user_features_scaled[start:start + block_rows], treatment_features_scaled, scaler
+                        ))
+                    writers['user_ids'].append(user_features.ids)
+                if not writers['user_ids'].rows:
+                    return False
+                arrays = {name: writer.finish() for name, writer in writers.items()}
+
+            if cohorts is not None:
+                arrays['cohort_centroids'] = cohorts.centroids
+
+            # Publish a new model version, then switch to it
+            with stage('train.publish'):
+                self.store.publish(
+                    dict(arrays, treatment_ids=treatment_features.ids, condition_ids=schema.conditions.condition_ids),
+                    scaler,
+                    treatment_features_scaled,
+                    {
+                        'trained_at': time.time(),
+                        'users': len(arrays['user_ids']),
+                        'treatments': len(treatment_features),
+                        'schema': schema.to_manifest(),
+                        'columns': schema.column_names(),
+                        'cohorts': len(arrays['similarity']) if cohorts is not None else None,
+                        'scoring': SCORING,
+                    },
+                )
+                self._load()
+        finally:
+            # The published version holds its own links to the files
+            for writer in writers.values():
+                writer.discard()
+
         return True
-    
-    def get_recommendations(self, user_id, top_n=5):
-        """Get treatment recommendations for a user"""
-        if self.similarity_matrix is None:
-            self.train()
-            
+
+    def _scale(self, features):
+        """Scale a feature matrix, leaving condition columns added since the fit at unit scale"""
+        matrix = features.to_sparse()
+        fitted = self.scaler.n_features_in_
+        if matrix.shape[1] == fitted:
+            return self.scaler.transform(matrix)
+        return sparse.hstack([self.scaler.transform(matrix[:, :fitted]), matrix[:, fitted:]], format='csr')
+
+    def _similarity(self, scaled, columns=None):
+        """Similarity of scaled user rows to the treatments (or just ``columns``)
+
+        In cohort mode each distinct cohort among the rows is scored once,
+        or not at all when it was scored before, and its members share the row.
+        """
+        if self.cohorts is None:
+            treatment_features = self.treatment_features
+            if columns is not None:
+                treatment_features = treatment_features[columns]
+            return _scores(scaled, treatment_features, self.scaler)
+
+        positions = {}
+        cohort_of_row, representatives = self.cohorts.assign(scaled, positions)
+        keys = list(positions)
+        missing = [position for position, key in enumerate(keys) if key not in self.cohort_scores]
+        if missing:
+            if len(self.cohort_scores) + len(missing) > COHORT_CACHE_SIZE:
+                self.cohort_scores = {}
+                missing = list(range(len(keys)))
+            scores = _scores(representatives[missing], self.treatment_features, self.scaler)
+            for position, row in zip(missing, scores):
+                self.cohort_scores[keys[position]] = row
+        scores = np.array([self.cohort_scores[key] for key in keys])[cohort_of_row]
+        return scores if columns is None else scores[:, columns]
+
+    def needs_full_refit(self):
+        """Whether incremental updates have drifted too far from the last fit"""
         if self.similarity_matrix is None:
+            return True
+
+        # Scheduled refit
+        if time.time() - self.trained_at > settings.RECOMMENDER_REFIT_INTERVAL:
+            return True
+
+        # Too many users rescored against scaler statistics they didn't shape
+        return len(self.user_overrides) > settings.RECOMMENDER_MAX_DRIFT * max(len(self.user_ids), 1)
+
+    def score_user(self, user_id, columns=None):
+        """Score one user against the fitted model without storing the result
+
+        Only the treatment ``columns`` are scored when given. Returns None
+        when the user has no profile or has a condition the fitted column
+        layout doesn't know.
+        """
+        user_features = build_user_features(self.schema, user_ids=[user_id])
+
+        # Conditions added since the last fit have no column yet
+        if user_features.empty or user_features.unknown_conditions:
+            return None
+
+        return self._similarity(self._scale(user_features), columns)[0]
+
+    def update_user(self, user_id):
+        """Rescore one user against the fitted model, refitting only when due"""
+        if self.needs_full_refit():
+            return self.train()
+
+        user_scores = self.score_user(user_id)
+        if user_scores is None:
+            if not UserHealth.objects.filter(user_id=user_id).exists():
+                # A deleted profile leaves nothing to recommend
+                Recommendation.objects.filter(user_id=user_id).delete()
+                return False
+            return self.train()
+
+        self.user_overrides[user_id] = user_scores
+        self.store.append_override(self.version, self.user_overrides, user_id)
+        self._refresh_overrides()
+
+        candidates, columns = self._candidates(self._user_conditions(user_id))
+        self._save_recommendations(user_id, candidates, user_scores[columns])
+
+        return True
+
+    def score_users(self, user_ids):
+        """Score a block of users at once against the fitted model
+
+        Returns (user_id, treatment_id, condition_id, score) entries for
+        every treatment sharing a condition with each user, ready for
+        ``Recommendation.objects.replace_for_users``. Conditions added since
+        the last fit are ignored until the next refit.
+        """
+        user_features = build_user_features(self.schema, user_ids=user_ids)
+        if user_features.empty:
             return []
-        
-        user_df, treatment_df = self._prepare_data()
-        
-        # Find user index
+
+        scores = self._similarity(self._scale(user_features))
+        return self._block_entries(user_features, scores)
+
+    def _block_entries(self, user_features, scores):
+        """Recommendation entries for a block of users from their score rows"""
+        entries = []
+        condition_block = user_features.conditions
+        # Users with the same conditions have the same candidates
+        candidates_by_conditions = {}
+        for row, user_id in enumerate(user_features.ids.tolist()):
+            # The user's conditions are the non-zero columns of their row
+            condition_columns = condition_block.indices[condition_block.indptr[row]:condition_block.indptr[row + 1]]
+            key = condition_columns.tobytes()
+            if key not in candidates_by_conditions:
+                candidates_by_conditions[key] = self._candidates(
+                    self.schema.conditions.condition_ids[condition_columns].tolist()
+                )
+            candidates, columns = candidates_by_conditions[key]
+            entries.extend(
+                (user_id, treatment_id, condition_id, score)
+                for treatment_id, condition_id, score in self._entries(candidates, scores[row, columns])
+            )
+        return entries
+
+    def update_treatment(self, treatment_id):
+        """Recompute one treatment and re-rank only the users it can be recommended to
+
+        The treatment's feature row is rebuilt (conditions created since the
+        fit get new columns at unit scale) and published as a new model
+        version together with the affected users' scores for its column;
+        everything else is reused from the current version. Falls back to
+        a full fit when the change can't be applied this way.
+        """
+        if self.similarity_matrix is None:
+            return self.train()
+
+        # A deleted treatment simply drops out of the candidate index
+        if not Treatment.objects.filter(pk=treatment_id).exists():
+            return False
+        condition_ids = list(Treatment.conditions.through.objects.filter(
+            treatment_id=treatment_id
+        ).values_list('medicalcondition_id', flat=True))
+        # The edit may have been made by another process after this one's last look at the links
+        candidate_index.validate_treatment(treatment_id, condition_ids)
+
+        # New conditions have the highest ids, so their columns go at the end
+        schema = self.schema
+        known_conditions = schema.conditions.condition_ids
+        new_conditions = sorted(set(condition_ids) - set(known_conditions.tolist()))
+        if new_conditions:
+            if len(known_conditions) and new_conditions[0] < known_conditions[-1]:
+                return self.train()
+            schema = schema.with_conditions(new_conditions)
+
+        treatment_features = self.treatment_features
+        if treatment_features.shape[1] < schema.width:
+            padding = sparse.csr_matrix((treatment_features.shape[0], schema.width - treatment_features.shape[1]))
+            treatment_features = sparse.hstack([treatment_features, padding], format='csr')
+        row = self._scale(build_treatment_features(schema, treatment_ids=[treatment_id]))
+
+        column = int(np.searchsorted(self.treatment_ids, treatment_id))
+        if column < len(self.treatment_ids) and self.treatment_ids[column] == treatment_id:
+            old_row = treatment_features[column]
+            if not new_conditions and (old_row != row).nnz == 0:
+                # Nothing the model uses changed, e.g. only the description
+                return True
+            old_conditions = schema.condition_ids_of(
+                old_row.indices[old_row.indices >= len(schema.numeric_columns)]
+            ).tolist()
+            treatment_features = sparse.vstack(
+                [treatment_features[:column], row, treatment_features[column + 1:]], format='csr'
+            )
+            treatment_ids = self.treatment_ids
+        elif column == len(self.treatment_ids):
+            old_conditions = []
+            treatment_features = sparse.vstack([treatment_features, row], format='csr')
+            treatment_ids = np.append(self.treatment_ids, treatment_id)
+        else:
+            # Ids only decrease when one is reused after a deletion
+            return self.train()
+
+        # Users who gain or lose this treatment as a candidate
+        user_ids = list(UserHealth.conditions.through.objects.filter(
+            medicalcondition_id__in=set(condition_ids) | set(old_conditions)
+        ).values_list('userhealth__user_id', flat=True).distinct())
+
+        # Score against the updated catalog; _load() restores whatever is published
+        self.treatment_ids = treatment_ids
+        self.treatment_features = treatment_features
+        self.schema = schema
+        self.cohort_scores = {}
         try:
-            user_idx = user_df[user_df['user_id'] == user_id].index[0]
-        except (IndexError, KeyError):
-            return []
-        
-        # Get similarity scores for this user
-        user_scores = self.similarity_matrix[user_idx]
-        
-        # Create recommendations
-        recommendations = []
-        for i, score in enumerate(user_scores):
-            treatment_id = treatment_df.iloc[i]['treatment_id']
-            treatment = Treatment.objects.get(id=treatment_id)
-            
-            # Get conditions that match between user and treatment
-            user_health = UserHealth.objects.get(user_id=user_id)
-            user_conditions = user_health.conditions.all()
-            treatment_conditions = treatment.conditions.all()
-            
-            # Find matching conditions
-            matching_conditions = set(user_conditions).intersection(set(treatment_conditions))
-            
-            # Create a recommendation for each matching condition
-            for condition in matching_conditions:
-                # Check if recommendation already exists
-                rec, created = Recommendation.objects.update_or_create(
-                    user_id=user_id,
-                    treatment=treatment,
-                    condition=condition,
-                    defaults={'score': float(score)}
+            entries = []
+            patches = [
+                (user_id, patch_column, score)
+                for user_id, user_patches in self.column_patches.items()
+                for patch_column, score in user_patches.items()
+                if patch_column != column
+            ]
+            overrides = dict(self.user_overrides)
+            for start in range(0, len(user_ids), RESCORE_BLOCK_SIZE):
+                user_features = build_user_features(schema, user_ids=user_ids[start:start + RESCORE_BLOCK_SIZE])
+                scores = self._similarity(self._scale(user_features))
+                entries.extend(self._block_entries(user_features, scores))
+                for user_id, user_scores in zip(user_features.ids.tolist(), scores):
+                    patches.append((user_id, column, user_scores[column]))
+                    if user_id in overrides:
+                        overrides[user_id] = user_scores
+
+            patch_user_ids, patch_columns, patch_scores = zip(*patches) if patches else ((), (), ())
+            self.store.publish(
+                {
+                    'similarity': self.similarity_matrix,
+                    'user_ids': self.user_ids,
+                    'treatment_ids': treatment_ids,
+                    'condition_ids': schema.conditions.condition_ids,
+                    'patch_user_ids': np.array(patch_user_ids, dtype=np.int64),
+                    'patch_columns': np.array(patch_columns, dtype=np.int64),
+                    'patch_scores': np.array(patch_scores, dtype=np.float64),
+                    **self._cohort_arrays(),
+                },
+                self.scaler,
+                treatment_features,
+                dict(
+                    self.manifest, treatments=len(treatment_ids),
+                    schema=schema.to_manifest(), columns=schema.column_names(),
+                ),
+                overrides=overrides,
+            )
+        finally:
+            self._load()
+
+        Recommendation.objects.replace_for_users(entries, user_ids)
+        return True
+
+    def _cohort_arrays(self):
+        """Cohort assignment arrays of the loaded model, for versions derived from it"""
+        if self.cohorts is None:
+            return {}
+        return {'user_cohorts': self.user_cohorts, 'cohort_centroids': self.cohorts.centroids}
+
+    def _fitted_scores(self, user_id):
+        """Similarity row for a user from the last full fit, with later treatment updates applied
+
+        Treatments added since the fit are NaN unless they were scored for this user.
+        """
+        # Find user index (user ids are stored sorted with the model)
+        user_idx = np.searchsorted(self.user_ids, user_id)
+        fitted = user_idx < len(self.user_ids) and self.user_ids[user_idx] == user_id
+        patches = self.column_patches.get(user_id, {})
+        if not fitted and not patches:
+            return None
+
+        user_scores = np.full(len(self.treatment_ids), np.nan)
+        if fitted:
+            row = user_idx if self.user_cohorts is None else self.user_cohorts[user_idx]
+            fitted_scores = self.similarity_matrix[row]
+            user_scores[:len(fitted_scores)] = fitted_scores
+        for column, score in patches.items():
+            user_scores[column] = score
+        return user_scores
+
+    def _user_scores(self, user_id, columns):
+        """Similarity scores of a user for some treatment columns, preferring incremental updates"""
+        user_scores = self.user_overrides.get(user_id)
+        if user_scores is None:
+            user_scores = self._fitted_scores(user_id)
+        if user_scores is not None:
+            user_scores = _take(user_scores, columns)
+            if not np.isnan(user_scores).any():
+                return user_scores
+
+        # Users created after the last fit, or treatments added since their
+        # row was scored, are scored on first use
+        user_scores = self.score_user(user_id, columns)
+        if user_scores is None:
+            # Let the worker refit for conditions the model doesn't know yet
+            enqueue_training(user_id=user_id)
+        return user_scores
+
+    def _user_conditions(self, user_id):
+        """Condition ids of one user's health profile"""
+        return list(UserHealth.conditions.through.objects.filter(
+            userhealth__user_id=user_id
+        ).values_list('medicalcondition_id', flat=True))
+
+    def _candidates(self, condition_ids):
+        """Treatments sharing any of ``condition_ids``, with their matrix columns
+
+        Returns a list of (treatment_id, shared condition ids) and the
+        matching array of columns. Treatments added since the last fit
+        have no column yet and are left out until the next refit.
+        """
+        candidates = candidate_index.candidates(condition_ids)
+
+        treatment_ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        columns = np.searchsorted(self.treatment_ids, treatment_ids)
+        columns = np.minimum(columns, len(self.treatment_ids) - 1)
+        fitted = self.treatment_ids[columns] == treatment_ids
+
+        return [(t, candidates[t]) for t in treatment_ids[fitted].tolist()], columns[fitted]
+
+    def _entries(self, candidates, scores):
+        """One (treatment_id, condition_id, score) entry per shared condition"""
+        return [
+            (treatment_id, condition_id, float(score))
+            for (treatment_id, condition_ids), score in zip(candidates, scores)
+            for condition_id in condition_ids
+        ]
+
+    def _save_recommendations(self, user_id, candidates, scores):
+        """Persist one recommendation per (treatment, shared condition) for a user"""
+        Recommendation.objects.replace_for_user(user_id, self._entries(candidates, scores))
+
+    def get_recommendations(self, user_id, top_n=5):
+        """Get treatment recommendations for a user
+
+        ``RECOMMENDER_SCORING_KERNEL`` picks the scores: the fitted feature
+        similarity (``model``) or the overlap of condition sets (``bitset``).
+        """
+        self.refresh()
+
+        if settings.RECOMMENDER_SCORING_KERNEL == 'bitset':
+            # Every treatment scored at once from packed condition sets; no fitted model needed
+            with stage('recommend.score'):
+                candidates, scores = candidate_index.bitsets().match(
+                    self._user_conditions(user_id), settings.RECOMMENDER_BITSET_METRIC
                 )
-                recommendations.append(rec)
-        
-        # Return top N recommendations
-        return sorted(recommendations, key=lambda x: x.score, reverse=True)[:top_n]
+        else:
+            # Training happens in the recommender worker, never in the request
+            if self.similarity_matrix is None:
+                enqueue_training()
+                return []
+
+            # Score only the treatments that share a condition with this user
+            with stage('recommend.candidates'):
+                candidates, columns = self._candidates(self._user_conditions(user_id))
+            if candidates:
+                with stage('recommend.score'):
+                    scores = self._user_scores(user_id, columns)
+                if scores is None:
+                    return []
+            else:
+                scores = []
 
-# Create a singleton instance
-recommender = HealthRecommender()
+        with stage('recommend.save'):
+            self._save_recommendations(user_id, candidates, scores)
+
+        # Return top N recommendations
+        with stage('recommend.read'):
+            return list(
+                Recommendation.objects.filter(user_id=user_id)
+                .select_related('treatment', 'condition')
+                .order_by('-score', '-id')[:top_n]
+            )
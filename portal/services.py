@@ -0,0 +1,22 @@
+import threading
+
+_lock = threading.Lock()
+_recommender = None
+
+
+def get_recommender():
+    """The process-wide HealthRecommender, created on first use
+
+    Importing ``portal.recommender`` pulls in numpy, scipy and scikit-learn
+    and loading it maps the model files, so it is deferred until a request
+    or job actually needs recommendations. Login, home and admin requests
+    never pay for it.
+    """
+    global _recommender
+    if _recommender is None:
+        with _lock:
+            if _recommender is None:
+                from .recommender import HealthRecommender
+
+                _recommender = HealthRecommender()
+    return _recommender
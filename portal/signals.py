@@ -0,0 +1,108 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from accounts.models import CustomUser
+from .models import Treatment, MedicalCondition, UserHealth, Recommendation, DashboardSnapshot
+from .candidates import candidate_index
+from .cache import recommendation_cache
+from .jobs import enqueue_rescores, enqueue_training
+
+
+@receiver(m2m_changed, sender=Treatment.conditions.through)
+def treatment_conditions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Rebuild the candidate index and update the treatments that gained or lost conditions"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    candidate_index.invalidate()
+    recommendation_cache.invalidate_all()
+    if not reverse:
+        enqueue_training(treatment_id=instance.pk)
+    elif pk_set:
+        # Changed from the condition side; pk_set holds Treatment ids
+        for treatment_id in pk_set:
+            enqueue_training(treatment_id=treatment_id)
+    else:
+        # A condition was cleared from an unknown set of treatments
+        enqueue_training()
+
+
+@receiver(post_delete, sender=Treatment)
+@receiver(post_delete, sender=MedicalCondition)
+def catalog_entry_deleted(sender, **kwargs):
+    """Deleting either side cascades to the through table without m2m_changed"""
+    candidate_index.invalidate()
+    recommendation_cache.invalidate_all()
+
+
+@receiver(post_save, sender=Treatment)
+@receiver(post_save, sender=MedicalCondition)
+def catalog_entry_saved(sender, **kwargs):
+    """Cached recommendations embed treatment and condition details"""
+    recommendation_cache.invalidate_all()
+
+
+@receiver(post_save, sender=Treatment)
+def treatment_saved(sender, instance, **kwargs):
+    """Recompute the treatment's column, e.g. for a new effectiveness score
+
+    New conditions need no job of their own: they only affect scores once
+    a treatment or a user is linked to them.
+    """
+    enqueue_training(treatment_id=instance.pk)
+
+
+@receiver(post_save, sender=Treatment)
+@receiver(pre_delete, sender=Treatment)
+def treatment_renamed_or_deleted(sender, instance, **kwargs):
+    """Dashboards embed the names and descriptions of recommended treatments"""
+    DashboardSnapshot.objects.invalidate_users(
+        Recommendation.objects.filter(treatment=instance).values('user_id')
+    )
+
+
+@receiver(post_save, sender=MedicalCondition)
+@receiver(pre_delete, sender=MedicalCondition)
+def condition_renamed_or_deleted(sender, instance, **kwargs):
+    """Dashboards embed the names of profile and recommendation conditions"""
+    DashboardSnapshot.objects.invalidate_users(UserHealth.objects.filter(conditions=instance).values('user_id'))
+    DashboardSnapshot.objects.invalidate_users(Recommendation.objects.filter(condition=instance).values('user_id'))
+
+
+def _enqueue_rescore(user_id):
+    # A profile is also deleted along with its user, who then needs no job
+    if CustomUser.objects.filter(pk=user_id).exists():
+        enqueue_training(user_id=user_id)
+
+
+@receiver(post_save, sender=UserHealth)
+@receiver(post_delete, sender=UserHealth)
+def health_profile_changed(sender, instance, **kwargs):
+    """Queue a rescore of the user for any profile write, from a view, the admin or a script"""
+    recommendation_cache.invalidate_user(instance.user_id)
+    DashboardSnapshot.objects.invalidate_users([instance.user_id])
+    transaction.on_commit(partial(_enqueue_rescore, instance.user_id))
+
+
+@receiver(m2m_changed, sender=UserHealth.conditions.through)
+def health_profile_conditions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        recommendation_cache.invalidate_user(instance.user_id)
+        DashboardSnapshot.objects.invalidate_users([instance.user_id])
+        transaction.on_commit(partial(_enqueue_rescore, instance.user_id))
+    elif pk_set:
+        # Changed from the condition side; pk_set holds UserHealth ids
+        user_ids = list(UserHealth.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+        for user_id in user_ids:
+            recommendation_cache.invalidate_user(user_id)
+        DashboardSnapshot.objects.invalidate_users(user_ids)
+        transaction.on_commit(partial(enqueue_rescores, user_ids))
+    else:
+        # A condition was cleared from an unknown set of users
+        recommendation_cache.invalidate_all()
+        DashboardSnapshot.objects.all().delete()
+        transaction.on_commit(enqueue_training)
@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+@register.filter
+def multiply(value, factor):
+    """Multiply a number (or a formatted number string) by a factor"""
+    try:
+        return float(value) * float(factor)
+    except (TypeError, ValueError):
+        return ''
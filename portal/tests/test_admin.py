@@ -0,0 +1,107 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django_otp import DEVICE_ID_SESSION_KEY
+from django_otp.plugins.otp_totp.models import TOTPDevice
+from accounts.models import CustomUser
+from portal import admin as portal_admin
+from portal.admin import EstimatedCountPaginator
+from portal.models import Recommendation, TrainingJob, UserHealth
+from .utils import TEST_CACHES, create_catalog, create_patient
+
+
+class FakeConnection:
+    """Connection stand-in that reports PostgreSQL and a row estimate"""
+
+    vendor = 'postgresql'
+
+    def __init__(self, estimate):
+        self.cursor = mock.MagicMock()
+        self.cursor.return_value.__enter__.return_value.fetchone.return_value = (estimate,)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        conditions, _ = create_catalog()
+        for i in range(3):
+            create_patient(f'patient{i}', [conditions[i]])
+
+    def count(self, queryset, estimate=None):
+        if estimate is None:
+            return EstimatedCountPaginator(queryset, 10).count
+        with mock.patch.object(portal_admin, 'connections', {'default': FakeConnection(estimate)}):
+            return EstimatedCountPaginator(queryset, 10).count
+
+    def test_other_databases_are_counted_exactly(self):
+        self.assertEqual(self.count(UserHealth.objects.all()), 3)
+
+    def test_large_unfiltered_postgresql_tables_use_the_estimate(self):
+        self.assertEqual(self.count(UserHealth.objects.all(), estimate=250000.0), 250000)
+
+    def test_small_or_filtered_postgresql_tables_are_counted_exactly(self):
+        self.assertEqual(self.count(UserHealth.objects.all(), estimate=50.0), 3)
+        self.assertEqual(self.count(UserHealth.objects.filter(age__gte=0), estimate=250000.0), 3)
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    # Rescoring two of the ten users stays below the drift limit
+    RECOMMENDER_MAX_DRIFT=0.3,
+)
+class RecomputeActionTests(TestCase):
+    def setUp(self):
+        self.conditions, self.treatments = create_catalog()
+        self.users = [create_patient(f'patient{i}', [self.conditions[i % 6]]) for i in range(10)]
+        for user in self.users[:2]:
+            for treatment in self.treatments[:3]:
+                Recommendation.objects.create(user=user, treatment=treatment, condition=self.conditions[0], score=0.5)
+        TrainingJob.objects.all().delete()
+
+        admin_user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        # The admin site requires an OTP-verified session
+        session = self.client.session
+        session[DEVICE_ID_SESSION_KEY] = TOTPDevice.objects.create(user=admin_user, name='phone').persistent_id
+        session.save()
+
+    def run_action(self, model, action, pks):
+        url = reverse(f'admin:portal_{model}_changelist')
+        response = self.client.post(url, {'action': action, '_selected_action': pks}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        return [str(message) for message in response.context['messages']]
+
+    def queued(self):
+        return sorted(TrainingJob.objects.values_list('kind', 'user_id', 'treatment_id'), key=str)
+
+    def test_health_profile_action_queues_a_rescore_per_user(self):
+        pks = [user.health_profile.pk for user in self.users[:2]]
+        messages = self.run_action('userhealth', 'recompute_user_recommendations', pks)
+        self.assertEqual(messages, ['Queued recommendation recomputes for 2 users.'])
+        self.assertEqual(self.queued(), sorted([('user', user.pk, None) for user in self.users[:2]], key=str))
+
+    @override_settings(RECOMMENDER_MAX_DRIFT=0.1)
+    def test_health_profile_action_queues_a_full_retrain_for_many_users(self):
+        pks = [user.health_profile.pk for user in self.users[:5]]
+        messages = self.run_action('userhealth', 'recompute_user_recommendations', pks)
+        self.assertIn('queued a full retrain', messages[0])
+        self.assertEqual(self.queued(), [('full', None, None)])
+
+    def test_recommendation_action_queues_each_user_once(self):
+        pks = list(Recommendation.objects.values_list('pk', flat=True))
+        self.assertEqual(len(pks), 6)
+        messages = self.run_action('recommendation', 'recompute_recommendation_users', pks)
+        self.assertEqual(messages, ['Queued recommendation recomputes for 2 users.'])
+        self.assertEqual(self.queued(), sorted([('user', user.pk, None) for user in self.users[:2]], key=str))
+
+    def test_treatment_action_queues_a_treatment_update_each(self):
+        pks = [treatment.pk for treatment in self.treatments[:2]]
+        messages = self.run_action('treatment', 'update_treatment_recommendations', pks)
+        self.assertEqual(messages, ['Queued recommendation updates for 2 treatments.'])
+        self.assertEqual(self.queued(), sorted([('treatment', None, pk) for pk in pks], key=str))
+
+    def test_changelists_render(self):
+        for model in ('userhealth', 'recommendation', 'trainingjob'):
+            with self.subTest(model=model):
+                response = self.client.get(reverse(f'admin:portal_{model}_changelist'))
+                self.assertEqual(response.status_code, 200)
@@ -0,0 +1,74 @@
+from django.test import TestCase
+from django.urls import reverse
+from accounts.models import CustomUser
+from portal.jobs import enqueue_training
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+class RecommendationsApiTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, self.treatments = create_catalog()
+        self.user = create_patient('patient', self.conditions[:3])
+        for i in range(6):
+            create_patient(f'other{i}', [self.conditions[i]], age=20 + 10 * i)
+        get_recommender().train()
+        self.client.force_login(self.user)
+        self.url = reverse('api_recommendations')
+
+    def test_unchanged_recommendations_are_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Another page size is another representation
+        response = self.client.get(self.url, {'limit': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_change_replaces_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.user.health_profile.conditions.remove(self.conditions[2])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotIn('Condition 2', [rec['condition_name'] for rec in response.json()['recommendations']])
+
+    def test_rescores_by_the_worker_only_replace_the_rescored_users_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        other = CustomUser.objects.get(username='other1')
+        enqueue_training(user_id=other.pk)
+        self.drain_jobs()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        enqueue_training(user_id=self.user.pk)
+        self.drain_jobs()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_cursor_pages_cover_every_recommendation_once(self):
+        expected = [rec.id for rec in get_recommender().get_recommendations(self.user.pk, top_n=50)]
+        self.assertGreater(len(expected), 2)
+
+        seen = []
+        params = {'limit': 2}
+        while True:
+            page = self.client.get(self.url, params).json()
+            self.assertLessEqual(len(page['recommendations']), 2)
+            seen.extend(rec['id'] for rec in page['recommendations'])
+            if page['next_cursor'] is None:
+                break
+            params = {'limit': 2, 'cursor': page['next_cursor']}
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_and_limit_are_rejected(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'cursor': 'W10='}, {'limit': 0}, {'limit': 51}, {'limit': 'ten'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['status'], 'error')
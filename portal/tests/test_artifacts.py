@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from scipy import sparse
+from sklearn.preprocessing import StandardScaler
+from portal.artifacts import ModelStore
+from portal.recommender import HealthRecommender
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+class ModelStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.store = ModelStore(self.root, keep=2)
+
+    def publish(self, value=1.0, **kwargs):
+        arrays = {'similarity': np.full((2, 3), value)}
+        return self.store.publish(arrays, StandardScaler(), sparse.csr_matrix((3, 4)), {'value': value}, **kwargs)
+
+    def test_published_version_is_loaded_memory_mapped(self):
+        version = self.publish(0.5)
+        self.assertEqual(self.store.current_version(), version)
+        model = self.store.load()
+        self.assertEqual(model['manifest']['version'], version)
+        self.assertIsInstance(model['arrays']['similarity'], np.memmap)
+        self.assertEqual(model['arrays']['similarity'].tolist(), [[0.5] * 3] * 2)
+
+    def test_failed_publish_leaves_the_current_version_alone(self):
+        version = self.publish()
+        with mock.patch('portal.artifacts.joblib.dump', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.publish(2.0)
+        self.assertEqual(self.store.current_version(), version)
+        self.assertEqual(os.listdir(self.store.versions), [version])
+
+    def test_old_versions_are_pruned(self):
+        versions = [self.publish(float(i)) for i in range(4)]
+        self.assertEqual(sorted(os.listdir(self.store.versions)), versions[-2:])
+
+
+class HotReloadTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, _ = create_catalog()
+        for i in range(6):
+            create_patient(f'patient{i}', [self.conditions[i]])
+
+    def test_other_processes_swap_to_a_newly_published_model(self):
+        reader = HealthRecommender()
+        self.assertIsNone(reader.version)
+
+        get_recommender().train()
+        reader.refresh()
+        self.assertEqual(reader.version, get_recommender().version)
+        self.assertEqual(reader.user_ids.tolist(), get_recommender().user_ids.tolist())
+
+        # Nothing new, nothing loaded
+        with mock.patch.object(reader, '_load') as load:
+            reader.refresh()
+        load.assert_not_called()
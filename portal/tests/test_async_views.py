@@ -0,0 +1,65 @@
+import threading
+from unittest import mock
+from asgiref.sync import iscoroutinefunction
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.urls import reverse
+from accounts.middleware import CachedOTPMiddleware
+from portal.cache import recommendation_cache
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+# Plain static storage: there is no collectstatic manifest in tests
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AsyncViewTests(RecommenderTestMixin, TransactionTestCase):
+    """Committed data, since scoring runs on pool threads with their own connections"""
+
+    def setUp(self):
+        super().setUp()
+        self.conditions, _ = create_catalog()
+        self.user = create_patient('patient', self.conditions[:2])
+        for i in range(4):
+            create_patient(f'other{i}', [self.conditions[i]])
+        get_recommender().train()
+        self.client = AsyncClient()
+        self.client.force_login(self.user)
+
+    async def test_logged_out_users_are_sent_to_log_in(self):
+        client = AsyncClient()
+        for name in ('portal_dashboard_async', 'api_recommendations_async'):
+            with self.subTest(name=name):
+                response = await client.get(reverse(name))
+                self.assertEqual(response.status_code, 302)
+                self.assertIn('login', response['Location'])
+
+    async def test_dashboard(self):
+        response = await self.client.get(reverse('portal_dashboard_async'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'portal/dashboard.html')
+        self.assertEqual(response.context['health_profile']['conditions'], ['Condition 0', 'Condition 1'])
+
+    async def test_recommendations_are_scored_in_the_pool_and_revalidated(self):
+        threads = []
+        get_or_compute = recommendation_cache.get_or_compute
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return get_or_compute(*args, **kwargs)
+
+        url = reverse('api_recommendations_async')
+        with mock.patch.object(recommendation_cache, 'get_or_compute', side_effect=record_thread):
+            response = await self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['recommendations'])
+            self.assertEqual(len(threads), 1)
+            self.assertTrue(threads[0].startswith('scoring'), threads)
+
+            response = await self.client.get(url, headers={'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(threads), 1)
+
+    def test_otp_middleware_runs_in_async_stacks(self):
+        async def get_response(request):
+            return None
+        self.assertTrue(iscoroutinefunction(CachedOTPMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(CachedOTPMiddleware(lambda request: None)))
@@ -0,0 +1,64 @@
+import numpy as np
+from django.test import SimpleTestCase
+from portal.bitset import TreatmentBitsets, pack, popcount, unpack
+
+
+class BitsetTests(SimpleTestCase):
+    def test_pack_and_unpack_round_trip_across_words(self):
+        rows = [[0, 63, 64, 129], [], [5]]
+        words = pack(rows, 130)
+        self.assertEqual(words.shape, (3, 3))
+        self.assertEqual(int(words[0, 0]), 1 | 1 << 63)
+        self.assertEqual(int(words[0, 1]), 1)
+        self.assertEqual(int(words[0, 2]), 1 << 1)
+        row, bits = unpack(words)
+        self.assertEqual(list(zip(row.tolist(), bits.tolist())), [(0, 0), (0, 63), (0, 64), (0, 129), (2, 5)])
+
+    def test_popcount_counts_the_set_bits_of_each_row(self):
+        rng = np.random.default_rng(0)
+        words = rng.integers(0, 2 ** 63, size=(50, 4), dtype=np.int64).astype(np.uint64) << np.uint64(1)
+        words[0] = np.uint64(2 ** 64 - 1)
+        words[1] = 0
+        expected = [sum(bin(int(word)).count('1') for word in row) for row in words]
+        self.assertEqual(popcount(words).tolist(), expected)
+        self.assertEqual(popcount(words)[:2].tolist(), [256, 0])
+
+    def test_match_agrees_with_set_arithmetic(self):
+        rng = np.random.default_rng(1)
+        treatments_by_condition = {}
+        conditions_of = {}
+        for treatment_id in range(1, 40):
+            conditions = set(rng.choice(np.arange(1, 150), size=rng.integers(1, 6), replace=False).tolist())
+            conditions_of[treatment_id] = conditions
+            for condition_id in conditions:
+                treatments_by_condition.setdefault(condition_id, []).append(treatment_id)
+        bitsets = TreatmentBitsets.from_index(treatments_by_condition)
+
+        # Condition 999 has no treatment but still counts towards the user's size
+        user = set(rng.choice(np.arange(1, 150), size=8, replace=False).tolist()) | {999}
+        for metric in ('overlap', 'jaccard', 'cosine'):
+            with self.subTest(metric=metric):
+                candidates, scores = bitsets.match(user, metric)
+                got = {treatment_id: (set(shared), score) for (treatment_id, shared), score in zip(candidates, scores)}
+                expected = {}
+                for treatment_id, conditions in conditions_of.items():
+                    shared = user & conditions
+                    if not shared:
+                        continue
+                    score = {
+                        'overlap': len(shared),
+                        'jaccard': len(shared) / len(user | conditions),
+                        'cosine': len(shared) / np.sqrt(len(user) * len(conditions)),
+                    }[metric]
+                    expected[treatment_id] = (shared, score)
+                self.assertEqual(got.keys(), expected.keys())
+                for treatment_id, (shared, score) in expected.items():
+                    self.assertEqual(got[treatment_id][0], shared)
+                    self.assertAlmostEqual(got[treatment_id][1], score)
+
+    def test_match_without_conditions_or_with_an_unknown_metric(self):
+        bitsets = TreatmentBitsets.from_index({1: [10], 2: [10, 11]})
+        candidates, scores = bitsets.match([])
+        self.assertEqual((candidates, len(scores)), ([], 0))
+        with self.assertRaises(ValueError):
+            bitsets.match([1], 'dice')
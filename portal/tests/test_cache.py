@@ -0,0 +1,41 @@
+from django.test import TestCase
+from portal.cache import recommendation_cache
+from portal.jobs import enqueue_training
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+class RecommendationCacheTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, _ = create_catalog()
+        self.patients = [create_patient(f'patient{i}', [self.conditions[i % 6]]) for i in range(10)]
+        get_recommender().train()
+        self.drain_jobs()
+
+    def get(self, user):
+        return recommendation_cache.get_or_compute(user.pk, 5, get_recommender())
+
+    def test_rescoring_one_user_keeps_the_entries_of_the_others(self):
+        user, other = self.patients[:2]
+        self.get(user)
+        self.get(other)
+
+        user.health_profile.conditions.add(self.conditions[3])
+        # Cached before the worker rescored the user
+        self.get(user)
+        enqueue_training(user_id=user.pk)
+        self.drain_jobs()
+        stats = recommendation_cache.stats()
+
+        self.get(other)
+        self.assertEqual(recommendation_cache.stats()['hits'], stats['hits'] + 1)
+        self.get(user)
+        self.assertEqual(recommendation_cache.stats()['misses'], stats['misses'] + 1)
+
+    def test_a_new_model_version_replaces_every_entry(self):
+        self.get(self.patients[0])
+        get_recommender().train()
+        stats = recommendation_cache.stats()
+        self.get(self.patients[0])
+        self.assertEqual(recommendation_cache.stats()['misses'], stats['misses'] + 1)
@@ -0,0 +1,63 @@
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from scipy import sparse
+from portal.cohorts import Cohorts
+from portal.features import NUMERIC_COLUMNS
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+def scaled_rows(demographics, conditions):
+    """Scaled feature rows: age, height and weight, no effectiveness, then condition columns"""
+    rows = np.zeros((len(demographics), len(NUMERIC_COLUMNS) + 3))
+    rows[:, :3] = demographics
+    for row, columns in enumerate(conditions):
+        rows[row, [len(NUMERIC_COLUMNS) + column for column in columns]] = 1
+    return sparse.csr_matrix(rows)
+
+
+class CohortsTests(SimpleTestCase):
+    def test_seeding_reads_past_a_first_chunk_of_look_alikes(self):
+        chunks = [scaled_rows([[1, 1, 1]] * 10, [[0]] * 10)]
+        chunks += [scaled_rows([[i, 2 * i, 1], [-i, 0, 2]], [[0], [1]]) for i in range(2, 6)]
+        cohorts = Cohorts.fit(chunks, 4)
+        self.assertEqual(len(cohorts.centroids), 4)
+
+    def test_fewer_distinct_users_than_clusters_is_logged(self):
+        chunks = [scaled_rows([[1, 1, 1], [2, 2, 2]] * 5, [[0]] * 10)]
+        with self.assertLogs('portal.cohorts', 'WARNING') as logs:
+            cohorts = Cohorts.fit(chunks, 4)
+        self.assertEqual(len(cohorts.centroids), 2)
+        self.assertIn('fitting 2 cohort clusters instead of 4', logs.output[0])
+
+    def test_assign_groups_by_cluster_and_condition_set(self):
+        cohorts = Cohorts([[0, 0, 0], [10, 10, 10]])
+        rows = scaled_rows([[0, 0, 1], [1, 0, 0], [9, 9, 9], [0, 1, 0]], [[0, 1], [0, 1], [0, 1], [2]])
+        positions = {}
+        cohort_of_row, representatives = cohorts.assign(rows, positions)
+        self.assertEqual(cohort_of_row.tolist(), [0, 0, 1, 2])
+        self.assertEqual(representatives.shape[0], 3)
+        self.assertEqual(representatives[1, :3].toarray().tolist(), [[10, 10, 10]])
+
+        # Cohorts seen before keep their positions
+        cohort_of_row, representatives = cohorts.assign(rows[[3, 1]], positions)
+        self.assertEqual(cohort_of_row.tolist(), [2, 0])
+        self.assertEqual(representatives.shape[0], 0)
+
+
+@override_settings(RECOMMENDER_COHORTS=True, RECOMMENDER_COHORT_CLUSTERS=2)
+class CohortTrainingTests(RecommenderTestMixin, TestCase):
+    def test_members_of_a_cohort_share_their_scores(self):
+        conditions, _ = create_catalog()
+        twins = [create_patient(f'twin{i}', conditions[:2], age=30) for i in range(2)]
+        create_patient('other', conditions[2:3], age=80)
+        recommender = get_recommender()
+        recommender.train()
+
+        self.assertEqual(len(recommender.cohorts.centroids), 2)
+        first, second = (
+            [(rec.treatment_id, rec.score) for rec in recommender.get_recommendations(twin.pk, top_n=10)]
+            for twin in twins
+        )
+        self.assertTrue(first)
+        self.assertEqual(first, second)
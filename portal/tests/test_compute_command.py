@@ -0,0 +1,52 @@
+from io import StringIO
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from accounts.models import CustomUser
+from portal.models import Recommendation
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient, stored_scores
+
+
+class ComputeRecommendationsTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, _ = create_catalog()
+        self.patients = [create_patient(f'patient{i}', [self.conditions[i % 6]]) for i in range(8)]
+        self.doctor = create_patient('doctor', [self.conditions[1]], user_type=CustomUser.DOCTOR)
+
+    def compute(self, *args):
+        stdout = StringIO()
+        call_command('compute_recommendations', '--processes', '1', '--chunk-size', '3', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def stored_users(self):
+        return set(Recommendation.objects.values_list('user_id', flat=True))
+
+    def test_train_and_store_everyone(self):
+        output = self.compute('--train')
+        self.assertIn('for 9 users', output)
+        self.assertIn('users/sec', output)
+        computed = stored_scores()
+
+        Recommendation.objects.all().delete()
+        self.store_all()
+        self.assertEqual(computed, stored_scores())
+
+    def test_filters_select_the_users(self):
+        get_recommender().train()
+        self.compute('--user-type', str(CustomUser.DOCTOR))
+        self.assertEqual(self.stored_users(), {self.doctor.pk})
+
+        Recommendation.objects.all().delete()
+        self.compute('--min-id', str(self.patients[2].pk), '--max-id', str(self.patients[4].pk))
+        self.assertEqual(self.stored_users(), {patient.pk for patient in self.patients[2:5]})
+
+        Recommendation.objects.all().delete()
+        self.compute('--condition', str(self.conditions[1].pk), '--condition', str(self.conditions[2].pk))
+        expected = {self.patients[1].pk, self.patients[2].pk, self.patients[7].pk, self.doctor.pk}
+        self.assertEqual(self.stored_users(), expected)
+
+    def test_without_a_model_nothing_is_computed(self):
+        with self.assertRaises(CommandError):
+            self.compute()
+        self.assertFalse(Recommendation.objects.exists())
@@ -0,0 +1,44 @@
+from django.test import TestCase
+from portal.models import Recommendation, DashboardSnapshot
+from .utils import create_catalog, create_patient
+
+
+class DashboardSnapshotTests(TestCase):
+    def setUp(self):
+        self.conditions, self.treatments = create_catalog()
+        self.user = create_patient('patient', self.conditions[:2])
+
+    def test_replace_for_users_refreshes_the_snapshot(self):
+        self.user.health_profile.conditions.set(self.conditions)
+        entries = [
+            (self.user.pk, treatment.pk, self.conditions[i % 6].pk, (i + 1) / 10)
+            for i, treatment in enumerate(self.treatments[:7])
+        ]
+        Recommendation.objects.replace_for_users(entries, [self.user.pk])
+
+        payload = DashboardSnapshot.objects.get(user=self.user).payload
+        self.assertEqual(payload['health_profile']['conditions'], [f'Condition {i}' for i in range(6)])
+        self.assertEqual(
+            [rec['treatment']['name'] for rec in payload['recommendations']],
+            [f'Treatment {i}' for i in range(6, 1, -1)],
+        )
+        self.assertEqual(payload['recommendations'][0]['score'], 0.7)
+
+    def test_profile_change_drops_the_snapshot_and_dashboard_rebuilds_it(self):
+        DashboardSnapshot.objects.refresh_for_users([self.user.pk])
+        self.user.health_profile.conditions.add(self.conditions[2])
+        self.assertFalse(DashboardSnapshot.objects.filter(user=self.user).exists())
+
+        payload = DashboardSnapshot.objects.for_user(self.user)
+        self.assertEqual(payload['health_profile']['conditions'], ['Condition 0', 'Condition 1', 'Condition 2'])
+        self.assertTrue(DashboardSnapshot.objects.filter(user=self.user).exists())
+
+    def test_renamed_treatment_drops_the_snapshots_recommending_it(self):
+        Recommendation.objects.replace_for_users(
+            [(self.user.pk, self.treatments[0].pk, self.conditions[0].pk, 0.5)], [self.user.pk]
+        )
+        self.treatments[0].name = 'Renamed'
+        self.treatments[0].save()
+        self.assertFalse(DashboardSnapshot.objects.filter(user=self.user).exists())
+        payload = DashboardSnapshot.objects.for_user(self.user)
+        self.assertEqual(payload['recommendations'][0]['treatment']['name'], 'Renamed')
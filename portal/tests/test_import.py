@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase
+from accounts.models import CustomUser
+from portal.models import MedicalCondition, UserHealth
+
+
+class ImportHealthProfilesTests(TestCase):
+    def setUp(self):
+        MedicalCondition.objects.create(name='Asthma', description='d')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'profiles.jsonl')
+
+    def run_import(self, records, *args):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(record if isinstance(record, str) else json.dumps(record))
+                f.write('\n')
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_health_profiles', self.path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue().splitlines()
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        stdout, errors = self.run_import([
+            {'username': 'ok', 'age': 30, 'conditions': ['asthma']},
+            '{not json',
+            {'email': ''},
+            {'username': 'u' * 151},
+            {'username': 'long-email', 'email': 'e' * 250 + '@x.com'},
+            {'username': 'long-name', 'first_name': 'f' * 151},
+            {'username': 'long-surname', 'last_name': 'l' * 151},
+            {'username': 'long-phone', 'phone_number': '0' * 21},
+            {'username': 'bad-type', 'user_type': 7},
+            {'username': 'bad-age', 'age': -1},
+            {'username': 'unknown', 'conditions': ['Gout']},
+            {'username': 'ok'},
+        ])
+
+        self.assertEqual([error.split(':')[0] for error in errors], [f'line {line}' for line in range(2, 13)])
+        self.assertIn('username or email is required', errors[1])
+        for error, field in zip(errors[2:7], ('username', 'email', 'first_name', 'last_name', 'phone_number')):
+            self.assertIn(f'{field} ', error)
+            self.assertIn('is longer than', error)
+        self.assertIn('unknown conditions Gout', errors[9])
+        self.assertIn('already exists', errors[10])
+        self.assertIn('Created 1 profiles', stdout)
+        self.assertIn('1 existing usernames skipped, 10 rows rejected', stdout)
+        self.assertEqual(
+            list(UserHealth.objects.values_list('user__username', 'age', 'conditions__name')), [('ok', 30, 'Asthma')]
+        )
+
+    def test_new_condition_names_are_checked_before_they_are_created(self):
+        _, errors = self.run_import([
+            {'username': 'a', 'conditions': ['Gout']},
+            {'username': 'b', 'conditions': ['c' * 101]},
+        ], '--create-conditions')
+        self.assertEqual(len(errors), 1)
+        self.assertIn('condition name', errors[0])
+        self.assertEqual(set(MedicalCondition.objects.values_list('name', flat=True)), {'Asthma', 'Gout'})
+
+    def test_a_chunk_the_database_rejects_is_rolled_back_and_reported(self):
+        records = [{'username': f'user{i}', 'conditions': ['Asthma']} for i in range(4)]
+        original = UserHealth.objects.bulk_create
+        calls = []
+
+        def bulk_create(objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 1:
+                raise IntegrityError('duplicate key')
+            return original(objs, *args, **kwargs)
+
+        with mock.patch.object(UserHealth.objects, 'bulk_create', side_effect=bulk_create):
+            stdout, errors = self.run_import(records, '--chunk-size', '2')
+
+        self.assertEqual(errors, ['lines 1-2: rejected by the database: duplicate key'])
+        self.assertIn('Created 2 profiles', stdout)
+        self.assertIn('2 rows rejected', stdout)
+        self.assertEqual(
+            sorted(CustomUser.objects.values_list('username', flat=True)), ['user2', 'user3']
+        )
+
+    def test_dry_run_writes_nothing(self):
+        stdout, errors = self.run_import([{'username': 'a', 'conditions': ['Gout']}], '--create-conditions', '--dry-run')
+        self.assertEqual(errors, [])
+        self.assertIn('Validated 1 profiles', stdout)
+        self.assertFalse(CustomUser.objects.exists())
+        self.assertFalse(MedicalCondition.objects.filter(name='Gout').exists())
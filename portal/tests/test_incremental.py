@@ -0,0 +1,64 @@
+from unittest import mock
+from django.test import TestCase
+from accounts.models import CustomUser
+from portal.recommender import HealthRecommender
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient, stored_scores
+
+
+class IncrementalUpdateTests(RecommenderTestMixin, TestCase):
+    """Rescoring one user stores what scoring everyone against the same fit would"""
+
+    def setUp(self):
+        super().setUp()
+        self.conditions, self.treatments = create_catalog()
+        for i in range(30):
+            create_patient(f'patient{i}', [self.conditions[i % 6], self.conditions[(i * 5) % 6]], age=20 + i)
+        get_recommender().train()
+        self.store_all()
+
+    def rescore(self, username, conditions, age=70):
+        user = CustomUser.objects.get(username=username)
+        health = user.health_profile
+        health.age = age
+        health.save()
+        health.conditions.set(conditions)
+        self.assertTrue(get_recommender().update_user(user.pk))
+        return user
+
+    def test_update_user_matches_a_full_rescore(self):
+        user = self.rescore('patient3', [self.conditions[1], self.conditions[4]])
+        incremental = stored_scores([user.pk])
+        self.store_all()
+        self.assertEqual(stored_scores([user.pk]), incremental)
+
+        get_recommender().train()
+        self.store_all()
+        retrained = stored_scores([user.pk])
+        self.assertEqual(incremental.keys(), retrained.keys())
+        # The incremental scores keep the scaling of the last fit, so they only agree closely
+        for key, score in retrained.items():
+            self.assertAlmostEqual(incremental[key], score, delta=0.05, msg=key)
+
+    def test_other_processes_read_only_the_appended_rows(self):
+        reader = HealthRecommender()
+        first = self.rescore('patient3', [self.conditions[1], self.conditions[4]])
+        second = self.rescore('patient4', [self.conditions[2]])
+
+        with mock.patch.object(reader, '_load') as load:
+            reader.refresh()
+        load.assert_not_called()
+        self.assertEqual(reader.user_overrides.keys(), {first.pk, second.pk})
+        for user_id, row in get_recommender().user_overrides.items():
+            self.assertEqual(reader.user_overrides[user_id].tolist(), row.tolist())
+
+    def test_superseded_rows_are_compacted(self):
+        path = get_recommender().store.versions / get_recommender().version / 'overrides.log'
+        self.rescore('patient3', [self.conditions[1]])
+        size = path.stat().st_size
+        for age in range(20, 25):
+            self.rescore('patient3', [self.conditions[1]], age=age)
+            self.assertLessEqual(path.stat().st_size, 2 * size)
+
+        reader = HealthRecommender()
+        self.assertEqual(len(reader.user_overrides), 1)
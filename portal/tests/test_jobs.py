@@ -0,0 +1,60 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from portal.jobs import enqueue_rescores, enqueue_training, claim_due_jobs, process_jobs
+from portal.models import TrainingJob
+from portal.services import get_recommender
+from .utils import create_catalog, create_patient
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.conditions, _ = create_catalog()
+        self.users = [create_patient(f'patient{i}', [self.conditions[i % 6]]) for i in range(20)]
+        TrainingJob.objects.all().delete()
+
+    def test_requests_for_pending_work_are_coalesced(self):
+        enqueue_training(user_id=self.users[0].pk)
+        enqueue_training(user_id=self.users[0].pk)
+        enqueue_training(user_id=self.users[1].pk)
+        enqueue_training()
+        enqueue_training()
+
+        jobs = {(job.kind, job.user_id): job.request_count for job in TrainingJob.objects.all()}
+        self.assertEqual(jobs, {('user', self.users[0].pk): 2, ('user', self.users[1].pk): 1, ('full', None): 2})
+
+    def test_jobs_wait_for_the_debounce_window(self):
+        enqueue_training(user_id=self.users[0].pk)
+        self.assertEqual(claim_due_jobs(debounce=60), [])
+
+        TrainingJob.objects.update(requested_at=timezone.now() - timedelta(seconds=61))
+        # A new request pushes the window back again
+        enqueue_training(user_id=self.users[0].pk)
+        self.assertEqual(claim_due_jobs(debounce=60), [])
+
+        TrainingJob.objects.update(requested_at=timezone.now() - timedelta(seconds=61))
+        jobs = claim_due_jobs(debounce=60)
+        self.assertEqual([(job.user_id, job.request_count) for job in jobs], [(self.users[0].pk, 2)])
+        self.assertEqual(TrainingJob.objects.get().status, 'running')
+        self.assertEqual(claim_due_jobs(debounce=0), [])
+
+    @override_settings(RECOMMENDER_MAX_DRIFT=0.1)
+    def test_rescores_of_many_users_fall_back_to_a_full_retrain(self):
+        self.assertEqual(enqueue_rescores([self.users[0].pk, self.users[1].pk, self.users[0].pk]), 2)
+        self.assertEqual(TrainingJob.objects.filter(kind='user').count(), 2)
+        # Coalesced with the pending rescores
+        self.assertEqual(enqueue_rescores([self.users[1].pk]), 1)
+        self.assertEqual(TrainingJob.objects.get(user=self.users[1]).request_count, 2)
+
+        self.assertIsNone(enqueue_rescores([user.pk for user in self.users[:3]]))
+        self.assertEqual(TrainingJob.objects.filter(kind='full', status='pending').count(), 1)
+
+    def test_a_full_retrain_covers_the_whole_batch(self):
+        enqueue_training(user_id=self.users[0].pk)
+        enqueue_training()
+        with mock.patch.object(get_recommender(), 'train', return_value=True) as train:
+            results = process_jobs(claim_due_jobs(debounce=0))
+        train.assert_called_once_with()
+        self.assertEqual(results, [('full retrain (2 jobs)', 'done')])
+        self.assertEqual(set(TrainingJob.objects.values_list('status', flat=True)), {'done'})
@@ -0,0 +1,91 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from accounts.models import CustomUser
+from portal import metrics
+from portal.middleware import MetricsMiddleware
+
+# Records one request of a view and waits for stdin to close before exiting
+PROCESS_SCRIPT = '''
+import sys
+import django
+django.setup()
+from portal import metrics
+metrics.registry.increment('portal_requests_total', view='other', status=200)
+metrics.registry.flush()
+print('ready', flush=True)
+sys.stdin.read()
+'''
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(METRICS_DIR=self.directory, METRICS_FLUSH_INTERVAL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.registry.after_fork()
+        self.addCleanup(metrics.registry.after_fork)
+
+    def requests_of(self, view, status=200):
+        key = metrics._labels_key({'view': view, 'status': status})
+        return metrics.registry.collect()['counters'].get('portal_requests_total', {}).get(key, 0)
+
+    def test_counts_of_other_processes_are_summed_and_kept_after_they_exit(self):
+        metrics.registry.increment('portal_requests_total', view='other', status=200)
+        env = dict(
+            os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'healthcareportal.settings'),
+            METRICS_DIR=self.directory,
+        )
+        process = subprocess.Popen(
+            [sys.executable, '-c', PROCESS_SCRIPT], cwd=settings.BASE_DIR, env=env, text=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        try:
+            self.assertEqual(process.stdout.readline().strip(), 'ready')
+            self.assertEqual(self.requests_of('other'), 2)
+        finally:
+            process.stdin.close()
+            process.wait(timeout=30)
+
+        self.assertEqual(self.requests_of('other'), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f'{process.pid}.json')))
+
+    def test_streamed_body_is_recorded_when_closed(self):
+        def body():
+            yield b'a'
+            CustomUser.objects.count()
+            yield b'b'
+
+        middleware = MetricsMiddleware(lambda request: StreamingHttpResponse(body()))
+        response = middleware(RequestFactory().get('/'))
+        self.assertEqual(self.requests_of('unresolved'), 0)
+
+        self.assertEqual(b''.join(response), b'ab')
+        response.close()
+        self.assertEqual(self.requests_of('unresolved'), 1)
+        queries = metrics.registry.collect()['histograms']['portal_request_sql_queries']
+        self.assertEqual(queries[metrics._labels_key({'view': 'unresolved'})]['sum'], 1)
+
+    def test_endpoint_is_for_staff_only(self):
+        url = reverse('metrics')
+        user = CustomUser.objects.create_user('patient', 'patient@example.com', 'pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        user.is_staff = True
+        user.save()
+        self.client.force_login(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE portal_recommendation_cache_hits_total counter', body)
+        self.assertIn('# TYPE portal_requests_total counter', body)
+        self.assertNotIn('gauge', body)
@@ -0,0 +1,61 @@
+import json
+from django.test import TestCase
+from django.urls import reverse
+from accounts.models import CustomUser
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+class PanelRecommendationsTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, self.treatments = create_catalog()
+        self.patients = [create_patient(f'patient{i}', self.conditions[i:i + 2]) for i in range(4)]
+        self.doctor = create_patient('doctor', self.conditions[:1], user_type=CustomUser.DOCTOR)
+        self.url = reverse('api_panel_recommendations')
+        self.client.force_login(self.doctor)
+
+    def lines(self, params=None):
+        response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_only_doctors_see_the_panel(self):
+        self.client.force_login(self.patients[0])
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['status'], 'error')
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_one_line_per_patient_with_each_treatment_once(self):
+        get_recommender().train()
+        lines = self.lines({'limit': 3})
+
+        self.assertEqual([line['user_id'] for line in lines], [patient.pk for patient in self.patients])
+        for line in lines:
+            recommendations = line['recommendations']
+            self.assertEqual(len(recommendations), 3)
+            treatments = [rec['treatment_id'] for rec in recommendations]
+            self.assertEqual(len(set(treatments)), len(treatments))
+            scores = [rec['score'] for rec in recommendations]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            self.assertEqual(
+                set(recommendations[0]),
+                {'treatment_id', 'treatment_name', 'condition_id', 'condition_name', 'score'},
+            )
+
+    def test_patients_are_filtered_by_condition_and_id(self):
+        get_recommender().train()
+        lines = self.lines({'condition': self.conditions[0].pk})
+        self.assertEqual([line['user_id'] for line in lines], [self.patients[0].pk])
+        lines = self.lines({'min_id': self.patients[1].pk, 'max_id': self.patients[2].pk})
+        self.assertEqual([line['user_id'] for line in lines], [patient.pk for patient in self.patients[1:3]])
+
+    def test_bad_parameters_and_a_missing_model(self):
+        for params in ({'limit': 0}, {'limit': 'ten'}, {'min_id': 'x'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 503)
@@ -0,0 +1,37 @@
+from django.test import TestCase
+from portal.models import MedicalCondition, Treatment
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_patient
+
+
+class ScoringTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.asthma = MedicalCondition.objects.create(name='Asthma', description='d')
+        self.gout = MedicalCondition.objects.create(name='Gout', description='d')
+        self.strong = Treatment.objects.create(name='Strong', description='d', effectiveness_score=0.95)
+        self.weak = Treatment.objects.create(name='Weak', description='d', effectiveness_score=0.1)
+        self.other = Treatment.objects.create(name='Other', description='d', effectiveness_score=0.95)
+        self.strong.conditions.set([self.asthma])
+        self.weak.conditions.set([self.asthma])
+        self.other.conditions.set([self.gout])
+        self.user = create_patient('patient', [self.asthma], age=30)
+        create_patient('short', [self.gout], age=80)
+        get_recommender().train()
+
+    def test_more_effective_treatment_ranks_higher(self):
+        scores = {
+            rec.treatment_id: rec.score for rec in get_recommender().get_recommendations(self.user.pk, top_n=10)
+        }
+        self.assertEqual(set(scores), {self.strong.pk, self.weak.pk})
+        self.assertGreater(scores[self.strong.pk], scores[self.weak.pk])
+        # Demographics do not flatten the condition match
+        self.assertGreater(scores[self.weak.pk], 0.5)
+
+    def test_demographics_do_not_change_the_ranking(self):
+        health = self.user.health_profile
+        health.height, health.weight = 120, 150
+        health.save()
+        self.assertTrue(get_recommender().update_user(self.user.pk))
+        ranked = [rec.treatment_id for rec in get_recommender().get_recommendations(self.user.pk, top_n=10)]
+        self.assertEqual(ranked, [self.strong.pk, self.weak.pk])
@@ -0,0 +1,45 @@
+from django.test import TestCase
+from portal.models import Recommendation, TrainingJob
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+class ProfileSignalTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, self.treatments = create_catalog()
+        self.user = create_patient('patient', [self.conditions[0]])
+        # Enough other users that one rescore stays below the drift limit
+        for i in range(10):
+            create_patient(f'other{i}', [self.conditions[3]])
+        TrainingJob.objects.all().delete()
+
+    def test_profile_save_outside_views_queues_a_rescore(self):
+        health = self.user.health_profile
+        health.age = 55
+        with self.captureOnCommitCallbacks(execute=True):
+            health.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            health.conditions.add(self.conditions[1])
+        job = TrainingJob.objects.get(status='pending')
+        self.assertEqual((job.kind, job.user_id, job.request_count), ('user', self.user.pk, 2))
+
+    def test_condition_side_change_queues_rescores_of_its_users(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conditions[2].users.add(self.user.health_profile)
+        self.assertTrue(TrainingJob.objects.filter(kind='user', user=self.user, status='pending').exists())
+
+    def test_deleting_the_user_queues_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(TrainingJob.objects.exists())
+
+    def test_deleting_the_profile_drops_the_users_recommendations(self):
+        get_recommender().train()
+        get_recommender().update_user(self.user.pk)
+        self.assertTrue(Recommendation.objects.filter(user=self.user).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.health_profile.delete()
+        self.assertTrue(TrainingJob.objects.filter(kind='user', user=self.user).exists())
+        self.assertFalse(get_recommender().update_user(self.user.pk))
+        self.assertFalse(Recommendation.objects.filter(user=self.user).exists())
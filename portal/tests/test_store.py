@@ -0,0 +1,34 @@
+from django.test import TestCase
+from portal.models import Treatment, Recommendation
+from .utils import create_catalog, create_patient, stored_scores
+
+
+class RecommendationStoreTests(TestCase):
+    def setUp(self):
+        self.conditions, self.treatments = create_catalog()
+        self.user = create_patient('patient', self.conditions[:2])
+
+    def test_replace_for_users_updates_in_place_and_deletes_stale_rows(self):
+        c0, c1 = self.conditions[0].pk, self.conditions[1].pk
+        t0, t1 = self.treatments[0].pk, self.treatments[1].pk
+        Recommendation.objects.replace_for_users([(self.user.pk, t0, c0, 0.5), (self.user.pk, t0, c1, 0.4)], [self.user.pk])
+        kept = Recommendation.objects.get(treatment_id=t0, condition_id=c0)
+
+        # The user no longer has condition 0
+        self.user.health_profile.conditions.remove(self.conditions[0])
+        Recommendation.objects.replace_for_users(
+            [(self.user.pk, t0, c0, 0.9), (self.user.pk, t0, c1, 0.8), (self.user.pk, t1, c1, 0.7)], [self.user.pk]
+        )
+
+        self.assertEqual(stored_scores(), {(self.user.pk, t0, c1): 0.8, (self.user.pk, t1, c1): 0.7})
+        self.assertFalse(Recommendation.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(Recommendation.objects.get(treatment_id=t0, condition_id=c1).score, 0.8)
+
+    def test_replace_for_users_only_touches_the_given_users(self):
+        other = create_patient('other', self.conditions[:1])
+        c0, t0 = self.conditions[0].pk, self.treatments[0].pk
+        Recommendation.objects.create(user=other, treatment_id=t0, condition_id=c0, score=0.3)
+        # A row whose treatment lost the condition is stale, but not for this call
+        Treatment.objects.get(pk=t0).conditions.remove(self.conditions[0])
+        Recommendation.objects.replace_for_users([], [self.user.pk])
+        self.assertEqual(stored_scores(), {(other.pk, t0, c0): 0.3})
@@ -0,0 +1,55 @@
+from unittest import mock
+import numpy as np
+from django.test import TestCase, override_settings
+from sklearn.preprocessing import StandardScaler
+from portal import recommender as recommender_module
+from portal.features import NUMERIC_COLUMNS, FeatureSchema, build_user_features, build_treatment_features
+from portal.models import Treatment
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient
+
+
+def dense_scores(schema):
+    """Scores of every user, computed in one go on dense matrices"""
+    users = build_user_features(schema)
+    treatments = build_treatment_features(schema)
+    users_dense = users.to_sparse().toarray()
+    scaler = StandardScaler(with_mean=False).fit(users_dense)
+    users_scaled = scaler.transform(users_dense)[:, len(NUMERIC_COLUMNS):]
+    treatments_scaled = scaler.transform(treatments.to_sparse().toarray())[:, len(NUMERIC_COLUMNS):]
+
+    norms = np.linalg.norm(users_scaled, axis=1)[:, None] * np.linalg.norm(treatments_scaled, axis=1)[None, :]
+    similarity = np.divide(users_scaled @ treatments_scaled.T, norms, out=np.zeros_like(norms), where=norms > 0)
+    effectiveness = np.clip([
+        Treatment.objects.get(pk=treatment_id).effectiveness_score for treatment_id in treatments.ids
+    ], 0, 1)
+    weight = 1 - recommender_module.EFFECTIVENESS_WEIGHT + recommender_module.EFFECTIVENESS_WEIGHT * effectiveness
+    return users.ids, treatments.ids, similarity * weight
+
+
+class BlockwiseTrainingTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, _ = create_catalog(conditions=9, treatments=12)
+        for i in range(25):
+            create_patient(f'patient{i}', [self.conditions[i % 9], self.conditions[(i * 4) % 9]], age=20 + i)
+
+    @override_settings(RECOMMENDER_TRAINING_CHUNK_SIZE=7)
+    def test_chunks_and_blocks_match_a_dense_computation(self):
+        with mock.patch.object(recommender_module, '_similarity_block_rows', return_value=3):
+            self.assertTrue(get_recommender().train())
+        recommender = get_recommender()
+        user_ids, treatment_ids, expected = dense_scores(FeatureSchema.from_database())
+
+        self.assertIsInstance(recommender.similarity_matrix, np.memmap)
+        self.assertEqual(recommender.user_ids.tolist(), list(user_ids))
+        self.assertEqual(recommender.treatment_ids.tolist(), list(treatment_ids))
+        np.testing.assert_allclose(recommender.similarity_matrix, expected, atol=1e-12)
+
+    @override_settings(RECOMMENDER_TRAINING_MEMORY_MB=1)
+    def test_blocks_fit_the_memory_budget(self):
+        rows = recommender_module._similarity_block_rows(1000)
+        row_bytes = recommender_module.SIMILARITY_COPIES * 1000 * 8
+        self.assertLessEqual(rows * row_bytes, 2 ** 20)
+        self.assertGreater((rows + 1) * row_bytes, 2 ** 20)
+        self.assertEqual(recommender_module._similarity_block_rows(10 ** 9), 1)
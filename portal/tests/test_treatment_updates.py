@@ -0,0 +1,123 @@
+import os
+import subprocess
+import sys
+from unittest import mock
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from portal.candidates import candidate_index
+from portal.models import UserHealth, Recommendation, TrainingJob
+from portal.services import get_recommender
+from .utils import RecommenderTestMixin, create_catalog, create_patient, stored_scores
+
+
+class TreatmentJobTests(RecommenderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.conditions, self.treatments = create_catalog()
+        self.patients = [create_patient(f'patient{i}', [self.conditions[i % 6]]) for i in range(12)]
+        get_recommender().train()
+        self.drain_jobs()
+
+    def test_update_treatment_reads_links_changed_elsewhere(self):
+        """A link added by another process is picked up even before the index's next version check"""
+        treatment, condition = self.treatments[0], self.conditions[3]
+        candidate_index.candidates([condition.pk])
+        # Another process's invalidate() never reaches this one's copy
+        with mock.patch.object(candidate_index, 'invalidate'), \
+                mock.patch('portal.candidates.VERSION_CHECK_INTERVAL', 3600):
+            treatment.conditions.add(condition)
+            self.assertTrue(get_recommender().update_treatment(treatment.pk))
+
+        patients = UserHealth.objects.filter(conditions=condition).values_list('user_id', flat=True)
+        self.assertTrue(patients)
+        self.assertEqual(
+            set(Recommendation.objects.filter(treatment=treatment, condition=condition).values_list('user_id', flat=True)),
+            set(patients),
+        )
+
+
+WORKER_SCRIPT = '''
+import sys
+import django
+django.setup()
+from django.db import connections
+connections['default'].settings_dict['NAME'] = sys.argv[1]
+from portal.candidates import candidate_index
+from portal.jobs import claim_due_jobs, process_jobs
+from portal.services import get_recommender
+get_recommender().train()
+process_jobs(claim_due_jobs(debounce=0))
+candidate_index.candidates([])
+print('ready', flush=True)
+sys.stdin.readline()
+for description, status in process_jobs(claim_due_jobs(debounce=0)):
+    print(f'{description}: {status}', flush=True)
+'''
+
+
+class TreatmentRetrainTests(RecommenderTestMixin, TestCase):
+    """An edited treatment is stored as a full retrain would store it"""
+
+    def setUp(self):
+        super().setUp()
+        self.conditions, self.treatments = create_catalog()
+        for i in range(30):
+            create_patient(f'patient{i}', [self.conditions[i % 6], self.conditions[(i * 5) % 6]], age=20 + i)
+        get_recommender().train()
+        self.store_all()
+
+    def test_update_treatment_matches_a_full_retrain(self):
+        treatment = self.treatments[2]
+        treatment.effectiveness_score = 0.95
+        treatment.save()
+        treatment.conditions.add(self.conditions[5])
+        treatment.conditions.remove(self.conditions[2])
+
+        self.assertTrue(get_recommender().update_treatment(treatment.pk))
+        incremental = stored_scores()
+        get_recommender().train()
+        self.store_all()
+        retrained = stored_scores()
+
+        self.assertEqual(incremental.keys(), retrained.keys())
+        for key, score in retrained.items():
+            self.assertAlmostEqual(incremental[key], score, places=9, msg=key)
+
+
+class TreatmentJobProcessTests(RecommenderTestMixin, TransactionTestCase):
+    """The treatment is edited here and the job run by a worker in another process"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('the worker process needs a database it can open, not an in-memory one')
+        super().setUp()
+        self.conditions, self.treatments = create_catalog()
+        self.patients = [create_patient(f'patient{i}', [self.conditions[i % 6]]) for i in range(12)]
+
+    def test_worker_scores_a_link_added_by_another_process(self):
+        env = dict(
+            os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'healthcareportal.settings'),
+            RECOMMENDER_MODEL_DIR=self.model_dir,
+        )
+        worker = subprocess.Popen(
+            [sys.executable, '-c', WORKER_SCRIPT, str(connection.settings_dict['NAME'])],
+            cwd=settings.BASE_DIR, env=env, text=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        self.addCleanup(worker.kill)
+        # The worker has built its candidate index before the edit
+        self.assertEqual(worker.stdout.readline().strip(), 'ready', worker.stderr.read() if worker.poll() else '')
+
+        treatment, condition = self.treatments[0], self.conditions[3]
+        treatment.conditions.add(condition)
+        output, errors = worker.communicate('\n', timeout=120)
+
+        self.assertEqual(worker.returncode, 0, errors)
+        self.assertIn(f'update treatment {treatment.pk}: done', output)
+        self.assertFalse(TrainingJob.objects.filter(treatment=treatment, status='failed').exists())
+        patients = UserHealth.objects.filter(conditions=condition).values_list('user_id', flat=True)
+        self.assertEqual(
+            set(Recommendation.objects.filter(treatment=treatment, condition=condition).values_list('user_id', flat=True)),
+            set(patients),
+        )
@@ -0,0 +1,76 @@
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.cache import caches
+from django.test import override_settings
+from accounts.models import CustomUser
+from portal import services
+from portal.candidates import candidate_index
+from portal.jobs import claim_due_jobs, process_jobs
+from portal.models import MedicalCondition, Treatment, UserHealth, Recommendation
+from portal.services import get_recommender
+
+# Per-process caches, so tests neither see nor clear the shared ones of a running server
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'tests-{alias}'}
+    for alias in settings.CACHES
+}
+
+
+def create_catalog(conditions=6, treatments=8):
+    """Conditions and treatments; treatment ``i`` is for conditions ``i`` and ``i + 1``"""
+    conditions = [
+        MedicalCondition.objects.create(name=f'Condition {i}', description='d') for i in range(conditions)
+    ]
+    created = []
+    for i in range(treatments):
+        treatment = Treatment.objects.create(name=f'Treatment {i}', description='d', effectiveness_score=(i + 1) / 10)
+        treatment.conditions.set([conditions[i % len(conditions)], conditions[(i + 1) % len(conditions)]])
+        created.append(treatment)
+    return conditions, created
+
+
+def create_patient(username, conditions, age=40, **fields):
+    user = CustomUser.objects.create(username=username, email=f'{username}@example.com', **fields)
+    health = UserHealth.objects.create(user=user, age=age, height=170, weight=70)
+    health.conditions.set(conditions)
+    return user
+
+
+def stored_scores(user_ids=None):
+    """{(user_id, treatment_id, condition_id): score} of the stored recommendations"""
+    recommendations = Recommendation.objects.all()
+    if user_ids is not None:
+        recommendations = recommendations.filter(user_id__in=user_ids)
+    return {
+        (user_id, treatment_id, condition_id): score
+        for user_id, treatment_id, condition_id, score in recommendations.values_list(
+            'user_id', 'treatment_id', 'condition_id', 'score'
+        )
+    }
+
+
+class RecommenderTestMixin:
+    """Gives each test its own model directory, recommender and empty caches"""
+
+    def setUp(self):
+        super().setUp()
+        self.model_dir = tempfile.mkdtemp()
+        settings_override = override_settings(RECOMMENDER_MODEL_DIR=self.model_dir, CACHES=TEST_CACHES)
+        settings_override.enable()
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.model_dir, ignore_errors=True)
+        services._recommender = None
+        self.addCleanup(setattr, services, '_recommender', None)
+        candidate_index.invalidate()
+        self.addCleanup(candidate_index.invalidate)
+
+    def drain_jobs(self):
+        return process_jobs(claim_due_jobs(debounce=0))
+
+    def store_all(self):
+        """Score and store every user against the current model, as compute_recommendations does"""
+        user_ids = list(UserHealth.objects.values_list('user_id', flat=True))
+        Recommendation.objects.replace_for_users(get_recommender().score_users(user_ids), user_ids)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('', views.home_view, name='portal_home'),
@@ -8,4 +8,9 @@ urlpatterns = [
     path('recommendations/', views.recommendations_view, name='recommendations'),
     path('api/update-conditions/', views.update_conditions, name='update_conditions'),
     path('api/recommendations/', views.api_recommendations, name='api_recommendations'),
+    path('api/panel-recommendations/', views.api_panel_recommendations, name='api_panel_recommendations'),
+    path('api/recommendation-cache/', views.recommendation_cache_stats, name='recommendation_cache_stats'),
+    # Async variants, for running under an ASGI server
+    path('async/dashboard/', async_views.dashboard_view, name='portal_dashboard_async'),
+    path('async/api/recommendations/', async_views.api_recommendations, name='api_recommendations_async'),
 ]
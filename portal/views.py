@@ -1,12 +1,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from .models import UserHealth, MedicalCondition, Treatment, Recommendation
-from .recommender import recommender
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from accounts.models import CustomUser
+from .models import UserHealth, MedicalCondition, Treatment, Recommendation, DashboardSnapshot
+from .services import get_recommender
+from .jobs import enqueue_training
+from .cache import recommendation_cache
+from . import metrics
 from .forms import UserHealthForm
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_POST
+import base64
+import hashlib
 import json
-import os
+from itertools import islice
 
 def home_view(request):
     """Home page view"""
@@ -15,20 +22,8 @@ def home_view(request):
 @login_required
 def dashboard_view(request):
     """User dashboard view"""
-    # Get or create user health profile
-    health_profile, created = UserHealth.objects.get_or_create(user=request.user)
-
-    # Get recommendations
-    recommendations = Recommendation.objects.filter(user=request.user).order_by('-score')[:5]
-
-    # Get all medical conditions
-    conditions = MedicalCondition.objects.all()
-
-    context = {
-        'health_profile': health_profile,
-        'recommendations': recommendations,
-        'conditions': conditions,
-    }
+    # Profile and top recommendations, kept up to date on writes
+    context = DashboardSnapshot.objects.for_user(request.user)
 
     return render(request, 'portal/dashboard.html', context)
 
@@ -40,9 +35,8 @@ def health_profile_view(request):
     if request.method == 'POST':
         form = UserHealthForm(request.POST, instance=health_profile)
         if form.is_valid():
+            # Saving queues a rescore of this user for the recommender worker
             form.save()
-            # Retrain the recommender system
-            recommender.train()
             return redirect('dashboard')
     else:
         form = UserHealthForm(instance=health_profile)
@@ -52,13 +46,7 @@ def health_profile_view(request):
 @login_required
 def recommendations_view(request):
     """View all recommendations"""
-    # Temporary fix for Render free tier memory limitations
-    if os.environ.get('RENDER_EXTERNAL_HOSTNAME'):
-        # Return empty recommendations for now
-        recommendations = []
-    else:
-        # Only run recommender locally
-        recommendations = recommender.get_recommendations(request.user.id, top_n=10)
+    recommendations = recommendation_cache.get_or_compute(request.user.id, 10, get_recommender())
 
     return render(request, 'portal/recommendations.html', {
         'recommendations': recommendations
@@ -83,17 +71,39 @@ def update_conditions(request):
             condition = get_object_or_404(MedicalCondition, id=condition_id)
             health_profile.conditions.add(condition)
 
-        # Retrain the recommender system
-        recommender.train()
-
         return JsonResponse({'status': 'success'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
-@login_required
-def api_recommendations(request):
-    """API endpoint for recommendations"""
-    recommendations = recommender.get_recommendations(request.user.id, top_n=5)
+# Page size of the recommendations API
+API_DEFAULT_LIMIT = 5
+API_MAX_LIMIT = 50
+
+def _encode_cursor(rec):
+    return base64.urlsafe_b64encode(json.dumps([rec.score, rec.id]).encode()).decode()
+
+def _decode_cursor(cursor):
+    score, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return float(score), int(pk)
+
+def _page_params(request):
+    """(limit, after, error response) of a recommendations page request"""
+    try:
+        limit = int(request.GET.get('limit', API_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= API_MAX_LIMIT:
+        return None, None, JsonResponse({'status': 'error', 'message': f'limit must be between 1 and {API_MAX_LIMIT}'}, status=400)
+    try:
+        after = _decode_cursor(request.GET['cursor']) if 'cursor' in request.GET else None
+    except (ValueError, TypeError):
+        return None, None, JsonResponse({'status': 'error', 'message': 'invalid cursor'}, status=400)
+    return limit, after, None
+
+def _page_response(recommendations, limit):
+    """JSON page of ``limit`` recommendations, given up to one more to detect a next page"""
+    recommendations = list(recommendations)
+    next_cursor = _encode_cursor(recommendations[limit - 1]) if len(recommendations) > limit else None
 
     # Convert to JSON-serializable format
     data = [{
@@ -103,6 +113,136 @@ def api_recommendations(request):
         'condition_name': rec.condition.name,
         'score': rec.score,
         'created_at': rec.created_at.isoformat()
-    } for rec in recommendations]
+    } for rec in recommendations[:limit]]
+
+    return JsonResponse({'recommendations': data, 'next_cursor': next_cursor})
+
+def _recommendations_validators(request):
+    # Shared by the ETag and Last-Modified functions of one request
+    if not hasattr(request, '_recommendations_validators'):
+        request._recommendations_validators = recommendation_cache.validators(request.user.id, get_recommender())
+    return request._recommendations_validators
+
+def _recommendations_etag(request):
+    tag, last_modified = _recommendations_validators(request)
+    # Each page and page size is a different representation
+    return hashlib.sha1(f'{tag}?{request.GET.urlencode()}'.encode()).hexdigest()
 
-    return JsonResponse({'recommendations': data})
+def _recommendations_last_modified(request):
+    tag, last_modified = _recommendations_validators(request)
+    return last_modified
+
+@login_required
+@condition(etag_func=_recommendations_etag, last_modified_func=_recommendations_last_modified)
+def api_recommendations(request):
+    """API endpoint for recommendations
+
+    Pages with ``?limit=`` and the ``next_cursor`` of the previous page in
+    ``?cursor=``. Responses carry an ETag and Last-Modified, so polling
+    clients get 304 Not Modified until the profile, catalog or model change.
+    """
+    limit, after, error = _page_params(request)
+    if error:
+        return error
+
+    # One extra row tells whether there is a next page
+    if after is None:
+        recommendations = recommendation_cache.get_or_compute(request.user.id, limit + 1, get_recommender())
+    else:
+        # Later pages read what the first page stored, without scoring
+        recommendations = Recommendation.objects.page_for_user(request.user.id, limit + 1, after)
+    return _page_response(recommendations, limit)
+
+# Patients read and scored per block by the panel endpoint
+PANEL_BLOCK_SIZE = 500
+
+def _panel_lines(patient_ids, limit):
+    """NDJSON lines of the top ``limit`` recommendations of each patient, block by block"""
+    recommender = get_recommender()
+    while True:
+        block = list(islice(patient_ids, PANEL_BLOCK_SIZE))
+        if not block:
+            return
+
+        # A treatment for several of a patient's conditions is listed once, under its best score
+        best = {user_id: {} for user_id in block}
+        for user_id, treatment_id, condition_id, score in recommender.score_users(block):
+            entry = best[user_id].get(treatment_id)
+            if entry is None or score > entry[0]:
+                best[user_id][treatment_id] = (score, treatment_id, condition_id)
+        by_user = {user_id: sorted(entries.values(), reverse=True)[:limit] for user_id, entries in best.items()}
+
+        # Names of just the treatments and conditions in this block
+        treatment_ids = {t for entries in by_user.values() for _, t, _ in entries}
+        condition_ids = {c for entries in by_user.values() for _, _, c in entries}
+        treatment_names = dict(Treatment.objects.filter(id__in=treatment_ids).values_list('id', 'name'))
+        condition_names = dict(MedicalCondition.objects.filter(id__in=condition_ids).values_list('id', 'name'))
+
+        for user_id, entries in by_user.items():
+            yield json.dumps({
+                'user_id': user_id,
+                'recommendations': [{
+                    'treatment_id': treatment_id,
+                    'treatment_name': treatment_names.get(treatment_id),
+                    'condition_id': condition_id,
+                    'condition_name': condition_names.get(condition_id),
+                    'score': score,
+                } for score, treatment_id, condition_id in entries],
+            }) + '\n'
+
+@login_required
+def api_panel_recommendations(request):
+    """Stream recommendations for many patients as NDJSON, one line per patient (doctors only)
+
+    Patients can be narrowed with ``?condition=`` (repeatable), ``?min_id=``
+    and ``?max_id=``; ``?limit=`` sets the recommendations per patient.
+    Patients are read and scored in blocks, so memory stays flat however
+    large the panel is.
+    """
+    if request.user.user_type != CustomUser.DOCTOR:
+        return JsonResponse({'status': 'error', 'message': 'Only doctors can access patient panels'}, status=403)
+
+    try:
+        limit = int(request.GET.get('limit', API_DEFAULT_LIMIT))
+        condition_ids = [int(c) for c in request.GET.getlist('condition')]
+        min_id = int(request.GET['min_id']) if 'min_id' in request.GET else None
+        max_id = int(request.GET['max_id']) if 'max_id' in request.GET else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'invalid parameter'}, status=400)
+    if not 1 <= limit <= API_MAX_LIMIT:
+        return JsonResponse({'status': 'error', 'message': f'limit must be between 1 and {API_MAX_LIMIT}'}, status=400)
+
+    recommender = get_recommender()
+    recommender.refresh()
+    if recommender.similarity_matrix is None:
+        enqueue_training()
+        return JsonResponse({'status': 'error', 'message': 'Recommendations are not ready yet'}, status=503)
+
+    patients = UserHealth.objects.filter(user__user_type=CustomUser.PATIENT).order_by('user_id')
+    if condition_ids:
+        patients = patients.filter(conditions__in=condition_ids).distinct()
+    if min_id is not None:
+        patients = patients.filter(user_id__gte=min_id)
+    if max_id is not None:
+        patients = patients.filter(user_id__lte=max_id)
+    patient_ids = patients.values_list('user_id', flat=True).iterator(chunk_size=PANEL_BLOCK_SIZE)
+
+    return StreamingHttpResponse(_panel_lines(patient_ids, limit), content_type='application/x-ndjson')
+
+@staff_member_required
+def recommendation_cache_stats(request):
+    """Hit/miss counters of the recommendation cache, for sizing it"""
+    return JsonResponse(recommendation_cache.stats())
+
+@staff_member_required
+def metrics_view(request):
+    """Request and recommender metrics of all workers in Prometheus text format"""
+    cache_stats = recommendation_cache.stats()
+    counters = [
+        ('portal_recommendation_cache_hits_total', 'Recommendation cache hits', cache_stats['hits']),
+        ('portal_recommendation_cache_misses_total', 'Recommendation cache misses', cache_stats['misses']),
+    ]
+    return HttpResponse(
+        metrics.to_prometheus(metrics.registry.collect(), counters),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,37 @@
+#!/usr/bin/env bash
+# Start gunicorn and the recommender worker side by side. They share the
+# model directory and the file-based caches on local disk, so they run in
+# one service rather than as separate ones.
+
+# Restart the worker whenever it exits, until the service stops
+(
+  stopping=
+  worker=
+  trap 'stopping=1; kill -TERM "$worker" 2>/dev/null' TERM INT
+  while [ -z "$stopping" ]; do
+    python manage.py recommender_worker &
+    worker=$!
+    wait "$worker"
+    status=$?
+    if [ -n "$stopping" ]; then
+      # Let it finish the current batch
+      wait "$worker"
+      break
+    fi
+    echo "recommender worker exited with status $status, restarting in 5s" >&2
+    sleep 5
+  done
+) &
+supervisor=$!
+
+gunicorn -c gunicorn_config.py "$@" &
+web=$!
+trap 'kill -TERM "$web" "$supervisor" 2>/dev/null' TERM INT
+
+# The service lives as long as the web server, and exits with its status
+wait "$web"
+kill -TERM "$supervisor" 2>/dev/null
+wait "$web"
+status=$?
+wait "$supervisor"
+exit "$status"